@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# replay scripted scenarios against the daemon loop, running on a synthetic
+# release area, and measure how long their effects take to be published
+#
+# the daemon loop runs in a thread, with local stand-ins for everything outside
+# calm: mail is delivered to a backend which just counts it, setup.ini is
+# signed with test/fake-gpg, irk notifications are recorded, repology data
+# comes from a pre-written cache, uploaded homepages aren't checked for
+# redirects, and the scallywag database is in the work directory.
+#
+# each step of a scenario (an upload, an automated build deploy, a vault
+# request or an untest) is timed from when it's complete (e.g. when the !ready
+# file is written) until a setup.ini showing its effect is published.
+#
+# scenarios are generated from a seed, and can be saved and replayed.
+#
+# e.g. python3 -m benchmarks.loadsim --scenario concurrent --packages 5000
+#      python3 -m benchmarks.loadsim --scenario mixed --save steps.json
+#      python3 -m benchmarks.loadsim --script steps.json --quiet-period 5
+#
+
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import types
+from unittest import mock
+
+import calm.calm
+from calm import common_constants
+from calm import db
+from calm import fixes
+from calm import irk
+from calm import mailqueue
+from calm import metrics
+from calm import repology
+from calm import scallywag_db
+from calm import sign
+from calm import untest
+from calm import utils
+from calm import vault
+
+from . import synthetic
+
+FAKE_GPG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test', 'fake-gpg')
+
+# scenario name -> list of (operation, number of steps, seconds they are spread over)
+SCENARIOS = {
+    'concurrent': [('upload', 10, 20)],
+    'rebuild': [('deploy', 50, 2)],
+    'vault': [('vault', 10, 5)],
+    'untest': [('untest', 10, 2)],
+    'mixed': [('upload', 10, 30), ('deploy', 20, 30), ('vault', 5, 30), ('untest', 5, 30)],
+}
+
+# how long to wait for the effects of the script, after the last step
+SETTLE_TIMEOUT = 300
+# how long to wait for the daemon loop to stop (which it does after finishing
+# any cycle in progress)
+STOP_TIMEOUT = 300
+
+
+#
+# choose the source packages operated on, and the versions involved
+#
+def _candidates(catalogue, op):
+    if op in ['upload', 'deploy']:
+        # (new versions are uploaded as a single package, so only choose
+        # sources which are)
+        return [s for s in catalogue if s.kind == 'single' and not s.test]
+    elif op == 'vault':
+        return [s for s in catalogue if len(s.versions) >= 2]
+    elif op == 'untest':
+        return [s for s in catalogue if s.test]
+    return []
+
+
+#
+# generate the steps of a scenario: a list of dicts with the time (relative to
+# the start of the script), operation, source package and version
+#
+# uploads are spread across as many maintainers as possible, and no source
+# package is chosen for more than one step
+#
+def script(catalogue, scenario, seed=0):
+    rng = random.Random(seed)
+    used = set()
+    steps = []
+    n = 0
+
+    for (op, count, spread) in SCENARIOS[scenario]:
+        by_maint = {}
+        for s in _candidates(catalogue, op):
+            if s.name not in used:
+                by_maint.setdefault(s.maintainer, []).append(s)
+
+        maints = sorted(by_maint)
+        rng.shuffle(maints)
+
+        for i in range(count):
+            maints = [m for m in maints if by_maint[m]]
+            if not maints:
+                logging.warning("only %d source packages suitable for %s" % (i, op))
+                break
+
+            choices = by_maint[maints[i % len(maints)]]
+            s = choices.pop(rng.randrange(len(choices)))
+            used.add(s.name)
+
+            if op in ['upload', 'deploy']:
+                n += 1
+                v = '9.%d-1' % n
+            elif op == 'vault':
+                v = s.versions[0]
+            else:
+                v = s.versions[-1]
+
+            steps.append({'t': round(rng.uniform(0, spread), 3), 'op': op, 'source': s.name, 'version': v})
+
+    return sorted(steps, key=lambda s: s['t'])
+
+
+#
+# a mail backend which just counts the messages delivered
+#
+class _CountingBackend(object):
+    def __init__(self):
+        self.delivered = 0
+
+    def open(self):
+        pass
+
+    def send(self, envelope_from, msg):
+        self.delivered += 1
+
+    def close(self):
+        pass
+
+
+#
+# the timing of a step, which is done when check() is true after a setup.ini is
+# published
+#
+class _Item(object):
+    def __init__(self, step, start, check):
+        self.op = step['op']
+        self.desc = '%s %s-%s' % (step['op'], step['source'], step['version'])
+        self.start = start
+        self.check = check
+        self.end = None
+
+
+class Simulation(object):
+    def __init__(self, workdir, packages, seed=0, quiet_period=2, max_delay=10, watch='tree', verbose=0):
+        self.workdir = workdir
+        self.items = []
+        self.notifications = []
+        self.lock = threading.Lock()
+        self.published = threading.Event()
+        self._test_sources = None
+        self.thread = None
+        self.stop = threading.Event()
+        self.stack = contextlib.ExitStack()
+        self.jobs = 0
+        self.start = None
+
+        args = types.SimpleNamespace()
+        args.rel_area = os.path.join(workdir, 'relarea')
+        args.homedir = os.path.join(workdir, 'home')
+        args.stagingdir = os.path.join(workdir, 'staging')
+        args.htdocs = os.path.join(workdir, 'htdocs', 'packages')
+        args.vault = os.path.join(workdir, 'vault')
+        args.setupdir = os.path.join(workdir, 'setup')
+        args.repodir = os.path.join(workdir, 'repodir')
+        args.logdir = os.path.join(workdir, 'logs')
+        args.pkglist = os.path.join(workdir, 'cygwin-pkg-maint')
+        args.compress_threads = 1
+        args.dryrun = False
+        args.email = ['leads@example.org']
+        args.force = 0
+        args.jobs = 1
+        args.keys = ['KEYID']
+        args.keygrips = []
+        args.max_delay = max_delay
+        args.quiet_period = quiet_period
+        args.release = 'synthetic'
+        args.reports = True
+        args.rsyncable = False
+        args.stale = True
+        args.verbose = verbose
+        args.watch = watch
+        self.args = args
+
+        for d in [args.homedir, args.stagingdir, args.htdocs, args.vault, args.setupdir, args.repodir, args.logdir]:
+            os.makedirs(d, exist_ok=True)
+
+        # log as the daemon does
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        calm.calm.logging_setup(args)
+        self.handlers = [h for h in root.handlers if h not in handlers]
+
+        logging.warning('generating release area with %d packages' % packages)
+        result = synthetic.generate(args.rel_area, args.pkglist, packages, seed)
+        self.catalogue = result.catalogue
+        self.sources = {s.name: s for s in self.catalogue}
+
+        for n in range(synthetic.MAINTAINERS):
+            m = os.path.join(args.homedir, 'Maintainer %d' % n)
+            os.makedirs(m, exist_ok=True)
+            with open(os.path.join(m, '!email'), 'w') as f:
+                print('maintainer%d@example.org' % n, file=f)
+
+        # repology thinks there's a newer upstream version of some packages
+        repology.write_cache(repology.cache_file(args),
+                             {s.name: repology.RepologyData([s.versions[-1].split('-')[0] if i % 3 else '99.0'], s.name)
+                              for i, s in enumerate(self.catalogue)})
+
+        self.scallywag_db = os.path.join(workdir, 'carpetbag.db')
+        with contextlib.closing(sqlite3.connect(self.scallywag_db)) as conn:
+            conn.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY, user TEXT, status TEXT, tokens TEXT, announce TEXT)')
+            conn.commit()
+
+    def __enter__(self):
+        args = self.args
+        s = self.stack
+
+        db.reset_db()
+
+        self.mail = _CountingBackend()
+        mailqueue.configure(os.path.join(self.workdir, 'mailqueue'), self.mail)
+        s.callback(mailqueue.configure, None)
+
+        s.enter_context(mock.patch.object(irk, 'irk', self._irk))
+        s.enter_context(mock.patch.object(sign, 'sign', functools.partial(sign.sign, gpg=FAKE_GPG)))
+        s.enter_context(mock.patch.object(scallywag_db, 'dbfile', self.scallywag_db))
+        s.enter_context(mock.patch.object(db, '_uploads_allowed_default', True))
+        s.enter_context(mock.patch.object(fixes, 'follow_redirect', lambda homepage: homepage))
+        # for the vault and untest tools
+        s.enter_context(mock.patch.object(common_constants, 'FTP', args.rel_area))
+        s.enter_context(mock.patch.object(common_constants, 'HTDOCS', os.path.dirname(args.htdocs)))
+        s.enter_context(mock.patch.object(common_constants, 'PKGMAINT', args.pkglist))
+        s.enter_context(mock.patch.dict(os.environ))
+
+        state = calm.calm.CalmState()
+        state.args = args
+        state.subject = 'calm: load simulation'
+
+        self.thread = threading.Thread(target=calm.calm.daemon_loop, args=(args, state, self.stop), name='daemon', daemon=True)
+        self.thread.start()
+
+        # wait for the initial processing cycle to complete
+        while not os.path.exists(self._history()):
+            if not self.thread.is_alive():
+                raise RuntimeError('daemon loop exited')
+            time.sleep(0.1)
+
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join(STOP_TIMEOUT)
+        if self.thread.is_alive():
+            logging.error('daemon loop did not stop within %d seconds' % STOP_TIMEOUT)
+        if mailqueue.queue():
+            mailqueue.queue().drain(10)
+        self.stack.close()
+
+        for h in self.handlers:
+            logging.getLogger().removeHandler(h)
+            h.close()
+
+    def _history(self):
+        return os.path.join(self.args.htdocs, metrics.HISTORY_FILE)
+
+    #
+    # irk stand-in: record the notification, and when setup.ini has been
+    # published, check which items are done
+    #
+    def _irk(self, message, target=irk.DEFAULT_TARGET):
+        now = time.time()
+        self.notifications.append((now, message))
+
+        if message.startswith('calm updated setup.ini'):
+            self._test_sources = None
+            with self.lock:
+                for i in self.items:
+                    if i.end is None and i.check():
+                        i.end = now
+            self.published.set()
+
+    # the source tarballs of test versions in the published setup.ini
+    def test_sources(self):
+        if self._test_sources is None:
+            self._test_sources = set()
+            test = False
+            with open(os.path.join(self.args.rel_area, synthetic.ARCH, 'setup.ini')) as f:
+                for l in f:
+                    if l.startswith('@ ') or l.startswith('['):
+                        test = (l.strip() == '[test]')
+                    elif test and l.startswith('source: '):
+                        self._test_sources.add(os.path.basename(l.split()[1]))
+        return self._test_sources
+
+    def _tarball(self, step):
+        s = self.sources[step['source']]
+        return os.path.join(self.args.rel_area, s.path, '%s-%s-src.tar.xz' % (s.name, step['version']))
+
+    def _ready(self, d, step):
+        s = self.sources[step['source']]
+        synthetic.write_version(d, s.path, s.name, step['version'])
+        utils.touch(os.path.join(d, s.path, '!ready'))
+
+    #
+    # perform a step
+    #
+    def do(self, step):
+        s = self.sources[step['source']]
+        tarball = self._tarball(step)
+
+        if step['op'] in ['upload', 'deploy']:
+            def check():
+                return os.path.exists(tarball)
+        elif step['op'] == 'vault':
+            def check():
+                return not os.path.exists(tarball)
+        else:
+            def check():
+                return os.path.basename(tarball) not in self.test_sources()
+
+        if step['op'] == 'upload':
+            d = os.path.join(self.args.homedir, s.maintainer)
+            self._ready(d, step)
+            start = time.time()
+            utils.touch(os.path.join(d, '.sftp-session-close'))
+        elif step['op'] == 'deploy':
+            self.jobs += 1
+            self._ready(os.path.join(self.args.stagingdir, str(self.jobs), s.maintainer), step)
+            start = time.time()
+            with contextlib.closing(sqlite3.connect(self.scallywag_db)) as conn:
+                conn.execute("INSERT INTO jobs VALUES (?, ?, 'deploying', '', '')", (self.jobs, s.maintainer))
+                conn.commit()
+            utils.touch(os.path.join(self.args.stagingdir, '.touch'))
+        else:
+            os.environ['CYGNAME'] = s.maintainer
+            pvr = '%s-%s' % (s.name, step['version'])
+            if step['op'] == 'vault':
+                vault.vault(pvr)
+                utils.touch(os.path.join(self.args.rel_area, synthetic.ARCH, '.touch'))
+            else:
+                untest.untest(pvr)
+            start = time.time()
+
+        with self.lock:
+            self.items.append(_Item(step, start, check))
+
+    #
+    # replay the steps of a script, and wait (for up to timeout seconds after
+    # the last step) until all of them have been published
+    #
+    def run(self, steps, timeout=SETTLE_TIMEOUT):
+        self.start = start = time.time()
+        for step in steps:
+            delay = start + step['t'] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.do(step)
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if all(i.end is not None for i in self.items):
+                    break
+            if not self.thread.is_alive():
+                break
+            self.published.wait(1)
+            self.published.clear()
+
+    #
+    # summarize the latencies of the steps, and the cycles which processed them
+    #
+    # (this should be used after the simulation has stopped, so the history
+    # includes the cycle which was in progress)
+    #
+    def results(self):
+        start = self.start
+        r = {'steps': len(self.items)}
+
+        for op in [None] + sorted(set(i.op for i in self.items)):
+            items = [i for i in self.items if op is None or i.op == op]
+            latencies = sorted(i.end - i.start for i in items if i.end is not None)
+            d = {'steps': len(items), 'done': len(latencies)}
+            if latencies:
+                d.update({'median': statistics.median(latencies),
+                          'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                          'max': latencies[-1]})
+            r[op or 'all'] = d
+
+        done = [i.end for i in self.items if i.end is not None]
+        elapsed = (max(done) - start) if done else 0
+        r['elapsed'] = elapsed
+        r['throughput'] = len(done) / elapsed if elapsed else 0
+        r['incomplete'] = [i.desc for i in self.items if i.end is None]
+
+        cycles = []
+        with open(self._history()) as f:
+            for l in f:
+                c = json.loads(l)
+                if c['time'] >= int(start):
+                    cycles.append(c['wall'])
+        r['cycles'] = {'count': len(cycles), 'median': statistics.median(cycles) if cycles else 0, 'max': max(cycles, default=0)}
+        r['notifications'] = len(self.notifications)
+        r['mail'] = self.mail.delivered
+
+        return r
+
+
+def report(r):
+    lines = []
+    for op in ['all'] + sorted(k for k in r if isinstance(r[k], dict) and 'done' in r[k] and k != 'all'):
+        d = r[op]
+        line = '%-8s %4d steps, %4d done' % (op, d['steps'], d['done'])
+        if d['done']:
+            line += ', latency median %7.2fs p95 %7.2fs max %7.2fs' % (d['median'], d['p95'], d['max'])
+        lines.append(line)
+
+    lines.append('%.2f steps/s over %.1fs, %d cycles (median %.2fs, max %.2fs), %d notifications, %d mails' %
+                 (r['throughput'], r['elapsed'], r['cycles']['count'], r['cycles']['median'], r['cycles']['max'], r['notifications'], r['mail']))
+    for i in r['incomplete']:
+        lines.append('not published: %s' % i)
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay scenarios against the calm daemon on a synthetic release area')
+    parser.add_argument('--json', action='store', metavar='FILE', help="save results to FILE")
+    parser.add_argument('--max-delay', action='store', type=int, metavar='SECONDS', help="daemon --max-delay (default: 10)", default=10)
+    parser.add_argument('--packages', action='store', type=int, metavar='N', help="number of packages (default: 1000)", default=1000)
+    parser.add_argument('--quiet-period', action='store', type=int, metavar='SECONDS', help="daemon --quiet-period (default: 2)", default=2)
+    parser.add_argument('--save', action='store', metavar='FILE', help="save the script replayed to FILE")
+    parser.add_argument('--scenario', action='store', choices=sorted(SCENARIOS), help="scenario to generate a script for (default: mixed)", default='mixed')
+    parser.add_argument('--script', action='store', metavar='FILE', help="replay the script in FILE (for the same --packages and --seed), rather than generating one")
+    parser.add_argument('--seed', action='store', type=int, metavar='N', help="random seed (default: 0)", default=0)
+    parser.add_argument('--timeout', action='store', type=int, metavar='SECONDS', help="how long to wait for steps to be published after the last one (default: %d)" % SETTLE_TIMEOUT, default=SETTLE_TIMEOUT)
+    parser.add_argument('--watch', action='store', choices=['tree', 'light'], help="daemon --watch (default: tree)", default='tree')
+    parser.add_argument('--workdir', action='store', metavar='DIR', help="work in DIR, which is kept afterwards (default: a temporary directory)")
+    parser.add_argument('-v', '--verbose', action='count', dest='verbose', help='verbose output')
+    (args) = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        if os.path.exists(workdir) and os.listdir(workdir):
+            parser.error('%s is not empty' % workdir)
+
+        sim = Simulation(workdir, args.packages, args.seed, args.quiet_period, args.max_delay, args.watch, args.verbose)
+
+        if args.script:
+            with open(args.script) as f:
+                steps = [json.loads(l) for l in f]
+        else:
+            steps = script(sim.catalogue, args.scenario, args.seed)
+
+        if args.save:
+            with open(args.save, 'w') as f:
+                for s in steps:
+                    print(json.dumps(s), file=f)
+
+        with sim:
+            sim.run(steps, args.timeout)
+        results = sim.results()
+
+    print(report(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if results['incomplete'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
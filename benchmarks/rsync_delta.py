@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# how much data rsync transfers to update a mirror from one generation of
+# setup.ini and its compressed variants to the next
+#
+# given a series of setup.ini files (e.g. from a history of them), in order,
+# each is compressed in each way, and either:
+#
+# - rsync's delta-transfer algorithm is modelled for each consecutive pair, to
+#   estimate the transfer, or
+#
+# - with --rsync, each is published in calm's on-disk layout, and a mirror of
+#   that is updated after each generation by actually running rsync, and the
+#   bytes it reports transferring for each file are measured.
+#
+# e.g. python3 -m benchmarks.rsync_delta --rsync setup.ini.1 setup.ini.2 setup.ini.3
+#
+
+import argparse
+import collections
+import hashlib
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from calm import compress
+from calm import publish
+
+# variants: (description, extension, rsyncable)
+VARIANTS = [
+    ('bz2', '.bz2', False),
+    ('xz', '.xz', False),
+    ('zst', '.zst', False),
+    ('zst --rsyncable', '.zst', True),
+]
+
+# the bytes sent per block in the block checksums, and per matched block in the
+# delta (roughly)
+CHECKSUM_BYTES = 4 + 16
+TOKEN_BYTES = 4
+
+
+# the block size rsync chooses for a file of a given length
+def block_size(length):
+    if length <= 700 * 700:
+        return 700
+
+    return min(131072, (int(math.sqrt(length)) // 8) * 8)
+
+
+# rsync's weak rolling checksum of a block
+def weak_checksum(block):
+    a = sum(block) & 0xffff
+    b = sum((len(block) - i) * c for i, c in enumerate(block)) & 0xffff
+    return a, b
+
+
+#
+# return an estimate of the bytes rsync transfers to turn old into new
+#
+def rsync_delta(old, new):
+    bs = block_size(len(old))
+
+    # the receiver sends checksums of each complete block of old
+    blocks = {}
+    for offset in range(0, len(old) - bs + 1, bs):
+        block = old[offset:offset + bs]
+        blocks.setdefault(weak_checksum(block), {})[hashlib.md5(block).digest()] = offset
+
+    sent = CHECKSUM_BYTES * (len(old) // bs)
+
+    # the sender looks for those blocks at every offset in new, sending literal
+    # data where there's no match
+    literal = 0
+    i = 0
+    a, b = weak_checksum(new[0:bs])
+    while i + bs <= len(new):
+        candidates = blocks.get((a, b))
+        if candidates and hashlib.md5(new[i:i + bs]).digest() in candidates:
+            sent += TOKEN_BYTES
+            i += bs
+            a, b = weak_checksum(new[i:i + bs])
+            continue
+
+        # roll the checksum forward one byte
+        out = new[i]
+        a = (a - out + (new[i + bs] if i + bs < len(new) else 0)) & 0xffff
+        b = (b - bs * out + a) & 0xffff
+        literal += 1
+        i += 1
+
+    literal += len(new) - i
+
+    return sent + literal
+
+
+def _report(desc, size, delta):
+    print('  %-16s %10d bytes, rsync transfers %10d bytes (%5.1f%%)' % (desc, size, delta, 100.0 * delta / size))
+
+
+#
+# estimate the transfer for each generation after the first, yielding the
+# setup.ini filename and a dict of description -> (size, estimated transfer)
+#
+def estimate(inifiles):
+    previous = None
+
+    for fn in inifiles:
+        with open(fn, 'rb') as f:
+            data = f.read()
+
+        current = {}
+        for (desc, ext, rsyncable) in VARIANTS:
+            current[desc] = compress.COMPRESSORS[ext](data, 1, rsyncable)
+
+        if previous:
+            yield fn, {desc: (len(current[desc]), rsync_delta(previous[desc], current[desc])) for (desc, _, _) in VARIANTS}
+
+        previous = current
+
+
+#
+# run rsync to update mirror from src, returning a dict of the bytes it
+# transferred for each file (by path relative to src)
+#
+# (--no-whole-file is needed, since rsync otherwise doesn't use the
+# delta-transfer algorithm when both sides are local)
+#
+def rsync(src, mirror, copy_links=False, rsync_cmd='rsync'):
+    cmd = [rsync_cmd, '-a', '--no-whole-file', '--delete', '--out-format=%n %b']
+    if copy_links:
+        cmd.append('--copy-links')
+    cmd.extend([src + '/', mirror + '/'])
+
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+
+    transferred = {}
+    for l in output.splitlines():
+        m = re.match(r'^(.*) (\d+)$', l)
+        if m:
+            transferred[m.group(1)] = int(m.group(2))
+
+    return transferred
+
+
+#
+# measure the transfer for each generation after the first, by publishing each
+# one in calm's layout and mirroring it with rsync, yielding the setup.ini
+# filename and a dict of description -> (size, bytes transferred)
+#
+# (when the mirror copies symlinks, each slot is updated from the generation
+# before the previous one, which is what it has at that path)
+#
+def measure(inifiles, copy_links=False, rsync_cmd='rsync'):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # a release area and a mirror of it, for each choice of rsyncable
+        trees = {}
+        for rsyncable in [False, True]:
+            src = os.path.join(tmpdir, 'rsyncable' if rsyncable else 'default', 'x86_64')
+            mirror = os.path.join(tmpdir, 'mirror-rsyncable' if rsyncable else 'mirror-default')
+            os.makedirs(src)
+            os.makedirs(mirror)
+            trees[rsyncable] = (src, mirror)
+
+        files = ['setup' + ext for ext in ['.ini'] + compress.EXTENSIONS]
+
+        for i, fn in enumerate(inifiles):
+            with open(fn, 'rb') as f:
+                data = f.read()
+
+            # publish this generation, and update the mirror
+            transferred = {}
+            for rsyncable, (src, mirror) in trees.items():
+                staging = publish.new_generation(src)
+                shutil.copyfile(fn, os.path.join(staging, 'setup.ini'))
+                compress.compress(data, os.path.join(staging, 'setup'), 1, rsyncable)
+                publish.publish(src, staging, files)
+                transferred[rsyncable] = rsync(src, mirror, copy_links, rsync_cmd)
+
+            result = {}
+            for (desc, ext, rsyncable) in [('ini', '.ini', False)] + VARIANTS:
+                # (the bytes transferred at every path the file appears at in
+                # the mirror are counted: that's just the file in the slot if
+                # symlinks are copied, but also the setup.* file and the copy
+                # under .setup/current/ if they are followed)
+                sent = sum(n for path, n in transferred[rsyncable].items() if os.path.basename(path) == 'setup' + ext)
+                size = os.path.getsize(os.path.join(trees[rsyncable][0], 'setup' + ext))
+                result[desc] = (size, sent)
+
+            # the first generation populates the mirror (or, if the mirror
+            # copies symlinks, the first generation in each slot)
+            if i >= (1 if copy_links else len(publish.SLOTS)):
+                yield fn, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='rsync transfer size between generations of setup.ini and its compressed variants')
+    parser.add_argument('--copy-links', action='store_true', help="with --rsync, mirror as rsync --copy-links does, following the setup.* symlinks")
+    parser.add_argument('--rsync', action='store_true', help="measure by publishing each generation and running rsync, rather than estimating")
+    parser.add_argument('--rsync-cmd', action='store', metavar='CMD', help="rsync command (default: rsync)", default='rsync')
+    parser.add_argument('inifiles', nargs='+', metavar='INIFILE', help="setup.ini files, oldest first")
+    (args) = parser.parse_args()
+
+    if len(args.inifiles) < 2:
+        parser.error('need at least two generations of setup.ini')
+
+    if args.rsync and not args.copy_links and len(args.inifiles) < len(publish.SLOTS) + 1:
+        parser.error('need at least %d generations of setup.ini, to populate each slot in the mirror first' % (len(publish.SLOTS) + 1))
+
+    if args.rsync:
+        if not shutil.which(args.rsync_cmd):
+            parser.error("%s not found" % args.rsync_cmd)
+        generations = measure(args.inifiles, args.copy_links, args.rsync_cmd)
+    else:
+        generations = estimate(args.inifiles)
+
+    totals = collections.OrderedDict()
+    for fn, result in generations:
+        print('%s:' % fn)
+        for desc, (size, delta) in result.items():
+            t = totals.setdefault(desc, [0, 0])
+            t[0] += size
+            t[1] += delta
+            _report(desc, size, delta)
+
+    print('total:')
+    for desc, (size, delta) in totals.items():
+        _report(desc, size, delta)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# time the main stages of processing on synthetic release areas of various
+# scales
+#
+# each benchmark has an (untimed) setup, run before each of its timed
+# repetitions. The minimum and median times are reported, and can be saved,
+# and compared with previously saved results to find regressions.
+#
+# e.g. python3 -m benchmarks.suite --scale 1000,10000 --json results.json
+#      python3 -m benchmarks.suite --scale 1000,10000 --compare results.json
+#
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+from calm import db
+from calm import package
+from calm import pkg2html
+from calm import reports
+
+from . import synthetic
+
+DEFAULT_SCALES = [1000, 10000, 50000]
+
+
+def _read(ctx):
+    return package.read_packages(ctx.args.rel_area)[0]
+
+
+def _validated(ctx):
+    packages = _read(ctx)
+    package.validate_packages(ctx.args, packages)
+    return packages
+
+
+def _merge_setup(ctx):
+    upload, _ = package.read_packages(ctx.upload)
+    return (_read(ctx), upload)
+
+
+# (these generate into an empty htdocs directory, i.e. from scratch)
+def _fresh_htdocs(ctx):
+    shutil.rmtree(ctx.args.htdocs, ignore_errors=True)
+    os.makedirs(ctx.args.htdocs)
+    db.reset_db()
+    return _validated(ctx)
+
+
+def _write_setup_ini(ctx, packages):
+    package.write_setup_ini(ctx.args, packages, synthetic.ARCH)
+
+
+def _write_repo_json(ctx, packages):
+    with open(os.path.join(ctx.workdir, 'packages.json'), 'w') as f:
+        package.write_repo_json(ctx.args, packages, f)
+
+
+# (name, setup, timed function)
+BENCHMARKS = [
+    ('read_packages', lambda ctx: None, lambda ctx, _: _read(ctx)),
+    ('validate_packages', _read, lambda ctx, packages: package.validate_packages(ctx.args, packages)),
+    ('merge', _merge_setup, lambda ctx, d: package.merge(*d)),
+    ('stale_packages', _validated, lambda ctx, packages: package.stale_packages(packages, [])),
+    ('write_setup_ini', _validated, _write_setup_ini),
+    ('write_repo_json', _validated, _write_repo_json),
+    ('do_reports', _fresh_htdocs, lambda ctx, packages: reports.do_reports(ctx.args, packages)),
+    ('update_package_listings', _fresh_htdocs, lambda ctx, packages: pkg2html.update_package_listings(ctx.args, packages)),
+]
+
+
+#
+# generate (or reuse, if already present in workdir) the release area for a
+# scale, returning the context the benchmarks run in
+#
+def context(workdir, scale):
+    d = os.path.join(workdir, str(scale))
+    rel_area = os.path.join(d, 'relarea')
+    upload = os.path.join(d, 'upload')
+    pkglist = os.path.join(d, 'cygwin-pkg-maint')
+
+    if not os.path.exists(pkglist):
+        shutil.rmtree(d, ignore_errors=True)
+        logging.warning('generating release area with %d packages' % scale)
+        synthetic.generate(upload, None, scale, update=True)
+        synthetic.generate(rel_area, pkglist, scale)
+
+    args = types.SimpleNamespace()
+    args.rel_area = rel_area
+    args.pkglist = pkglist
+    args.htdocs = os.path.join(d, 'htdocs')
+    args.homedir = os.path.join(d, 'homes')
+    args.repodir = os.path.join(d, 'repodir')
+    args.inifile = os.path.join(d, 'setup.ini')
+    args.arch = synthetic.ARCH
+    args.release = 'synthetic'
+    args.setup_version = '2.999'
+    args.dryrun = False
+    args.force = 0
+    args.jobs = 1
+
+    for p in [args.htdocs, args.homedir, args.repodir]:
+        os.makedirs(p, exist_ok=True)
+
+    for n in range(synthetic.MAINTAINERS):
+        m = os.path.join(args.homedir, 'Maintainer %d' % n)
+        os.makedirs(m, exist_ok=True)
+        with open(os.path.join(m, '!email'), 'w') as f:
+            print('maintainer%d@example.org' % n, file=f)
+
+    db.reset_db()
+
+    return types.SimpleNamespace(args=args, upload=upload, workdir=d)
+
+
+def run(ctx, setup, func, repeat):
+    times = []
+    for _i in range(repeat):
+        data = setup(ctx)
+        start = time.perf_counter()
+        func(ctx, data)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark processing of synthetic release areas')
+    parser.add_argument('--scale', action='store', metavar='N[,N]', help="numbers of packages (default: %s)" % ','.join(str(s) for s in DEFAULT_SCALES), default=','.join(str(s) for s in DEFAULT_SCALES))
+    parser.add_argument('--benchmark', action='append', metavar='NAME', choices=[b[0] for b in BENCHMARKS], help="run only NAME (may be repeated)")
+    parser.add_argument('--repeat', action='store', type=int, metavar='N', help="timed repetitions of each benchmark (default: 3)", default=3)
+    parser.add_argument('--workdir', action='store', metavar='DIR', help="keep generated release areas in DIR, and reuse them (default: a temporary directory)")
+    parser.add_argument('--json', action='store', metavar='FILE', help="save results to FILE")
+    parser.add_argument('--compare', action='store', metavar='FILE', help="compare results with those previously saved in FILE")
+    parser.add_argument('--threshold', action='store', type=float, metavar='RATIO', help="report a regression when slower than the compared result by RATIO (default: 1.25)", default=1.25)
+    (args) = parser.parse_args()
+
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+    # processing synthetic packages shouldn't produce any warnings or errors
+    # worth seeing, but if it does, they are reported once
+    logging.getLogger().addFilter(_OnceFilter())
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        results = {}
+        regressions = 0
+
+        for scale in [int(s) for s in args.scale.split(',')]:
+            ctx = context(workdir, scale)
+            results[str(scale)] = {}
+
+            for (name, setup, func) in BENCHMARKS:
+                if args.benchmark and name not in args.benchmark:
+                    continue
+
+                times = run(ctx, setup, func, args.repeat)
+                r = {'min': min(times), 'median': statistics.median(times), 'times': times}
+                results[str(scale)][name] = r
+
+                line = '%6d %-24s min %8.3fs median %8.3fs' % (scale, name, r['min'], r['median'])
+                previous = baseline.get(str(scale), {}).get(name)
+                if previous:
+                    ratio = r['min'] / previous['min']
+                    line += ' (%.2fx)' % ratio
+                    if ratio > args.threshold:
+                        line += ' REGRESSION'
+                        regressions += 1
+                print(line, flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+class _OnceFilter(logging.Filter):
+    def __init__(self):
+        super().__init__()
+        self.seen = set()
+
+    def filter(self, record):
+        if record.msg in self.seen:
+            return False
+        self.seen.add(record.msg)
+        return True
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# generate a synthetic release area, of a given scale
+#
+# the packages generated are a realistic mixture of: single package sources,
+# libraries (with soversion runtime and -devel subpackages, some of which have
+# had soversion bumps), noarch packages with -doc subpackages, test versions,
+# and packages made obsolete by others. Each has a few versions (older versions
+# being given older mtimes), tiny-but-valid tarballs, hints and sha512.sum
+# files, and requires: on packages generated before it.
+#
+# e.g. python3 -m benchmarks.synthetic --packages 10000 /tmp/relarea /tmp/cygwin-pkg-maint
+#
+
+import argparse
+import hashlib
+import io
+import lzma
+import os
+import random
+import sys
+import tarfile
+import time
+import types
+
+ARCH = 'x86_64'
+CATEGORIES = ['Base', 'Devel', 'Doc', 'Graphics', 'Libs', 'Net', 'Perl', 'Python', 'Text', 'Utils', 'X11']
+MAINTAINERS = 20
+YEAR = 365.25 * 24 * 60 * 60
+
+
+def _tarball(members):
+    b = io.BytesIO()
+    with tarfile.open(fileobj=b, mode='w') as t:
+        for name, data in members:
+            ti = tarfile.TarInfo(name)
+            ti.size = len(data)
+            ti.mtime = 0
+            t.addfile(ti, io.BytesIO(data))
+    return lzma.compress(b.getvalue())
+
+
+# the same (tiny) tarball contents are used for every package
+TARBALLS = {
+    'install': _tarball([('usr/bin/synthetic', b'#!/bin/sh\n'), ('usr/share/doc/synthetic/README', b'synthetic\n')]),
+    'source': _tarball([('synthetic.cygport', b'NAME=synthetic\n')]),
+    'empty': _tarball([]),
+}
+DIGESTS = {k: hashlib.sha512(v).hexdigest() for k, v in TARBALLS.items()}
+
+
+class _Writer(object):
+    def __init__(self, rel_area, now, sums=True):
+        self.rel_area = rel_area
+        self.now = now
+        self.sums = sums
+        self.count = 0
+        self.names = set()
+
+    # write the tarball and hint for a version of a package, into path
+    # (relative to the release area)
+    def write(self, path, pn, v, hints, tarball='install', age=0):
+        d = os.path.join(self.rel_area, path)
+        os.makedirs(d, exist_ok=True)
+
+        source = tarball == 'source'
+        base = '%s-%s%s' % (pn, v, '-src' if source else '')
+        tf = os.path.join(d, base + '.tar.xz')
+        with open(tf, 'wb') as f:
+            f.write(TARBALLS[tarball])
+
+        with open(os.path.join(d, base + '.hint'), 'w') as f:
+            for k, val in hints.items():
+                if val is None:
+                    print('%s:' % k, file=f)
+                else:
+                    print('%s: %s' % (k, val), file=f)
+
+        if self.sums:
+            with open(os.path.join(d, 'sha512.sum'), 'a') as f:
+                print('%s  %s' % (DIGESTS[tarball], os.path.basename(tf)), file=f)
+
+        mtime = self.now - age
+        for fn in [tf, os.path.join(d, base + '.hint')]:
+            os.utime(fn, (mtime, mtime))
+
+        key = pn + ('-src' if source else '')
+        if key not in self.names:
+            self.names.add(key)
+            self.count += 1
+
+
+#
+# generate a release area with (approximately) count packages in rel_area, and a
+# package maintainer list for it in pkglist, returning the numbers of source
+# packages and packages generated, and a catalogue describing each source
+# package
+#
+# if update is True, instead generate only a new version of every 100th source
+# package (e.g. as an upload to merge with the release area generated with the
+# same count and seed)
+#
+def generate(rel_area, pkglist, count, seed=0, update=False):
+    rng = random.Random(seed)
+    w = _Writer(rel_area, time.time())
+    runtimes = []
+    sources = []
+    catalogue = []
+    i = 0
+
+    while w.count < count:
+        name = 'pkg%05d' % i
+        kind = rng.choice(['single'] * 4 + ['library'] * 4 + ['noarch'] * 2)
+        nversions = rng.randint(1, 3)
+        test = rng.random() < 0.1
+        obsoletes = rng.random() < 0.05 and not update
+        category = rng.choice(CATEGORIES)
+        requires = ' '.join(sorted(set(rng.sample(runtimes, min(len(runtimes), rng.randint(0, 3))))))
+        selected = not update or (i % 100 == 0)
+        sources.append(name)
+        i += 1
+
+        versions = ['1.%d-1' % n for n in range(nversions)]
+        if test:
+            versions.append('2.0-1')
+        if update:
+            versions = ['9.0-1']
+
+        arch = 'noarch' if kind == 'noarch' else ARCH
+        srcdir = os.path.join(arch, 'release', name)
+        # (some libraries have only runtime and -devel packages)
+        has_main = not (kind == 'library' and i % 2)
+        catalogue.append(types.SimpleNamespace(name=name, kind=kind, path=srcdir, versions=versions, test=test,
+                                               maintainer='Maintainer %d' % ((i - 1) % MAINTAINERS)))
+        # the package which obsoletes the -compat package
+        replacement = name if has_main else name + '-devel'
+
+        for n, v in enumerate(versions):
+            if not selected:
+                break
+
+            age = (len(versions) - n) * YEAR
+            common = {'category': category}
+            if test and v == '2.0-1':
+                common['test'] = None
+            obsoleting = {'obsoletes': name + '-compat'} if obsoletes and n == len(versions) - 1 else {}
+
+            sdesc = '"Synthetic package %s"' % name
+            w.write(srcdir, name, v, dict(common, sdesc=sdesc[:-1] + ' (source)"'), 'source', age)
+
+            main_requires = requires
+            if kind == 'library':
+                # soversion bumped at 1.2
+                so = 1 if v >= '1.2' else 0
+                lib = 'lib%s_%d' % (name, so)
+                w.write(os.path.join(srcdir, lib), lib, v, dict(common, sdesc=sdesc[:-1] + ' (runtime)"', requires=requires, **{'external-source': name}), age=age)
+                devel = dict(common, sdesc=sdesc[:-1] + ' (development)"', requires=lib, **{'external-source': name})
+                if replacement != name:
+                    devel.update(obsoleting)
+                w.write(os.path.join(srcdir, name + '-devel'), name + '-devel', v, devel, age=age)
+                main_requires = lib
+
+            if has_main:
+                w.write(srcdir, name, v, dict(common, sdesc=sdesc, requires=main_requires, **obsoleting), age=age)
+
+            if kind == 'noarch':
+                w.write(os.path.join(srcdir, name + '-doc'), name + '-doc', v, dict(common, sdesc=sdesc[:-1] + ' (documentation)"', **{'external-source': name}), age=age)
+
+            # an old package made obsolete by the current version of another
+            if obsoletes and n == 0:
+                w.write(os.path.join(srcdir, name + '-compat'), name + '-compat', v, dict(common, category='_obsolete', sdesc=sdesc[:-1] + ' (obsolete)"', requires=replacement, **{'external-source': name}), 'empty', age)
+
+        # later packages can depend on this one
+        if kind == 'single':
+            runtimes.append(name)
+        elif kind == 'library':
+            runtimes.append('lib%s_%d' % (name, 1 if nversions > 2 else 0))
+
+        # (when generating an update, count the packages which would have
+        # been generated, so the same ones are chosen)
+        if not selected:
+            w.count += {'single': 2, 'library': 3 + (i + 1) % 2, 'noarch': 3}[kind]
+
+    if not update:
+        with open(pkglist, 'w') as f:
+            for n, s in enumerate(sources):
+                print('%-45s Maintainer %d' % (s, n % MAINTAINERS), file=f)
+
+    return types.SimpleNamespace(sources=len(sources), packages=w.count, catalogue=catalogue)
+
+
+#
+# write an upload of version v of a single package source (e.g. one described
+# in the catalogue returned by generate()) into path, relative to directory
+# (e.g. a maintainer's upload directory), with the files given mtimes just
+# before now
+#
+def write_version(directory, path, name, v, now=None):
+    w = _Writer(directory, now or time.time(), sums=False)
+    sdesc = '"Synthetic package %s"' % name
+    w.write(path, name, v, {'category': 'Utils', 'sdesc': sdesc[:-1] + ' (source)"', 'homepage': 'https://example.org/%s' % name}, 'source', 1)
+    w.write(path, name, v, {'category': 'Utils', 'sdesc': sdesc}, age=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic release area')
+    parser.add_argument('--packages', action='store', type=int, metavar='N', help="number of packages (default: 1000)", default=1000)
+    parser.add_argument('--seed', action='store', type=int, metavar='N', help="random seed (default: 0)", default=0)
+    parser.add_argument('--update', action='store_true', help="generate new versions of some packages, rather than a release area")
+    parser.add_argument('relarea', metavar='RELAREA', help="release area directory to create")
+    parser.add_argument('pkglist', metavar='PKGLIST', help="package maintainer list to create")
+    (args) = parser.parse_args()
+
+    if os.path.exists(args.relarea):
+        parser.error('%s already exists' % args.relarea)
+
+    result = generate(args.relarea, args.pkglist, args.packages, args.seed, args.update)
+    print('generated %d packages from %d source packages' % (result.packages, result.sources))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,20 +22,102 @@
 #
 
 import logging
+import os
+import pickle
+import tempfile
+from collections import namedtuple
 from logging.handlers import BufferingHandler
 
+# how many records are held in memory, before further records are written to a
+# temporary file
+SPILL_THRESHOLD = 10000
+
+# what we keep in memory about every record, so they can be selected without
+# reading them back
+RecordSummary = namedtuple('RecordSummary', ['levelno', 'maint', 'package'])
+
 
 # Loosely based on the "Buffering logging messages and outputting them
 # conditionally" example from the python logging cookbook.
 #
 # AbeyanceHandler holds log output in a BufferingHandler.  When closed, it will
 # pass all log output of retainLevel or higher to the callback.
-
+#
+# To bound memory use, only the first capacity records are kept in memory,
+# later ones are pickled to a temporary file. A summary of every record is kept
+# in summaries, and records() is used to retrieve the records themselves.
+#
 class AbeyanceHandler(BufferingHandler):
-    def __init__(self, callback, retainLevel):
+    def __init__(self, callback, retainLevel, capacity=None):
         BufferingHandler.__init__(self, capacity=0)
         self.callback = callback
         self.setLevel(retainLevel)
+        self.memory_capacity = capacity if capacity is not None else SPILL_THRESHOLD
+        self.summaries = []
+        self._spill = None
+        self._offsets = []
+
+    def emit(self, record):
+        summary = RecordSummary(record.levelno, getattr(record, 'maint', None), getattr(record, 'package', None))
+
+        if len(self.buffer) < self.memory_capacity:
+            self.buffer.append(record)
+        else:
+            try:
+                data = pickle.dumps(self._prepare(record))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                self.handleError(record)
+                return
+
+            # (handle() already holds the lock when calling emit(), but be
+            # explicit, since records() moves the file position as well)
+            self.acquire()
+            try:
+                if self._spill is None:
+                    self._spill = tempfile.TemporaryFile(prefix='calm-log-')
+
+                self._spill.seek(0, os.SEEK_END)
+                self._offsets.append(self._spill.tell())
+                self._spill.write(data)
+            finally:
+                self.release()
+
+        self.summaries.append(summary)
+
+    # make a record picklable, by merging args into the message and formatting
+    # any exception information (as QueueHandler does)
+    @staticmethod
+    def _prepare(record):
+        d = dict(record.__dict__)
+        d['msg'] = record.getMessage()
+        d['args'] = None
+        if record.exc_info:
+            if not record.exc_text:
+                d['exc_text'] = logging.Formatter().formatException(record.exc_info)
+            d['exc_info'] = None
+        d.pop('message', None)
+        return d
+
+    # the records with the given indices into summaries (default all), in that
+    # order
+    def records(self, indices=None):
+        if indices is None:
+            indices = range(len(self.summaries))
+
+        n = len(self.buffer)
+        for i in indices:
+            if i < n:
+                yield self.buffer[i]
+            else:
+                # hold the lock between seeking and reading, so a record
+                # emitted by another thread can't move the file position
+                self.acquire()
+                try:
+                    self._spill.seek(self._offsets[i - n])
+                    d = pickle.load(self._spill)
+                finally:
+                    self.release()
+                yield logging.makeLogRecord(d)
 
     def shouldFlush(self, record):
         # the capacity we pass to BufferingHandler is irrelevant since we
@@ -49,6 +131,12 @@ class AbeyanceHandler(BufferingHandler):
         # discard the buffers contents
         super().close()
 
+        self.summaries = []
+        self._offsets = []
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
     def __enter__(self):
         logging.getLogger().addHandler(self)
         return self
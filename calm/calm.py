@@ -62,26 +62,40 @@ import signal
 import sys
 import tempfile
 import time
-from enum import Flag, auto, unique
 
 import xtarfile
 
 from . import common_constants
+from . import compress
 from . import db
+from . import dirtree
 from . import irk
 from . import logfilters
+from . import mailqueue
 from . import maintainers
+from . import metrics
 from . import package
 from . import pkg2html
+from . import profiling
+from . import publish
 from . import repology
 from . import reports
 from . import scallywag_db
 from . import setup_exe
+from . import sign
 from . import uploads
 from . import utils
 from .abeyance_handler import AbeyanceHandler
 from .buffering_smtp_handler import BufferingSMTPHandler
 from .movelist import MoveList
+from .scheduler import Event, MAX_DELAY, QUIET_PERIOD, Scheduler
+
+# how long we wait for queued mail to be delivered before exiting
+MAILQUEUE_DRAIN_TIMEOUT = 60
+# how often the daemon checks if the scheduler has actions due
+POLL_INTERVAL = 1
+# how often the release area is checked for changes, when not watching it
+RELAREA_SCAN_INTERVAL = 30
 
 
 #
@@ -94,6 +108,9 @@ class CalmState(object):
         self.packages = {}
         self.valid_provides = set()
         self.missing_obsolete = {}
+        self.ini_digests = {}
+        self.repo_json_cache = {}
+        self.reports_cache = {}
 
 
 #
@@ -101,17 +118,25 @@ class CalmState(object):
 #
 
 def process_relarea(args, state):
+    with metrics.phase('process_relarea'):
+        return _process_relarea(args, state)
+
+
+def _process_relarea(args, state):
     error = False
 
     # read the package set
     logging.debug("reading existing packages")
-    packages, _ = package.read_packages(args.rel_area)
+    with metrics.phase('read_packages'), profiling.profile('read'):
+        packages, _ = package.read_packages(args.rel_area)
 
     state.valid_provides = db.update_package_names(args, packages)
     state.missing_obsolete = db.update_missing_obsolete(args, packages)
 
     # validate the package set
-    if not package.validate_packages(args, packages, state.valid_provides, state.missing_obsolete):
+    with metrics.phase('validate_packages'), profiling.profile('validate'):
+        valid = package.validate_packages(args, packages, state.valid_provides, state.missing_obsolete)
+    if not valid:
         logging.error("existing package set has errors")
         error = True
 
@@ -122,7 +147,8 @@ def process_relarea(args, state):
     # area, or vault requests, so first check here if there are any stale
     # packages to vault
     if args.stale:
-        packages = remove_stale_packages(args, packages, state)
+        with metrics.phase('stale'), profiling.profile('stale'):
+            packages = remove_stale_packages(args, packages, state)
         if packages is None:
             logging.error("error while evaluating stale packages")
             return None
@@ -139,30 +165,43 @@ def process_relarea(args, state):
 #
 
 
-def process_uploads(args, state):
+#
+# if only is not None, it's a set of the maintainers whose homedirs are checked
+# for uploads (otherwise all maintainers' homedirs are)
+#
+def process_uploads(args, state, only=None):
     # read maintainer list
     mlist = maintainers.maintainer_list(args)
 
     # make the list of all packages
     all_packages = maintainers.all_packages(args.pkglist)
 
+    # the maintainers whose uploads have been processed
+    processed = set()
+
     # for each maintainer
     for name in sorted(mlist.keys()):
+        if only is not None and name not in only:
+            continue
+
         m = mlist[name]
+        processed.add(name)
 
-        with logfilters.AttrFilter(maint=m.name):
+        with logfilters.AttrFilter(maint=m.name), metrics.phase('upload/%s' % m.name):
             process_maintainer_uploads(args, state, all_packages, m, args.homedir, 'upload')
 
     # for each deploy job
     def deploy_upload(r):
         m = mlist[r.user]
-        with logfilters.AttrFilter(maint=m.name):
+        processed.add(r.user)
+        with logfilters.AttrFilter(maint=m.name), metrics.phase('upload/%s' % m.name):
             return process_maintainer_uploads(args, state, all_packages, m, os.path.join(args.stagingdir, str(r.id)), 'staging', scrub=True, record=r)
 
     scallywag_db.do_deploys(deploy_upload)
 
-    # record updated reminder times for maintainers
-    maintainers.update_reminder_times(mlist)
+    # record updated reminder times for maintainers (only those processed, as
+    # we don't know if the others still need reminding)
+    maintainers.update_reminder_times({n: mlist[n] for n in processed})
 
     return state.packages
 
@@ -206,6 +245,7 @@ def process_maintainer_uploads(args, state, all_packages, m, basedir, desc, scru
     return success
 
 
+@metrics.subsystem('announce_upload')
 def _announce_upload(args, scan_result, maintainer, r):
     announce = ('announce' in r.tokens) and ('noannounce' not in r.tokens)
 
@@ -273,6 +313,8 @@ def _announce_upload(args, scan_result, maintainer, r):
 
                     break
 
+            metrics.archive_io(a, tf)
+
     # TODO: maybe other mechanisms for getting package ChangeLog?
     # NEWS inside upstream source tarball?
 
@@ -560,10 +602,94 @@ def is_passphrase_cached(args):
     return passphrase_cached == set(args.keygrips)
 
 
+#
+# the digest of the currently published setup.ini
+#
+# this is remembered when we publish it, so we don't need to re-read it, unless
+# it appears to have been changed by something else since then
+#
+def published_ini_digest(state, inifile):
+    st = os.stat(inifile)
+    (digest, mtime, size) = state.ini_digests.get(inifile, (None, None, None))
+
+    if (st.st_mtime_ns != mtime) or (st.st_size != size):
+        logging.debug('computing digest of %s' % (inifile))
+        digest = package.setup_ini_digest(inifile)
+        state.ini_digests[inifile] = (digest, st.st_mtime_ns, st.st_size)
+
+    return digest
+
+
+def remember_ini_digest(state, inifile, digest):
+    st = os.stat(inifile)
+    state.ini_digests[inifile] = (digest, st.st_mtime_ns, st.st_size)
+
+
 #
 #
 #
 def do_output(args, state):
+    with profiling.profile('output'):
+        update_json = write_setup_and_json(args, state)
+
+    # write reports
+    if (update_json or args.force) and args.reports:
+        with metrics.phase('reports'), profiling.profile('reports'):
+            reports.do_reports(args, state.packages, state.reports_cache)
+
+    # update packages listings
+    # XXX: perhaps we need a --[no]listing command line option to disable this from being run?
+    with metrics.phase('update_package_listings'), profiling.profile('listings'):
+        pkg2html.update_package_listings(args, state.packages)
+
+    # if we are daemonized, allow force regeneration of static content in htdocs
+    # initially (in case the generation code has changed), but update that
+    # static content only as needed on subsequent loops
+    args.force = 0
+
+
+#
+# build all the files which make up a new generation of setup.ini in a staging
+# directory, then publish them all at once
+#
+# if any of them couldn't be made, the staging directory is discarded and the
+# current generation is kept, and False is returned
+#
+def publish_setup_ini(args, basedir, inifile):
+    staging = publish.new_generation(basedir)
+    logging.info("moving %s to %s" % (inifile, staging))
+    shutil.move(inifile, os.path.join(staging, 'setup.ini'))
+
+    # compress
+    with open(os.path.join(staging, 'setup.ini'), 'rb') as f:
+        data = f.read()
+    with metrics.phase('compress'):
+        compressed = compress.compress(data, os.path.join(staging, 'setup'), args.compress_threads, args.rsyncable)
+
+    if not compressed:
+        logging.error("compressing setup.ini in %s failed, not publishing it" % (basedir))
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+
+    # sign
+    extensions = ['.ini'] + compress.EXTENSIONS
+    with metrics.phase('sign'):
+        failed = sign.sign([os.path.join(staging, 'setup' + ext) for ext in extensions], args.keys)
+
+    if failed:
+        logging.error("signing %s failed, not publishing setup.ini in %s" % (', '.join(os.path.basename(f) for f in failed), basedir))
+        shutil.rmtree(staging, ignore_errors=True)
+        return False
+
+    publish.publish(basedir, staging, [f for ext in extensions for f in ['setup' + ext, 'setup' + ext + '.sig']])
+    return True
+
+
+#
+# write setup.ini (and the files derived from it) for each arch, and
+# packages.json, returning True if they changed
+#
+def write_setup_and_json(args, state):
     update_json = False
 
     # for each arch
@@ -584,7 +710,8 @@ def do_output(args, state):
             changed = False
 
             # write setup.ini
-            package.write_setup_ini(args, state.packages, arch)
+            with metrics.phase('write_setup_ini'):
+                digest = package.write_setup_ini(args, state.packages, arch)
 
             # make it world-readable, if we can
             try:
@@ -598,9 +725,9 @@ def do_output(args, state):
                 changed = True
             else:
                 # or, if it's changed in more than timestamp and comments
-                status = os.system('/usr/bin/diff -I^setup-timestamp -I^# -w -B -q %s %s >/dev/null' % (inifile, tmpfile.name))
-                logging.debug('diff exit status %d' % (status))
-                if (status >> 8) == 1:
+                current_digest = published_ini_digest(state, inifile)
+                logging.debug('setup.ini digest %s, published %s' % (digest, current_digest))
+                if digest != current_digest:
                     changed = True
 
             # then update setup.ini
@@ -610,40 +737,14 @@ def do_output(args, state):
             elif not is_passphrase_cached(args):
                 logging.debug("removing %s, cannot sign" % (tmpfile.name))
                 os.remove(tmpfile.name)
-            else:
+            elif args.dryrun:
                 update_json = True
-
-                if args.dryrun:
-                    logging.warning("not moving %s to %s, due to --dry-run" % (tmpfile.name, inifile))
-                    os.remove(tmpfile.name)
-                else:
-                    # make a backup of the current setup.ini
-                    if os.path.exists(inifile):
-                        shutil.copy2(inifile, inifile + '.bak')
-
-                    # replace setup.ini
-                    logging.info("moving %s to %s" % (tmpfile.name, inifile))
-                    shutil.move(tmpfile.name, inifile)
-                    irk.irk("calm updated setup.ini for arch '%s'" % (arch))
-
-                    # compress and re-sign
-                    extensions = ['.ini', '.bz2', '.xz', '.zst']
-                    for ext in extensions:
-                        extfile = os.path.join(basedir, 'setup' + ext)
-                        try:
-                            os.remove(extfile + '.sig')
-                        except FileNotFoundError:
-                            pass
-
-                        if ext == '.bz2':
-                            utils.system('/usr/bin/bzip2 <%s >%s' % (inifile, extfile))
-                        elif ext == '.xz':
-                            utils.system('/usr/bin/xz -6e <%s >%s' % (inifile, extfile))
-                        elif ext == '.zst':
-                            utils.system('/usr/bin/zstd -q -f --ultra -20 %s -o %s' % (inifile, extfile))
-
-                        keys = ' '.join(['-u' + k for k in args.keys])
-                        utils.system('/usr/bin/gpg ' + keys + ' --batch --yes -b ' + extfile)
+                logging.warning("not moving %s to %s, due to --dry-run" % (tmpfile.name, inifile))
+                os.remove(tmpfile.name)
+            elif publish_setup_ini(args, basedir, tmpfile.name):
+                update_json = True
+                remember_ini_digest(state, inifile, digest)
+                irk.irk("calm updated setup.ini for arch '%s'" % (arch))
 
     # update a marker file indicating when repository was updated
     # (for the benefit of quickly checking if mirrors are up to date)
@@ -658,8 +759,8 @@ def do_output(args, state):
     if update_json or not os.path.exists(jsonfile):
         with tempfile.NamedTemporaryFile(mode='wb', delete=False) as tmpfile:
             logging.debug('writing %s' % (tmpfile.name))
-            with lzma.open(tmpfile, 'wt') as lzf:
-                package.write_repo_json(args, state.packages, lzf)
+            with lzma.open(tmpfile, 'wt') as lzf, metrics.phase('write_repo_json'):
+                package.write_repo_json(args, state.packages, lzf, state.repo_json_cache)
         logging.info("moving %s to %s" % (tmpfile.name, jsonfile))
         shutil.move(tmpfile.name, jsonfile)
 
@@ -669,37 +770,162 @@ def do_output(args, state):
         except (OSError):
             pass
 
-    # write reports
-    if (update_json or args.force) and args.reports:
-        reports.do_reports(args, state.packages)
+    return update_json
 
-    # update packages listings
-    # XXX: perhaps we need a --[no]listing command line option to disable this from being run?
-    pkg2html.update_package_listings(args, state.packages)
 
-    # if we are daemonized, allow force regeneration of static content in htdocs
-    # initially (in case the generation code has changed), but update that
-    # static content only as needed on subsequent loops
-    args.force = 0
+#
+# daemonization loop
+#
+
+#
+# the directories watched when not watching the whole of the relarea, upload
+# and staging directories: the upload directory and each maintainer's homedir
+# within it, the staging directory, and the directories in the relarea (for
+# per-arch .touch triggers)
+#
+def watched_dirs(args):
+    dirs = [args.homedir, args.stagingdir]
+
+    for top in [args.homedir, args.rel_area]:
+        for e in sorted(os.listdir(top)):
+            d = os.path.join(top, e)
+            if os.path.isdir(d):
+                dirs.append(d)
+
+    return dirs
 
 
 #
-# daemonization loop
+# the body of the daemon: process everything, and then repeatedly wait for
+# events which need processing, and process them
+#
+# (this runs until stop is set, if given, otherwise forever)
 #
+def daemon_loop(args, state, stop=None):
+    import inotify.adapters
+
+    logging.getLogger('inotify.adapters').propagate = False
+
+    scheduler = Scheduler(args, args.quiet_period, args.max_delay)
+    # do all actions initially
+    scheduler.schedule(Event.read_uploads | Event.read_relarea)
+    saw_events = False
 
-@unique
-class Event(Flag):
-    read_uploads = auto()
-    read_relarea = auto()
+    state.packages = {}
+
+    mask = inotify.constants.IN_CREATE | inotify.constants.IN_DELETE | inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_ATTRIB | inotify.constants.IN_MOVED_TO
+    relarea_tree = None
+
+    if args.watch == 'tree':
+        # watch for changes in relarea, upload and staging directories
+        i = inotify.adapters.InotifyTrees([args.rel_area, args.homedir, args.stagingdir],
+                                          mask=mask,
+                                          block_duration_s=POLL_INTERVAL)
+    else:
+        # watch only the directories where triggers appear (so the number
+        # of watches doesn't grow with the size of the release area), and
+        # periodically look for changes in the release area by comparing
+        # directory mtimes
+        i = inotify.adapters.Inotify(block_duration_s=POLL_INTERVAL)
+        dirs = watched_dirs(args)
+        for d in dirs:
+            i.add_watch(d, mask)
+
+        relarea_tree = dirtree.scan(args.rel_area, exclude=[publish.GENERATIONS_DIR])
+        relarea_scan_time = time.time()
+        logging.debug("watching %d directories, release area has %d directories" % (len(dirs), len(relarea_tree)))
+
+    while stop is None or not stop.is_set():
+        (action, maints, paths) = scheduler.take()
+        if action:
+            metrics.start()
+            profiling.start_cycle()
+            with mail_logs(state):
+                if Event.read_relarea in action:
+                    if saw_events:
+                        irk.irk("calm processing release area")
+                    state.packages = process_relarea(args, state)
+
+                if not state.packages:
+                    logging.error("errors in relarea, not processing uploads or writing setup.ini")
+                else:
+                    if Event.read_uploads in action:
+                        if saw_events:
+                            irk.irk("calm processing uploads")
+                        state.packages = process_uploads(args, state, maints)
+
+                    do_output(args, state)
+
+                if saw_events:
+                    irk.irk("calm processing done")
+
+        # we wake at a 10 minute offset from the next 240 minute boundary
+        # (i.e. at :10 past every fourth hour) to check the state of the
+        # release area, in case someone has ninja-ed in a change there...
+        interval = 240 * 60
+        offset = 10 * 60
+        delay = interval - ((time.time() - offset) % interval)
+        next_scan_time = time.time() + delay
+
+        if action:
+            m = metrics.finish(args)
+            logging.info("next rescan in %d seconds, %s" % (delay, m.summary()))
+            logging.debug("I/O by subsystem: %s" % (m.io_summary()))
+
+        saw_events = False
+
+        # wait until the scheduler decides accumulated actions are due
+        # (event_gen() yields None every POLL_INTERVAL seconds when
+        # there are no events, so we can check that)
+        while not scheduler.due():
+            try:
+                for event in i.event_gen(yield_nones=True):
+                    if event is not None:
+                        logging.debug("inotify event %s" % str(event))
+                        saw_events = True
+                        scheduler.add(event)
+
+                        # watch any newly created maintainer homedir
+                        (_, type_names, path, filename) = event
+                        if relarea_tree is not None and path == args.homedir and 'IN_ISDIR' in type_names and 'IN_CREATE' in type_names:
+                            i.add_watch(os.path.join(path, filename), mask)
+                        continue
+
+                    if stop is not None and stop.is_set():
+                        return
+
+                    if relarea_tree is not None and time.time() >= relarea_scan_time + RELAREA_SCAN_INTERVAL:
+                        new_tree = dirtree.scan(args.rel_area, exclude=[publish.GENERATIONS_DIR])
+                        relarea_scan_time = time.time()
+                        changes = dirtree.changed(relarea_tree, new_tree)
+                        relarea_tree = new_tree
+                        if changes:
+                            logging.debug("release area changes in %s" % ', '.join(sorted(changes)))
+                            if scheduler.add_relarea_changes(changes):
+                                saw_events = True
+
+                    if scheduler.due():
+                        break
+                    elif not scheduler.pending() and time.time() > next_scan_time:
+                        logging.debug("scheduled rescan")
+                        scheduler.schedule(Event.read_uploads | Event.read_relarea)
+                        break
+            except inotify.calls.InotifyError:
+                # can occur if a just created directory is (re)moved before
+                # we set a watch on it
+                pass
+
+        logging.info("woken, actions %s, after %d events" % (scheduler.action, scheduler.events))
+        if scheduler.maintainers:
+            logging.info("uploads from maintainers %s" % ', '.join(sorted(scheduler.maintainers)))
+        if scheduler.paths:
+            logging.debug("changes in %s" % ', '.join(sorted(scheduler.paths)))
 
 
 def do_daemon(args, state):
     import daemon
-    import inotify.adapters
     import pidlockfile
 
-    logging.getLogger('inotify.adapters').propagate = False
-
     def getLogFileDescriptors(logger):
         """Get a list of fds from logger"""
         handles = []
@@ -716,110 +942,32 @@ def do_daemon(args, state):
         umask=0o002,
         pidfile=pidlockfile.PIDLockFile(args.daemon))
 
-    # XXX: running flag isn't actually doing anything anymore so can be removed
-    running = True
-    # do all actions initially
-    action = Event.read_uploads | Event.read_relarea
-    saw_events = False
-
     def sigterm(signum, frame):
         logging.debug("SIGTERM")
-        nonlocal running
-        running = False
         raise InterruptedError
 
     def sighup(signum, frame):
         logging.debug("SIGHUP")
 
+    def sigusr1(signum, frame):
+        logging.info("SIGUSR1, profiling %s" % ('enabled' if profiling.toggle() else 'disabled'))
+
     context.signal_map = {
         signal.SIGTERM: sigterm,
         signal.SIGHUP: sighup,
+        signal.SIGUSR1: sigusr1,
     }
 
     with context:
         logging.info("calm daemon started, pid %d" % (os.getpid()))
         irk.irk("calm daemon started")
 
-        state.packages = {}
-
-        # watch for changes in relarea, upload and staging directories
-        i = inotify.adapters.InotifyTrees([args.rel_area, args.homedir, args.stagingdir],
-                                          mask=inotify.constants.IN_CREATE | inotify.constants.IN_DELETE | inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_ATTRIB | inotify.constants.IN_MOVED_TO,
-                                          block_duration_s=60)
+        # deliver any mail left queued from last time
+        if mailqueue.queue():
+            mailqueue.queue().start()
 
         try:
-            while running:
-                if action:
-                    with mail_logs(state):
-                        if Event.read_relarea in action:
-                            if saw_events:
-                                irk.irk("calm processing release area")
-                            state.packages = process_relarea(args, state)
-
-                        if not state.packages:
-                            logging.error("errors in relarea, not processing uploads or writing setup.ini")
-                        else:
-                            if Event.read_uploads in action:
-                                if saw_events:
-                                    irk.irk("calm processing uploads")
-                                state.packages = process_uploads(args, state)
-
-                            do_output(args, state)
-
-                        if saw_events:
-                            irk.irk("calm processing done")
-
-                # we wake at a 10 minute offset from the next 240 minute boundary
-                # (i.e. at :10 past every fourth hour) to check the state of the
-                # release area, in case someone has ninja-ed in a change there...
-                interval = 240 * 60
-                offset = 10 * 60
-                delay = interval - ((time.time() - offset) % interval)
-                next_scan_time = time.time() + delay
-
-                if action:
-                    logging.info("next rescan in %d seconds" % (delay))
-
-                action = Event(0)
-                saw_events = False
-                depth = args.rel_area.count(os.path.sep) + 1
-
-                try:
-                    # It would be nice to use inotify.adaptor's timeout feature so
-                    # we go at least a few seconds without events, to ensure that we
-                    # don't start processing in the middle of a flurry of events.
-                    # Unfortunately, that goes back to waiting for the full
-                    # block_duration_s if timeout hasn't expired...
-                    for event in i.event_gen(yield_nones=True):
-                        if event is not None:
-                            logging.debug("inotify event %s" % str(event))
-                            saw_events = True
-                            (_, type_names, path, filename) = event
-                            if path.startswith(args.rel_area):
-                                # ignore sha512.sum and modifications to setup.*
-                                # files in the arch directory
-                                if (filename != 'sha512.sum') and ((path.count(os.path.sep) > depth) or filename == ".touch"):
-                                    action |= Event.read_relarea
-                            elif path.startswith(args.stagingdir) and (filename == '.touch'):
-                                action |= Event.read_uploads
-                            elif (path.startswith(args.homedir)) and (filename == ".sftp-session-close"):
-                                action |= Event.read_uploads
-                        else:
-                            # None means no more events are currently available, so
-                            # break to process actions
-                            break
-                except inotify.calls.InotifyError:
-                    # can occur if a just created directory is (re)moved before
-                    # we set a watch on it
-                    pass
-
-                if not saw_events:
-                    if time.time() > next_scan_time:
-                        logging.debug("scheduled rescan")
-                        action |= (Event.read_uploads | Event.read_relarea)
-
-                if action:
-                    logging.info("woken, actions %s" % action)
+            daemon_loop(args, state)
 
         except InterruptedError:
             # inotify module has the annoying behaviour of eating any EINTR
@@ -844,6 +992,7 @@ def do_daemon(args, state):
 
         irk.irk(stop_reason)
         logging.info(stop_reason)
+        irk.flush()
 
 
 def mail_logs(state):
@@ -857,16 +1006,35 @@ def mail_cb(state, loghandler):
 
     # if there are any log records of ERROR level or higher, send those records
     # to leads
-    if any([record.levelno >= logging.ERROR for record in loghandler.buffer]):
+    errors = [i for (i, s) in enumerate(loghandler.summaries) if s.levelno >= logging.ERROR]
+    if errors:
         leads_email = BufferingSMTPHandler(state.args.email, subject='%s' % (state.subject))
-        for record in loghandler.buffer:
-            if record.levelno >= logging.ERROR:
-                leads_email.handle(record)
+        for record in loghandler.records(errors):
+            leads_email.handle(record)
         leads_email.close()
 
-    # send each maintainer mail containing log entries caused by their actions,
-    # or pertaining to their packages
     mlist = maintainers.maintainer_list(state.args)
+
+    # make a list of the records for each maintainer: those caused by their
+    # actions, or pertaining to their packages
+    pkg_maintainers = {}
+    for m in mlist.values():
+        for p in m.pkgs:
+            pkg_maintainers.setdefault(p.data, []).append(m.name)
+
+    maint_records = {}
+    max_level = logging.NOTSET
+    for (i, s) in enumerate(loghandler.summaries):
+        max_level = max(max_level, s.levelno)
+
+        names = set(pkg_maintainers.get(s.package, []))
+        if s.maint is not None:
+            names.add(s.maint)
+
+        for n in names:
+            maint_records.setdefault(n, []).append(i)
+
+    # send each maintainer mail containing those records
     for m in mlist.values():
         # may happen for previous maintainers who orphaned all their packages
         # before an email became mandatory
@@ -884,12 +1052,10 @@ def mail_cb(state, loghandler):
         threshold = logging.WARNING if m.quiet else logging.INFO
 
         # if there are any log records of thresholdLevel or higher ...
-        if any([record.levelno >= threshold for record in loghandler.buffer]):
+        if max_level >= threshold:
             # ... send all associated records to the maintainer
-            for record in loghandler.buffer:
-                if ((getattr(record, 'maint', None) == m.name) or
-                    (getattr(record, 'package', None) in m.pkgs)):
-                    maint_email.handle(record)
+            for record in loghandler.records(maint_records.get(m.name, [])):
+                maint_email.handle(record)
 
         maint_email.close()
 
@@ -924,6 +1090,13 @@ def logging_setup(args):
 #
 #
 
+def profile_phases(s):
+    try:
+        return profiling.parse_phases(s)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def main():
     htdocs_default = os.path.join(common_constants.HTDOCS, 'packages')
     homedir_default = common_constants.HOMEDIR
@@ -935,22 +1108,34 @@ def main():
     setupdir_default = common_constants.HTDOCS
     vault_default = common_constants.VAULT
     logdir_default = '/sourceware/cygwin-staging/logs'
+    mailqueue_default = '/sourceware/cygwin-staging/mailqueue'
     key_default = [common_constants.DEFAULT_GPG_KEY]
 
     parser = argparse.ArgumentParser(description='Upset replacement')
+    parser.add_argument('--compress-threads', action='store', type=int, metavar='N', help="threads each for xz and zstd compression of setup.ini (default: 1)", default=1)
     parser.add_argument('-d', '--daemon', action='store', nargs='?', const=pidfile_default, help="daemonize (PIDFILE defaults to " + pidfile_default + ")", metavar='PIDFILE')
     parser.add_argument('--email', action='store', dest='email', nargs='?', default='', const=common_constants.EMAILS, help="email output to maintainer and ADDRS (ADDRS defaults to '" + common_constants.EMAILS + "')", metavar='ADDRS')
     parser.add_argument('--force', action='count', help="force regeneration of static htdocs content", default=0)
     parser.add_argument('--homedir', action='store', metavar='DIR', help="maintainer home directory (default: " + homedir_default + ")", default=homedir_default)
     parser.add_argument('--htdocs', action='store', metavar='DIR', help="htdocs output directory (default: " + htdocs_default + ")", default=htdocs_default)
+    parser.add_argument('-j', '--jobs', action='store', type=int, metavar='N', help="number of processes used to write package listings (default: 1)", default=1)
     parser.add_argument('--key', action='append', metavar='KEYID', help="key to use to sign setup.ini", default=key_default, dest='keys')
     parser.add_argument('--logdir', action='store', metavar='DIR', help="log directory (default: '" + logdir_default + "')", default=logdir_default)
+    parser.add_argument('--mailqueue', action='store', metavar='DIR', help="queue outgoing mail in DIR, and deliver it in the background (default: '" + mailqueue_default + "', '' to send mail immediately)", default=mailqueue_default)
+    parser.add_argument('--max-delay', action='store', type=int, metavar='SECONDS', help="longest delay after the first event before processing starts, when daemonized (default: %d)" % MAX_DELAY, default=MAX_DELAY)
     parser.add_argument('--pkglist', action='store', metavar='FILE', help="package maintainer list (default: " + pkglist_default + ")", default=pkglist_default)
+    parser.add_argument('--profile', action='store', metavar='PHASE[,PHASE]', type=profile_phases, help="profile phases (%s, or all) into PROFILE_DIR (when daemonized, SIGUSR1 toggles profiling)" % ','.join(profiling.PHASES), default=set())
+    parser.add_argument('--profile-dir', action='store', metavar='DIR', help="profile output directory (default: 'profile' in the log directory)")
+    parser.add_argument('--profile-memory', action='store_true', help="also compare memory allocations in profiled phases with the previous cycle")
+    parser.add_argument('--quiet-period', action='store', type=int, metavar='SECONDS', help="wait for a period with no events before processing starts, when daemonized (default: %d)" % QUIET_PERIOD, default=QUIET_PERIOD)
     parser.add_argument('--release', action='store', help='value for setup-release key (default: cygwin)', default='cygwin')
     parser.add_argument('--releasearea', action='store', metavar='DIR', help="release directory (default: " + relarea_default + ")", default=relarea_default, dest='rel_area')
     parser.add_argument('--repodir', action='store', metavar='DIR', help="packaging repositories directory (default: " + repodir_default + ")", default=repodir_default)
+    parser.add_argument('--rsyncable', action='store_true', help="make compressed setup.ini friendlier to rsync's delta transfer")
     parser.add_argument('--setupdir', action='store', metavar='DIR', help="setup executable directory (default: " + setupdir_default + ")", default=setupdir_default)
+    parser.add_argument('--smtp', action='store', metavar='HOST[:PORT]', help="deliver queued mail via SMTP to HOST (default: use sendmail)")
     parser.add_argument('--stagingdir', action='store', metavar='DIR', help="automated build staging directory (default: " + stagingdir_default + ")", default=stagingdir_default)
+    parser.add_argument('--watch', action='store', choices=['tree', 'light'], help="watch every directory for changes, or only where triggers appear, periodically comparing release area directory mtimes (default: tree)", default='tree')
     parser.add_argument('--no-stale', action='store_false', dest='stale', help="don't vault stale packages")
     parser.set_defaults(stale=True)
     parser.add_argument('--reports', action='store_true', dest='reports', help="produce reports (default: off unless daemonized)", default=None)
@@ -967,6 +1152,11 @@ def main():
 
     logging_setup(args)
 
+    profiling.configure(args.profile_dir or os.path.join(args.logdir, 'profile'), args.profile, args.profile_memory)
+
+    if args.mailqueue and not args.dryrun:
+        mailqueue.configure(args.mailqueue, mailqueue.smtp_backend(args.smtp) if args.smtp else None)
+
     # find matching keygrips for keys
     args.keygrips = []
     for k in args.keys:
@@ -993,6 +1183,11 @@ def main():
     else:
         status = do_main(args, state)
 
+    # give queued mail a chance to be delivered before we exit (anything which
+    # isn't will be delivered next time)
+    if mailqueue.queue() and not mailqueue.queue().drain(MAILQUEUE_DRAIN_TIMEOUT):
+        logging.warning("%d messages remain in mail queue" % len(mailqueue.queue().pending()))
+
     return status
 
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# produce the compressed variants of setup.ini
+#
+
+import bz2
+import concurrent.futures
+import logging
+import lzma
+import re
+import subprocess
+import time
+import zlib
+
+import zstandard
+
+
+# equivalent to 'bzip2'
+def _compress_bz2(data, threads, rsyncable):
+    return bz2.compress(data, 9)
+
+
+# equivalent to 'xz -6e'
+def _compress_xz(data, threads, rsyncable):
+    # the lzma module can't do multithreaded compression, so use xz(1) for that
+    if threads > 1:
+        return subprocess.run(['/usr/bin/xz', '-6e', '-T%d' % threads],
+                              input=data, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, check=True).stdout
+
+    return lzma.compress(data, preset=6 | lzma.PRESET_EXTREME)
+
+
+# on average, how many packages go into each frame when rsyncable
+RSYNCABLE_PACKAGES_PER_FRAME = 64
+
+
+#
+# split setup.ini content into chunks, each starting at a package stanza
+#
+# whether a chunk starts at a given package depends only on the package name,
+# so adding, removing or changing a package only changes the chunk containing
+# it, and the other chunks remain the same.
+#
+def rsyncable_chunks(data):
+    start = 0
+    for m in re.finditer(rb'^@ (\S+)$', data, re.MULTILINE):
+        if (zlib.crc32(m.group(1)) % RSYNCABLE_PACKAGES_PER_FRAME == 0) and (m.start() > start):
+            yield data[start:m.start()]
+            start = m.start()
+
+    yield data[start:]
+
+
+# equivalent to 'zstd --ultra -20'
+#
+# if rsyncable, each chunk of the content is compressed as an independent frame,
+# so rsync can transfer only the frames which have changed (a sequence of frames
+# is still a valid zstd stream)
+#
+# (this relies on setup.zst being published at the same path each time, so a
+# mirror has the earlier version to use as the basis for the transfer; see
+# publish.py, and benchmarks/rsync_delta.py for measuring the effect)
+def _compress_zst(data, threads, rsyncable):
+    cctx = zstandard.ZstdCompressor(level=20, write_checksum=True,
+                                    threads=threads if threads > 1 else 0)
+
+    if rsyncable:
+        return b''.join(cctx.compress(chunk) for chunk in rsyncable_chunks(data))
+
+    return cctx.compress(data)
+
+
+COMPRESSORS = {
+    '.bz2': _compress_bz2,
+    '.xz': _compress_xz,
+    '.zst': _compress_zst,
+}
+
+# the extensions of the compressed variants we produce
+EXTENSIONS = list(COMPRESSORS.keys())
+
+
+#
+# write each compressed variant of data to basename+extension
+#
+# the compressors all release the GIL while working, so are run concurrently, so
+# the time taken is that of the slowest one, rather than the sum of all of them.
+#
+# threads > 1 additionally allows the xz and zstd compressors to use that many
+# threads each.
+#
+# rsyncable makes the zstd variant friendlier to rsync's delta transfer, at the
+# cost of some compression ratio.
+#
+# returns True if all variants were written successfully (otherwise, the caller
+# mustn't publish the partial set of variants)
+#
+def compress(data, basename, threads=1, rsyncable=False):
+    def _compress(ext):
+        fn = basename + ext
+        start = time.time()
+        try:
+            cdata = COMPRESSORS[ext](data, threads, rsyncable)
+            with open(fn, 'wb') as f:
+                f.write(cdata)
+        except (OSError, subprocess.CalledProcessError, zstandard.ZstdError) as e:
+            logging.error("compressing %s failed: %s" % (fn, e))
+            return False
+
+        logging.info("compressed %s in %.2f seconds (%d bytes to %d bytes)" % (fn, time.time() - start, len(data), len(cdata)))
+        return True
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(COMPRESSORS)) as executor:
+        results = list(executor.map(_compress, EXTENSIONS))
+
+    return all(results)
@@ -36,6 +36,8 @@ from . import utils
 
 # database instance
 _db = None
+# cache of the historic_package_names table
+_historic_names = None
 # tests currently need to be able to adjust this default
 _uploads_allowed_default = False
 
@@ -47,9 +49,14 @@ def get_db(args):
         utils.makedirs(args.htdocs)
         dbfn = os.path.join(args.htdocs, 'calm.db')
         logging.debug("sqlite3 database %s" % (dbfn))
-        _db = peewee.SqliteDatabase(dbfn, autoconnect=False)
+        # use WAL mode, so readers and a writer (e.g. calm and calm-tool)
+        # don't block each other, and wait for a while for any other writer
+        # to finish, rather than failing immediately
+        _db = peewee.SqliteDatabase(dbfn, autoconnect=False,
+                                    pragmas={'journal_mode': 'wal',
+                                             'busy_timeout': 30000})
 
-        models = [HistoricPackageName, VaultRequest, MissingObsolete, AnnounceMsgid, Maintainer]
+        models = [HistoricPackageName, VaultRequest, MissingObsolete, AnnounceMsgid, Maintainer, SummaryFingerprint, GeneratedFile]
 
         # set the database for all models
         for model in models:
@@ -65,9 +72,11 @@ def get_db(args):
 # Reset the global database instance
 def reset_db():
     global _db
+    global _historic_names
     if _db is not None:
         _db.close()
         _db = None
+    _historic_names = None
 
 
 # Model definitions
@@ -134,6 +143,23 @@ class Maintainer(BaseModel):
         table_name = 'maintainers'
 
 
+# table recording a fingerprint of the inputs to each package summary page
+class SummaryFingerprint(BaseModel):
+    name = peewee.TextField(primary_key=True)
+    fingerprint = peewee.TextField()
+
+    class Meta:
+        table_name = 'summary_fingerprints'
+
+
+# table recording the files we have generated in htdocs
+class GeneratedFile(BaseModel):
+    path = peewee.TextField(primary_key=True)
+
+    class Meta:
+        table_name = 'generated_files'
+
+
 # connect to the database
 def connect(args):
 
@@ -144,21 +170,35 @@ def connect(args):
 # this tracks the set of all names we have ever had for packages, and returns
 # ones which aren't in the set of names for current package
 #
+# (the set of historic names is only read from the database once, after that
+# only newly appearing names are written to it)
+#
 def update_package_names(args, packages):
+    global _historic_names
+
     db = connect(args)
     current_names = set(packages.keys())
 
     with db.connection_context():
         # get all historic names
-        historic_names = set(
-            row.name for row in HistoricPackageName.select()
-        )
+        if _historic_names is None:
+            _historic_names = set(
+                row.name for row in HistoricPackageName.select()
+            )
+
+        historic_names = set(_historic_names)
 
         # add newly appearing names to current_names
         new_names = current_names - historic_names
-        for n in new_names:
-            HistoricPackageName.create(name=n)
-            logging.debug("package '%s' name is added" % (n))
+        if new_names:
+            with db.atomic():
+                for batch in peewee.chunked(sorted(new_names), 500):
+                    HistoricPackageName.insert_many([{'name': n} for n in batch]).on_conflict_ignore().execute()
+
+            for n in sorted(new_names):
+                logging.debug("package '%s' name is added" % (n))
+
+            _historic_names.update(new_names)
 
     # this is data isn't quite perfect for this purpose: it doesn't know about:
     # - names which the removed package provide:d
@@ -251,23 +291,97 @@ def announce_msgid_set(args, srcpackage, msgid):
         AnnounceMsgid.create(srcpackage=srcpackage, msgid=msgid)
 
 
+#
+# synchronize maintainer information with the database
+#
+# uploads_allowed is read from the database, everything else is written to it
+# (but only for rows which have changed)
+#
 def maintainer_info(args, mlist):
     db = connect(args)
 
     with db.connection_context():
+        rows = {mi.name: mi for mi in Maintainer.select()}
+
+        changed = []
         for m in mlist.values():
             if m.name == 'ORPHANED':
                 continue
 
-            mi = Maintainer.get_or_none(Maintainer.name == m.name)
+            mi = rows.get(m.name, None)
             if mi:
                 m.uploads_allowed = mi.uploads_allowed
+                uploads_allowed = mi.uploads_allowed
             else:
-                mi = Maintainer.create(name=m.name)
-                mi.uploads_allowed = _uploads_allowed_default
-
-            mi.email = ','.join(m.email)
-            mi.last_reminder = m.reminder_time
-            mi.last_seen = m.last_seen
-            mi.is_trusted = m.is_trusted
-            mi.save()
+                uploads_allowed = _uploads_allowed_default
+
+            row = {
+                'name': m.name,
+                'email': ','.join(m.email),
+                'last_reminder': m.reminder_time,
+                'last_seen': m.last_seen,
+                'is_trusted': m.is_trusted,
+                'uploads_allowed': uploads_allowed,
+            }
+
+            if mi and all(getattr(mi, k) == v for k, v in row.items()):
+                continue
+
+            changed.append(row)
+
+        if changed:
+            with db.atomic():
+                for batch in peewee.chunked(changed, 100):
+                    Maintainer.insert_many(batch).on_conflict_replace().execute()
+
+        logging.debug("%d of %d maintainer records updated" % (len(changed), len(mlist)))
+
+
+def maintainer_uploads_allowed(args, mlist):
+    db = connect(args)
+
+    with db.connection_context():
+        for (name, uploads_allowed) in Maintainer.select(Maintainer.name, Maintainer.uploads_allowed).tuples():
+            if name in mlist:
+                mlist[name].uploads_allowed = uploads_allowed
+
+
+def summary_fingerprints(args):
+    db = connect(args)
+
+    with db.connection_context():
+        return {row.name: row.fingerprint for row in SummaryFingerprint.select()}
+
+
+def summary_fingerprints_update(args, changed, removed):
+    db = connect(args)
+
+    with db.connection_context():
+        with db.atomic():
+            # (in batches, to stay within the limit on the number of SQL
+            # variables)
+            rows = [{'name': n, 'fingerprint': f} for (n, f) in changed.items()]
+            for batch in peewee.chunked(rows, 500):
+                SummaryFingerprint.insert_many(batch).on_conflict_replace().execute()
+
+            for batch in peewee.chunked(sorted(removed), 500):
+                SummaryFingerprint.delete().where(SummaryFingerprint.name.in_(batch)).execute()
+
+
+def generated_files(args):
+    db = connect(args)
+
+    with db.connection_context():
+        return set(row.path for row in GeneratedFile.select())
+
+
+def generated_files_update(args, added, removed):
+    db = connect(args)
+
+    with db.connection_context():
+        with db.atomic():
+            for batch in peewee.chunked(sorted(added), 500):
+                GeneratedFile.insert_many([{'path': p} for p in batch]).on_conflict_ignore().execute()
+
+            for batch in peewee.chunked(sorted(removed), 500):
+                GeneratedFile.delete().where(GeneratedFile.path.in_(batch)).execute()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# find changes in a directory tree by comparing directory mtimes, without
+# needing an inotify watch on every directory in it
+#
+# a directory's mtime changes when an entry in it is created, removed or
+# renamed. Each directory is given a digest of its mtime and the names and
+# digests of its subdirectories (as in a Merkle tree), so comparing two scans
+# only needs to descend into the subtrees where the digests differ.
+#
+# (this doesn't notice a file being modified in place, but files in the
+# release area are only ever replaced)
+#
+
+import hashlib
+import os
+from collections import namedtuple
+
+Node = namedtuple('Node', ['mtime', 'digest', 'children'])
+
+
+#
+# scan the tree below root, returning a dict of Node, keyed by the path of each
+# directory relative to root. Directories with a name in exclude aren't scanned.
+#
+def scan(root, exclude=()):
+    tree = {}
+
+    def _scan(relpath):
+        path = os.path.join(root, relpath)
+        children = []
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False) and e.name not in exclude:
+                        children.append(e.name)
+        except FileNotFoundError:
+            # removed while we were scanning
+            return None
+
+        h = hashlib.sha1(str(mtime).encode())
+        for c in sorted(children):
+            digest = _scan(os.path.normpath(os.path.join(relpath, c)))
+            if digest:
+                h.update(c.encode(errors='surrogateescape') + b'\0' + digest)
+
+        tree[relpath] = Node(mtime, h.digest(), frozenset(children))
+        return tree[relpath].digest
+
+    _scan('.')
+    return tree
+
+
+#
+# compare two scans, returning the set of relative paths of directories which
+# have been created, removed or had their contents changed
+#
+def changed(old, new):
+    result = set()
+    todo = ['.']
+
+    while todo:
+        p = todo.pop()
+        o = old.get(p)
+        n = new.get(p)
+
+        if o and n and o.digest == n.digest:
+            continue
+
+        if not o or not n or o.mtime != n.mtime:
+            result.add(p)
+
+        children = (o.children if o else frozenset()) | (n.children if n else frozenset())
+        todo.extend(os.path.normpath(os.path.join(p, c)) for c in children)
+
+    return result
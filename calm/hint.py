@@ -29,6 +29,8 @@ import argparse
 import re
 from collections import OrderedDict
 
+from . import metrics
+
 try:
     import license_expression
 except ModuleNotFoundError:
@@ -221,6 +223,8 @@ def hint_file_parse(fn, kind, strict=False):
 
     with open(fn, 'rb') as f:
         c = f.read()
+        metrics.io('opens')
+        metrics.io('bytes_read', len(c))
 
         # validate that .hint file is UTF-8 encoded
         try:
@@ -5,51 +5,232 @@
 # First argument must be a channel URL. If it does not begin with "irc",
 # the base URL for freenode is prepended.
 #
+# Messages are queued, and sent by a background thread over a single connection
+# to irked, so sending a notification never blocks the caller (even when irked
+# is slow or down). If the queue is full, the notification is dropped.
+#
 # SPDX-License-Identifier: BSD-2-Clause
 
 import json
+import logging
+import queue
 import socket
 import sys
+import threading
+import time
 
 DEFAULT_SERVER = ("localhost", 6659)
 DEFAULT_TARGET = ['irc://irc.libera.chat/cygwin-bots']
 
+# maximum number of notifications waiting to be sent
+QUEUE_SIZE = 100
+# coalesced messages are kept below this length
+MAX_MESSAGE_LEN = 400
+# close the connection after this long with nothing to send
+IDLE_TIMEOUT = 300
+# timeout for connecting to irked
+CONNECT_TIMEOUT = 10
+# wait this long before trying to connect again, after failing to
+RECONNECT_DELAY = 60
+# how long to wait for queued notifications to be sent, when exiting
+FLUSH_TIMEOUT = 10
+
 
 def connect(server=DEFAULT_SERVER):
-    return socket.create_connection(server)
+    return socket.create_connection(server, timeout=CONNECT_TIMEOUT)
 
 
 def send(s, target, message):
     data = {"to": target, "privmsg": message}
     # print(json.dumps(data))
-    s.sendall(bytes(json.dumps(data), "ascii"))
+    s.sendall(bytes(json.dumps(data) + "\n", "ascii"))
+
+
+def canonical_target(t):
+    if "irc:" not in t and "ircs:" not in t:
+        t = "irc://chat.freenode.net/{0}".format(t)
+    return t
+
+
+#
+# coalesce a list of (target, message) into fewer messages: repeats of the same
+# message are counted, and messages to the same target are joined together, up
+# to MAX_MESSAGE_LEN.
+#
+def coalesce(items):
+    coalesced = []
+    for t, m in items:
+        if coalesced and coalesced[-1][0] == t and coalesced[-1][1] == m:
+            coalesced[-1][2] += 1
+        else:
+            coalesced.append([t, m, 1])
+
+    result = []
+    for t, m, n in coalesced:
+        if n > 1:
+            m = '%s (x%d)' % (m, n)
 
+        if result and result[-1][0] == t and len(result[-1][1]) + len(m) + 2 <= MAX_MESSAGE_LEN:
+            result[-1] = (t, result[-1][1] + '; ' + m)
+        else:
+            result.append((t, m))
 
-def irk(message, target=DEFAULT_TARGET, server=DEFAULT_SERVER):
-    if not isinstance(target, list):
-        target = [target]
+    return result
+
+
+#
+# if background is False, no sender thread is started, and send_pending() must
+# be called to send queued notifications
+#
+class Notifier(object):
+    def __init__(self, server=DEFAULT_SERVER, maxsize=QUEUE_SIZE, background=True):
+        self.server = server
+        self.background = background
+        self.queue = queue.Queue(maxsize)
+        # notifications dropped because the queue was full (protected by lock,
+        # as it's counted by notify() and reset by the sender thread)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.sock = None
+        self.thread = None
+
+    def notify(self, message, target=DEFAULT_TARGET):
+        if not isinstance(target, list):
+            target = [target]
+
+        for t in target:
+            try:
+                self.queue.put_nowait((canonical_target(t), message))
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+        if self.background:
+            self.start()
+
+    #
+    # send items, and everything else which is currently queued (if that fails,
+    # OSError is raised and those notifications are discarded)
+    #
+    def send_pending(self, items=None):
+        items = items or []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
 
-    for t in target:
         try:
-            s = connect(server)
-            if "irc:" not in t and "ircs:" not in t:
-                t = "irc://chat.freenode.net/{0}".format(t)
+            self._send(items)
+        finally:
+            for _i in items:
+                self.queue.task_done()
+
+    def _send(self, items):
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+
+        if not items and not dropped:
+            return
+
+        if dropped:
+            items = items + [(canonical_target(t), 'calm dropped %d notification(s)' % dropped) for t in DEFAULT_TARGET]
+
+        messages = coalesce(items)
+
+        # if the existing connection has failed, try again with a new one
+        while True:
+            fresh = self.sock is None
+            try:
+                if fresh:
+                    self.sock = connect(self.server)
+                for t, m in messages:
+                    send(self.sock, t, m)
+                return
+            except OSError:
+                self.close()
+                if fresh:
+                    raise
+
+    def close(self):
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _worker(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=IDLE_TIMEOUT)
+            except queue.Empty:
+                self.close()
+                continue
+
+            try:
+                self.send_pending([item])
+            except OSError as e:
+                logging.debug('irk: sending notifications failed: %s' % (e))
+                time.sleep(RECONNECT_DELAY)
+
+    # start the sender thread, if it isn't already running
+    #
+    # (this is done lazily, as threads don't survive daemonization)
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._worker, name='irk', daemon=True)
+            self.thread.start()
+
+    #
+    # wait for up to timeout seconds for the queue to empty, returning True if
+    # it did
+    #
+    # (Queue.join() can't time out, so it's waited for in another thread)
+    #
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        drained = threading.Event()
+
+        def _join():
+            self.queue.join()
+            drained.set()
+
+        threading.Thread(target=_join, name='irk-flush', daemon=True).start()
+        return drained.wait(timeout)
+
+
+_notifier = None
+
+
+def notifier():
+    global _notifier
+
+    if _notifier is None:
+        _notifier = Notifier()
+
+    return _notifier
+
+
+def irk(message, target=DEFAULT_TARGET):
+    notifier().notify(message, target)
 
-            send(s, t, message)
 
-            s.close()
-        except OSError:
-            pass
+def flush(timeout=FLUSH_TIMEOUT):
+    return notifier().flush(timeout)
 
 
 def main():
     message = " ".join(sys.argv[1:])
 
+    n = Notifier(background=False)
+    n.notify(message)
     try:
-        irk(message)
+        n.send_pending()
     except socket.error as e:
         sys.stderr.write("irk: write to server failed: %r\n" % e)
         sys.exit(1)
+    finally:
+        n.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# a queue of outgoing mail, delivered in the background
+#
+# messages are written into a spool directory, which a worker thread drains,
+# so a slow MTA doesn't hold up anything else. Since the spool is on disk,
+# nothing is lost if we are restarted before a message is delivered.
+#
+# a message which can't be delivered is retried (with an increasing delay), and
+# after MAX_ATTEMPTS is moved to the 'failed' subdirectory of the spool.
+#
+
+import email
+import logging
+import os
+import smtplib
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+SENDMAIL = '/usr/sbin/sendmail'
+
+# delay before retrying delivery of a message (doubled after each failure, up
+# to the maximum)
+RETRY_DELAY = 60
+RETRY_DELAY_MAX = (60 * 60)
+MAX_ATTEMPTS = 24
+
+# the queue, if one has been configured
+_queue = None
+
+
+#
+# deliver messages by running sendmail for each one
+#
+class SendmailBackend(object):
+    def __init__(self, sendmail=SENDMAIL):
+        self.sendmail = sendmail
+
+    def open(self):
+        pass
+
+    def send(self, envelope_from, msg):
+        with subprocess.Popen([self.sendmail, '-t', '-oi', '-f', envelope_from], stdin=subprocess.PIPE) as p:
+            p.communicate(msg)
+            if p.returncode != 0:
+                raise OSError('sendmail exit status %d' % (p.returncode))
+
+    def close(self):
+        pass
+
+
+#
+# deliver messages over a single SMTP connection for each batch
+#
+class SMTPBackend(object):
+    def __init__(self, host, port=25, timeout=60):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.conn = None
+
+    def open(self):
+        self.conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+    def send(self, envelope_from, msg):
+        # (recipients are taken from To:, Cc: and Bcc:, and Bcc: is removed, as
+        # sendmail -t does)
+        self.conn.send_message(email.message_from_bytes(msg), from_addr=envelope_from)
+
+    def close(self):
+        if self.conn:
+            try:
+                self.conn.quit()
+            except smtplib.SMTPException:
+                pass
+            self.conn = None
+
+
+#
+# if background is False, no worker thread is started, and deliver() must be
+# called to deliver queued messages
+#
+class MailQueue(object):
+    def __init__(self, spooldir, backend=None, background=True):
+        self.spooldir = spooldir
+        self.background = background
+        self.failed = os.path.join(spooldir, 'failed')
+        os.makedirs(self.failed, exist_ok=True)
+
+        self.backend = backend or SendmailBackend()
+        self.attempts = {}
+        self.retry_at = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    #
+    # add a message to the spool (atomically, so the worker never sees a partial
+    # message)
+    #
+    def enqueue(self, envelope_from, msg):
+        name = '%d-%s.msg' % (time.time() * 1000000, uuid.uuid4().hex)
+
+        with tempfile.NamedTemporaryFile(dir=self.spooldir, prefix='.', delete=False) as f:
+            f.write(envelope_from.encode() + b'\n')
+            f.write(msg)
+        os.replace(f.name, os.path.join(self.spooldir, name))
+
+        logging.debug('mailqueue: queued %s' % (name))
+        if self.background:
+            self.start()
+            self.wakeup.set()
+
+    def pending(self):
+        return sorted(f for f in os.listdir(self.spooldir) if f.endswith('.msg'))
+
+    #
+    # try to deliver every message which is due, returning the number still
+    # pending
+    #
+    def deliver(self):
+        now = time.time()
+        due = [f for f in self.pending() if self.retry_at.get(f, 0) <= now]
+        if not due:
+            return len(self.pending())
+
+        try:
+            self.backend.open()
+        except (OSError, smtplib.SMTPException) as e:
+            logging.warning('mailqueue: connecting to MTA failed: %s' % (e))
+            for f in due:
+                self._failed(f)
+            return len(self.pending())
+
+        try:
+            for f in due:
+                fn = os.path.join(self.spooldir, f)
+                try:
+                    with open(fn, 'rb') as spooled:
+                        envelope_from = spooled.readline().decode().rstrip('\n')
+                        msg = spooled.read()
+                except FileNotFoundError:
+                    # removed by someone else
+                    logging.warning('mailqueue: %s has disappeared' % (f))
+                    self._forget(f)
+                    continue
+                except (OSError, UnicodeDecodeError) as e:
+                    # retrying won't help with a malformed message
+                    logging.error('mailqueue: reading %s failed: %s' % (f, e))
+                    self._give_up(f)
+                    continue
+
+                try:
+                    self.backend.send(envelope_from, msg)
+                except (OSError, ValueError, smtplib.SMTPException) as e:
+                    logging.warning('mailqueue: delivering %s failed: %s' % (f, e))
+                    self._failed(f)
+                    continue
+
+                logging.debug('mailqueue: delivered %s' % (f))
+                try:
+                    os.unlink(fn)
+                except FileNotFoundError:
+                    pass
+                self._forget(f)
+        finally:
+            self.backend.close()
+
+        return len(self.pending())
+
+    def _failed(self, f):
+        attempts = self.attempts.get(f, 0) + 1
+
+        if attempts >= MAX_ATTEMPTS:
+            logging.error('mailqueue: giving up delivering %s after %d attempts' % (f, attempts))
+            self._give_up(f)
+            return
+
+        self.attempts[f] = attempts
+        self.retry_at[f] = time.time() + min(RETRY_DELAY * 2 ** (attempts - 1), RETRY_DELAY_MAX)
+
+    # move a message to the failed directory
+    def _give_up(self, f):
+        try:
+            os.replace(os.path.join(self.spooldir, f), os.path.join(self.failed, f))
+        except OSError as e:
+            logging.error('mailqueue: moving %s to %s failed: %s' % (f, self.failed, e))
+        self._forget(f)
+
+    def _forget(self, f):
+        self.attempts.pop(f, None)
+        self.retry_at.pop(f, None)
+
+    def _worker(self):
+        while True:
+            self.wakeup.clear()
+
+            # don't let anything unexpected stop the worker, just try again later
+            try:
+                self.deliver()
+            except Exception:
+                logging.exception('mailqueue: delivery failed unexpectedly')
+                self.wakeup.wait(RETRY_DELAY)
+                continue
+
+            # wait until something is queued, or the next retry is due
+            timeout = None
+            if self.retry_at:
+                timeout = max(0, min(self.retry_at.values()) - time.time())
+            self.wakeup.wait(timeout)
+
+    # start the worker thread, if it isn't already running
+    #
+    # (this is done lazily, as threads don't survive daemonization)
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._worker, name='mailqueue', daemon=True)
+            self.thread.start()
+
+    #
+    # wait for up to timeout seconds for the queue to empty, returning True if
+    # it did
+    #
+    def drain(self, timeout):
+        deadline = time.time() + timeout
+
+        while self.pending():
+            if time.time() >= deadline:
+                return False
+
+            self.start()
+            self.wakeup.set()
+            time.sleep(0.1)
+
+        return True
+
+
+#
+# configure a queue which sendmail() enqueues into (otherwise mail is sent
+# synchronously)
+#
+# (the worker isn't started until something is queued, or start() is called)
+#
+def configure(spooldir, backend=None):
+    global _queue
+
+    if spooldir:
+        _queue = MailQueue(spooldir, backend)
+    else:
+        _queue = None
+
+    return _queue
+
+
+def queue():
+    return _queue
+
+
+# parse a HOST[:PORT] specification for the SMTP backend
+def smtp_backend(spec):
+    if ':' in spec:
+        host, port = spec.rsplit(':', 1)
+        return SMTPBackend(host, int(port))
+
+    return SMTPBackend(spec)
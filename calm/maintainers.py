@@ -278,24 +278,78 @@ def pkg_list(pkglist):
     return _read_pkglist(pkglist)
 
 
+# the maintainer list as last made, and a key identifying what it was made from
+_maintainer_list_cache = None
+
+# the files in a homedir which we read information from
+HOMEDIR_FILES = ['!email', '!mail', '!reminder-timestamp', '.last-seen']
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# a key which changes if anything we read from the homedirs changes
+#
+# (if the mtime of the directory containing the homedirs hasn't changed, no
+# homedirs have been added or removed, so only the homedirs of maintainers
+# already in the list need checking)
+def _homedirs_key(homedirs, names):
+    return (_mtime(homedirs),
+            tuple((n, _mtime(os.path.join(homedirs, n)), tuple(_mtime(os.path.join(homedirs, n, f)) for f in HOMEDIR_FILES)) for n in sorted(names)))
+
+
 # create maintainer list
+#
+# this is called several times each cycle, so the list is cached, and only
+# made again if the package maintainers list or anything in the homedirs has
+# changed
+#
 def maintainer_list(args):
+    global _maintainer_list_cache
+
     Maintainer._homedirs = args.homedir
+    pkgs = pkg_list(args.pkglist)
+
+    if _maintainer_list_cache:
+        (key, cached_pkgs, mlist) = _maintainer_list_cache
+        if (cached_pkgs is pkgs) and (key == (args.homedir, args.htdocs, _homedirs_key(args.homedir, mlist.keys()))):
+            # reset per-cycle state
+            for m in mlist.values():
+                m.reminders_issued = False
+                m.reminders_timestamp_checked = False
+
+            # uploads_allowed may have been changed in the db by someone else
+            db.maintainer_uploads_allowed(args, mlist)
+
+            _check_emails(mlist)
+            return mlist
 
     mlist = {}
 
     # add all maintainers for all packages
-    for p in pkg_list(args.pkglist).values():
+    for p in pkgs.values():
         for m in p.maintainers():
             Maintainer._find(mlist, m).pkgs.append(p)
 
     # read information from homedirs
     mlist = add_directories(mlist, args.homedir)
+    key = (args.homedir, args.htdocs, _homedirs_key(args.homedir, mlist.keys()))
 
     # read and update information in db
     db.maintainer_info(args, mlist)
 
-    # check all maintainers have an email
+    _maintainer_list_cache = (key, pkgs, mlist)
+
+    _check_emails(mlist)
+    return mlist
+
+
+# check all maintainers have an email
+def _check_emails(mlist):
     for m in mlist.values():
         if m.name == 'ORPHANED':
             continue
@@ -307,8 +361,6 @@ def maintainer_list(args):
         if not m.email:
             logging.error("no email address known for maintainer '%s'" % (m.name))
 
-    return mlist
-
 
 def update_reminder_times(mlist):
     for m in mlist.values():
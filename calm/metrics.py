@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# per-phase timing and counters for a processing cycle
+#
+# the wall-clock and CPU time spent in each phase are recorded, along with
+# counters (packages, files, bytes hashed, bytes decompressed, etc.), and
+# written at the end of each cycle as a Prometheus textfile-collector file,
+# and appended to a JSON-lines history, both next to calm.db
+#
+# (CPU time is for this process, so includes threads, but not subprocesses)
+#
+# I/O (stat calls, file opens, bytes read, archives opened and bytes
+# decompressed) is also counted, attributed to the innermost subsystem (e.g.
+# 'read_one_package', 'sha512_file') doing it, so it can be seen whether a slow
+# cycle is I/O-bound, and where that I/O comes from.
+#
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_FILE = 'calm.prom'
+HISTORY_FILE = 'calm-metrics.jsonl'
+# the history is rotated when it grows larger than this
+HISTORY_MAX_SIZE = 16 * 1024 * 1024
+# the number of phases mentioned in the summary
+SUMMARY_PHASES = 4
+# the kinds of I/O counted
+IO_KINDS = ['stats', 'opens', 'bytes_read', 'archives', 'bytes_decompressed']
+
+
+class Metrics(object):
+    def __init__(self):
+        self.start = time.time()
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.wall = 0
+        self.cpu = 0
+        # phase -> [wall, cpu, calls]
+        self.phases = {}
+        self.counters = {}
+        # subsystem -> kind -> count
+        self.io = {}
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.wall_start
+        self.cpu = time.process_time() - self.cpu_start
+
+    def record(self, name, wall, cpu):
+        p = self.phases.setdefault(name, [0, 0, 0])
+        p[0] += wall
+        p[1] += cpu
+        p[2] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def count_io(self, subsystem, kind, n=1):
+        c = self.io.setdefault(subsystem, {})
+        c[kind] = c.get(kind, 0) + n
+
+    # add the counters and I/O counts from another Metrics (e.g. from a worker
+    # process)
+    def merge(self, other):
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for subsystem, c in other.io.items():
+            for kind, n in c.items():
+                self.count_io(subsystem, kind, n)
+
+    def summary(self):
+        top = sorted(self.phases.items(), key=lambda i: i[1][0], reverse=True)[:SUMMARY_PHASES]
+        return 'cycle took %.1fs (%.1fs CPU)%s' % (self.wall, self.cpu, ''.join(', %s %.1fs' % (n, p[0]) for n, p in top))
+
+    def io_summary(self):
+        if not self.io:
+            return 'none'
+
+        return '; '.join('%s: %s' % (subsystem, ', '.join('%d %s' % (c[k], k.replace('_', ' ')) for k in IO_KINDS if c.get(k)))
+                         for subsystem, c in sorted(self.io.items()))
+
+    def as_dict(self):
+        return {
+            'time': int(self.start),
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'phases': {n: {'wall': round(p[0], 6), 'cpu': round(p[1], 6), 'calls': p[2]} for n, p in sorted(self.phases.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'io': {subsystem: dict(sorted(c.items())) for subsystem, c in sorted(self.io.items())},
+        }
+
+    def prometheus(self):
+        lines = []
+
+        def metric(name, desc, kind, samples):
+            lines.append('# HELP calm_%s %s' % (name, desc))
+            lines.append('# TYPE calm_%s %s' % (name, kind))
+            for labels, value in samples:
+                lines.append('calm_%s%s %s' % (name, labels, repr(value)))
+
+        def phase_labels(name):
+            # per-maintainer phases are named 'phase/maintainer'
+            (phase, _, maint) = name.partition('/')
+            labels = 'phase="%s"' % _escape(phase)
+            if maint:
+                labels += ',maintainer="%s"' % _escape(maint)
+            return '{%s}' % labels
+
+        metric('cycle_timestamp_seconds', 'When the last processing cycle started.', 'gauge', [('', int(self.start))])
+        metric('cycle_wall_seconds', 'Wall-clock time taken by the last processing cycle.', 'gauge', [('', self.wall)])
+        metric('cycle_cpu_seconds', 'CPU time taken by the last processing cycle.', 'gauge', [('', self.cpu)])
+
+        phases = sorted(self.phases.items())
+        metric('phase_wall_seconds', 'Wall-clock time spent in each phase in the last processing cycle.', 'gauge', [(phase_labels(n), p[0]) for n, p in phases])
+        metric('phase_cpu_seconds', 'CPU time spent in each phase in the last processing cycle.', 'gauge', [(phase_labels(n), p[1]) for n, p in phases])
+        metric('phase_calls', 'Number of times each phase ran in the last processing cycle.', 'gauge', [(phase_labels(n), p[2]) for n, p in phases])
+
+        for n, v in sorted(self.counters.items()):
+            metric(n, 'Number of %s in the last processing cycle.' % n.replace('_', ' '), 'gauge', [('', v)])
+
+        for k in IO_KINDS:
+            samples = [('{subsystem="%s"}' % _escape(subsystem), c[k]) for subsystem, c in sorted(self.io.items()) if k in c]
+            if samples:
+                metric('io_%s' % k, 'Number of %s by each subsystem in the last processing cycle.' % k.replace('_', ' '), 'gauge', samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(s):
+    return s.replace('\\', '\\\\').replace('"', '\\"')
+
+
+# the metrics for the current cycle
+_current = Metrics()
+# the stack of subsystems entered, for each thread
+_local = threading.local()
+
+
+def current():
+    return _current
+
+
+#
+# start a new cycle
+#
+def start():
+    global _current
+    _current = Metrics()
+    return _current
+
+
+#
+# measure a phase
+#
+@contextmanager
+def phase(name):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        _current.record(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+
+def count(name, n=1):
+    _current.count(name, n)
+
+
+#
+# attribute I/O done within this context (or by this function, when used as a
+# decorator) to a subsystem, unless it's within another subsystem entered
+# later
+#
+@contextmanager
+def subsystem(name):
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+#
+# count I/O of a kind (one of IO_KINDS), attributed to the current subsystem
+#
+def io(kind, n=1):
+    stack = getattr(_local, 'stack', None)
+    _current.count_io(stack[-1] if stack else 'other', kind, n)
+
+
+#
+# count the I/O done in opening and reading (so far) the tar archive a, opened
+# from the file fn
+#
+# the compressed bytes read are the position in the underlying file of the
+# decompressor (which may be well short of the end of the file, if not all of
+# the archive has been read), except for those compressions which xtarfile
+# decompresses in their entirety into a temporary file first.
+#
+def archive_io(a, fn):
+    io('archives')
+    io('opens')
+
+    f = a.fileobj
+    # (the underlying file of an LZMAFile or BZ2File, or a GzipFile)
+    f = getattr(f, '_fp', None) or getattr(f, 'fileobj', None) or f
+    if os.path.abspath(getattr(f, 'name', '')) == os.path.abspath(fn):
+        io('bytes_read', f.tell())
+    else:
+        io('stats')
+        io('bytes_read', os.path.getsize(fn))
+
+    io('bytes_decompressed', a.offset)
+
+
+#
+# finish the current cycle, and write out its metrics
+#
+def finish(args):
+    m = _current
+    m.finish()
+
+    if args.dryrun:
+        return m
+
+    try:
+        # (atomically, so the collector never sees a partial file)
+        with tempfile.NamedTemporaryFile(mode='w', dir=args.htdocs, prefix='.', delete=False) as f:
+            f.write(m.prometheus())
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, os.path.join(args.htdocs, PROMETHEUS_FILE))
+
+        history = os.path.join(args.htdocs, HISTORY_FILE)
+        if os.path.exists(history) and os.path.getsize(history) > HISTORY_MAX_SIZE:
+            os.replace(history, history + '.1')
+        with open(history, 'a') as f:
+            print(json.dumps(m.as_dict()), file=f)
+    except OSError as e:
+        logging.warning("writing metrics failed: %s" % (e))
+
+    return m
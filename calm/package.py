@@ -42,6 +42,7 @@ import xtarfile
 from . import common_constants
 from . import hint
 from . import maintainers
+from . import metrics
 from . import past_mistakes
 from . import utils
 from .movelist import MoveList
@@ -187,7 +188,9 @@ def read_packages(rel_area):
     for root in ['noarch', 'src'] + common_constants.ARCHES:
         releasedir = os.path.join(rel_area, root)
 
-        for (dirpath, _subdirs, files) in os.walk(releasedir, followlinks=True):
+        for (dirpath, subdirs, files) in os.walk(releasedir, followlinks=True):
+            # ignore dot-directories (e.g. generations of setup.ini)
+            subdirs[:] = [d for d in subdirs if not d.startswith('.')]
             result = collect_files_package_dir(collected, rel_area, dirpath, files) or result
 
     # then read each package
@@ -203,6 +206,8 @@ def read_packages(rel_area):
             result = read_one_package(packages, p, rel_area, fl[kind] + fl['all'], kind, strict=False) or result
 
     logging.debug("%d packages read from %s" % (len(packages), rel_area))
+    metrics.count('packages', len(packages))
+    metrics.count('files', sum(len(fl[k]) for fl in collected.values() for k in fl))
 
     return (packages, result)
 
@@ -213,8 +218,11 @@ def sha512_file_hash(fn, block_size=256 * 128):
     sha512 = hashlib.sha512()
 
     with open(fn, 'rb') as f:
+        metrics.io('opens')
         for chunk in iter(lambda: f.read(block_size), b''):
             sha512.update(chunk)
+            metrics.count('bytes_hashed', len(chunk))
+            metrics.io('bytes_read', len(chunk))
 
     return sha512.hexdigest()
 
@@ -224,7 +232,9 @@ def sha512_file_hash(fn, block_size=256 * 128):
 def sha512sum_file_read(sum_fn):
     sha512 = {}
     with open(sum_fn) as fo:
+        metrics.io('opens')
         for l in fo:
+            metrics.io('bytes_read', len(l))
             match = re.match(r'^(\S+)\s+(?:\*|)(\S+)$', l)
             if match:
                 sha512[match.group(2)] = match.group(1)
@@ -237,10 +247,14 @@ def sha512sum_file_read(sum_fn):
 # helper function to determine sha512 for a particular file
 #
 # read sha512 checksum from a sha512.sum file, if present, otherwise compute it
+@metrics.subsystem('sha512_file')
 def sha512_file(fn):
     (dirname, basename) = os.path.split(fn)
     sum_fn = os.path.join(dirname, 'sha512.sum')
+    metrics.io('stats')
     if os.path.exists(sum_fn):
+        # (the cached contents are checked against the mtime)
+        metrics.io('stats')
         sha512 = sha512sum_file_read(sum_fn)
         if basename in sha512:
             return sha512[basename]
@@ -425,6 +439,7 @@ def collect_files_package_dir(collected, basedir, dirpath, files):
 #
 # read a single package
 #
+@metrics.subsystem('read_one_package')
 def read_one_package(packages, p, basedir, files, kind, strict):
     warnings = False
     error = False
@@ -560,6 +575,7 @@ def read_one_package(packages, p, basedir, files, kind, strict):
             t.size = os.path.getsize(rp.abspath(basedir))
             t.is_empty = tarfile_is_empty(rp.abspath(basedir))
             t.mtime = os.path.getmtime(rp.abspath(basedir))
+            metrics.io('stats', 2)
             t.sha512 = sha512_file(rp.abspath(basedir))
 
             # record the arch_tag (or what it would have been, if not omitted)
@@ -630,6 +646,7 @@ def read_one_package(packages, p, basedir, files, kind, strict):
         hintobj.repopath = rp
         hintobj.hints = pvr_hint
         hintobj.mtime = os.path.getmtime(rp.abspath(basedir))
+        metrics.io('stats')
 
         actual_hints[ovr] = hintobj
         if vr in tars:
@@ -656,8 +673,10 @@ def read_one_package(packages, p, basedir, files, kind, strict):
 #
 # utility to determine if a tar file is empty
 #
+@metrics.subsystem('tarfile_is_empty')
 def tarfile_is_empty(tf):
     size = os.path.getsize(tf)
+    metrics.io('stats')
 
     # report invalid files (smaller than the smallest possible compressed file
     # for any of the compressions we support)
@@ -679,7 +698,10 @@ def tarfile_is_empty(tf):
     # if it's really a tar file, does it contain zero files?
     try:
         with xtarfile.open(tf, mode='r') as a:
-            if any(a) == 0:
+            empty = not any(a)
+            metrics.count('bytes_decompressed', a.offset)
+            metrics.archive_io(a, tf)
+            if empty:
                 return True
     except Exception as e:
         logging.error("exception %s while reading %s" % (type(e).__name__, tf))
@@ -1302,14 +1324,70 @@ def packages_warnings(args, packages, *modified):
                     logging.warning("package '%s' doesn't have any non-test versions (i.e. no curr: version)" % (p))
 
 
+#
+# a digest of setup.ini content, which ignores the timestamp, comments and
+# whitespace, so it only changes when the content changes in a way which
+# matters to setup
+#
+class SetupIniDigest(object):
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._partial = ''
+
+    def update(self, s):
+        lines = (self._partial + s).split('\n')
+        self._partial = lines.pop()
+        for l in lines:
+            self._update_line(self._hash, l)
+
+    @staticmethod
+    def _update_line(h, l):
+        if l.startswith('setup-timestamp') or l.startswith('#'):
+            return
+
+        l = ''.join(l.split())
+        if l:
+            h.update(l.encode() + b'\n')
+
+    def hexdigest(self):
+        h = self._hash.copy()
+        self._update_line(h, self._partial)
+        return h.hexdigest()
+
+
+# a file-like wrapper which updates a digest with everything written through it
+class _DigestingWriter(object):
+    def __init__(self, f, digest):
+        self._f = f
+        self._digest = digest
+
+    def write(self, s):
+        self._digest.update(s)
+        return self._f.write(s)
+
+
+# compute the SetupIniDigest of an existing setup.ini file
+def setup_ini_digest(fn):
+    digest = SetupIniDigest()
+    with open(fn) as f:
+        for l in f:
+            digest.update(l)
+
+    return digest.hexdigest()
+
+
 #
 # write setup.ini
 #
+# returns the SetupIniDigest of the content written
+#
 def write_setup_ini(args, packages, arch):
 
     logging.debug('writing %s' % (args.inifile))
 
-    with open(args.inifile, 'w') as f:
+    digest = SetupIniDigest()
+    with open(args.inifile, 'w') as fo:
+        f = _DigestingWriter(fo, digest)
         tz = time.time()
         # write setup.ini header
         print(textwrap.dedent('''\
@@ -1511,6 +1589,8 @@ def write_setup_ini(args, packages, arch):
                     if hints.get('conflicts', ''):
                         print("conflicts: %s" % ', '.join(hints['conflicts']), file=f)
 
+    return digest.hexdigest()
+
 
 # helper function to output details for a particular tar file
 def tar_line(p, category, v, f):
@@ -1531,89 +1611,178 @@ def upper_first_character(s):
 #
 #
 
-def _find_build_recipe_file(args, pn):
+# index the packaging repositories which exist in repodir
+def build_recipe_repos(args):
+    repos = set()
     if args.repodir:
-        repo = os.path.join(args.repodir, '%s.git' % pn)
-        if os.path.exists(repo):
-            # XXX: we might want to check contents of the repo to determine if this
-            # package has a cygport or g-b-s build script
-            return 'https://cygwin.com/cgit/cygwin-packages/%s/tree/%s.cygport' % (pn, pn)
+        try:
+            for f in os.listdir(args.repodir):
+                if f.endswith('.git'):
+                    repos.add(f[:-len('.git')])
+        except FileNotFoundError:
+            pass
+
+    return repos
+
+
+def _find_build_recipe_file(repos, pn):
+    if pn in repos:
+        # XXX: we might want to check contents of the repo to determine if this
+        # package has a cygport or g-b-s build script
+        return 'https://cygwin.com/cgit/cygwin-packages/%s/tree/%s.cygport' % (pn, pn)
 
     return None
 
 
+# the hints of subpackages which appear in packages.json
+REPO_JSON_SUBPACKAGE_HINTS = ['depends', 'provides', 'obsoletes']
+
+# the hints of source packages which appear in packages.json
+REPO_JSON_PACKAGE_HINTS = ['homepage', 'license', 'build-depends']
+
+
 #
-# write a json summary of packages
+# everything which the packages.json entry for a source package depends upon
 #
-def write_repo_json(args, packages, f):
-    pkg_maintainers = maintainers.pkg_list(args.pkglist)
+# this is much cheaper to compute than the entry itself, so is used as a
+# fingerprint, to identify when a cached entry can be reused
+#
+def _repo_json_inputs(packages, po, repos, pkg_maintainers):
+    bv = po.best_version
 
-    pl = []
-    for pn in sorted(packages):
-        po = packages[pn]
-        arches = common_constants.ARCHES  # XXX: multiarch TODO: set of arches which have this package
+    subpackages = []
+    for sp in sorted(po.is_used_by):
+        spo = packages[sp]
+        hints = spo.hints(spo.best_version)
+        subpackages.append((sp, hints.get('category', ''), [hints.get(k, None) for k in REPO_JSON_SUBPACKAGE_HINTS]))
 
-        def package(p):
-            if p in packages:
-                return packages[p]
+    m = pkg_maintainers.get(po.orig_name, None)
 
-            # will lead to AttributeError as has no hints method
-            return None
+    return (po.orig_name,
+            sorted((vr, 'test' in po.hints(vr)) for vr in po.versions()),
+            po.hints(bv)['sdesc'],
+            [po.hints(bv).get(k, None) for k in REPO_JSON_PACKAGE_HINTS],
+            str(po.importance),
+            getattr(po, 'up_to_date', 1),
+            hasattr(po, 'upstream_version'),
+            str(getattr(po, 'upstream_version', None)),
+            subpackages,
+            po.orig_name in repos,
+            sorted(m.maintainers()) if m and not m.is_orphaned() else None)
 
-        bv = po.best_version
 
-        if po.kind != Kind.source:
-            continue
+#
+# the packages.json entry for a source package
+#
+def _repo_json_package(packages, po, repos, pkg_maintainers):
+    arches = common_constants.ARCHES  # XXX: multiarch TODO: set of arches which have this package
+
+    def package(p):
+        if p in packages:
+            return packages[p]
+
+        # will lead to AttributeError as has no hints method
+        return None
+
+    bv = po.best_version
+
+    versions = {}
+    for vr in sorted(po.versions(), key=lambda v: SetupVersion(v)):
+        key = 'test' if 'test' in po.hints(vr) else 'stable'
+        versions[key] = versions.get(key, []) + [vr]
 
-        versions = {}
-        for vr in sorted(po.versions(), key=lambda v: SetupVersion(v)):
-            key = 'test' if 'test' in po.hints(vr) else 'stable'
-            versions[key] = versions.get(key, []) + [vr]
+    up_to_date = getattr(po, 'up_to_date', 1)
 
-        up_to_date = getattr(po, 'up_to_date', 1)
+    d = {
+        'name': po.orig_name,
+        'versions': versions,
+        'summary': po.hints(bv)['sdesc'].strip('"'),
+        'arches': arches,
+        'importance': str(po.importance),
+        'up_to_date': 'no' if up_to_date < 0 else 'yes' if up_to_date == 0 else 'unknown',
+    }
 
-        d = {
-            'name': po.orig_name,
-            'versions': versions,
-            'summary': po.hints(bv)['sdesc'].strip('"'),
-            'arches': arches,
-            'importance': str(po.importance),
-            'up_to_date': 'no' if up_to_date < 0 else 'yes' if up_to_date == 0 else 'unknown',
-        }
+    if hasattr(po, 'upstream_version'):
+        d['upstream_version'] = str(po.upstream_version)
 
-        if hasattr(po, 'upstream_version'):
-            d['upstream_version'] = str(po.upstream_version)
+    spl = []
+    for sp in sorted(po.is_used_by):
+        hints = package(sp).hints(package(sp).best_version)
+        sp = {'name': sp, 'categories': hints.get('category', '').split()}
+        for k in REPO_JSON_SUBPACKAGE_HINTS:
+            if hints.get(k, None):
+                sp[k] = hints[k]
+        spl.append(sp)
+    d['subpackages'] = spl
 
-        spl = []
-        for sp in sorted(po.is_used_by):
-            hints = package(sp).hints(package(sp).best_version)
-            sp = {'name': sp, 'categories': hints.get('category', '').split()}
-            for k in ['depends', 'provides', 'obsoletes']:
-                if hints.get(k, None):
-                    sp[k] = hints[k]
-            spl.append(sp)
-        d['subpackages'] = spl
+    for k in REPO_JSON_PACKAGE_HINTS:
+        if k in po.hints(bv):
+            d[k] = po.hints(bv)[k]
 
-        for k in ['homepage', 'license', 'build-depends']:
-            if k in po.hints(bv):
-                d[k] = po.hints(bv)[k]
+    build_recipe = _find_build_recipe_file(repos, po.orig_name)
+    if build_recipe:
+        d['build_recipe'] = build_recipe
 
-        build_recipe = _find_build_recipe_file(args, po.orig_name)
-        if build_recipe:
-            d['build_recipe'] = build_recipe
+    if (po.orig_name in pkg_maintainers) and (not pkg_maintainers[po.orig_name].is_orphaned()):
+        d['maintainers'] = sorted(pkg_maintainers[po.orig_name].maintainers())
 
-        if (po.orig_name in pkg_maintainers) and (not pkg_maintainers[po.orig_name].is_orphaned()):
-            d['maintainers'] = sorted(pkg_maintainers[po.orig_name].maintainers())
+    return d
 
-        pl.append(d)
+
+#
+# write a json summary of packages
+#
+# the entry for each source package is written as it is generated, so f can be
+# a compressor stream.
+#
+# if a cache dict is provided, it is used to keep the encoded entries between
+# calls, so only those for packages which have changed are re-generated.
+#
+def write_repo_json(args, packages, f, cache=None):
+    pkg_maintainers = maintainers.pkg_list(args.pkglist)
+    repos = build_recipe_repos(args)
+
+    if cache is None:
+        cache = {}
+
+    fragments = []
+    reused = 0
+    for pn in sorted(packages):
+        po = packages[pn]
+
+        if po.kind != Kind.source:
+            continue
+
+        inputs = _repo_json_inputs(packages, po, repos, pkg_maintainers)
+        if (pn in cache) and (cache[pn][0] == inputs):
+            fragment = cache[pn][1]
+            reused += 1
+        else:
+            fragment = json.dumps(_repo_json_package(packages, po, repos, pkg_maintainers))
+            # (copied, so later changes to the hints don't affect it)
+            cache[pn] = (copy.deepcopy(inputs), fragment)
+
+        fragments.append(fragment)
+
+    # forget about packages which have gone away
+    for pn in set(cache) - set(packages):
+        del cache[pn]
+
+    logging.debug("packages.json: %d entries, %d reused" % (len(fragments), reused))
 
     j = {
         'repository_name': args.release,
         'timestamp': int(time.time()),
-        'num_packages': len(pl),
-        'packages': pl,
+        'num_packages': len(fragments),
     }
-    json.dump(j, f)
+
+    # write the header, then stream the list of packages
+    f.write(json.dumps(j)[:-1] + ', "packages": [')
+    for i, fragment in enumerate(fragments):
+        if i:
+            f.write(', ')
+        f.write(fragment)
+    f.write(']}')
 
 
 #
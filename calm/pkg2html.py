@@ -35,17 +35,25 @@
 # - remove any .htaccess or listing files for which there was no package
 # - remove any directories which are now empty
 #
+# the list of files under HTDOCS is taken from a manifest of the files we've
+# generated (kept in the database), rather than by scanning the directory tree
+# every time. Occasionally, the manifest is reconciled with what's actually on
+# disk.
+#
 # note that the directory hierarchy of (noarch|arch)/package/subpackages is
 # flattened in the package listing to just the package name
 #
 
 import argparse
+import concurrent.futures
 import functools
 import glob
+import hashlib
 import html
 import logging
 import lzma
 import math
+import multiprocessing
 import os
 import re
 import string
@@ -61,15 +69,23 @@ import markdown
 import xtarfile
 
 from . import common_constants
+from . import db
 from . import maintainers
+from . import metrics
 from . import package
 from . import reports
 from . import utils
 from .version import SetupVersion
 
 
-summary_last_touched = {}
-SUMMARY_REWRITE_INTERVAL = (24 * 60 * 60)
+# this should be changed whenever the way summary pages are written changes, so
+# they all get rewritten
+SUMMARY_FORMAT = 1
+
+# how often the manifest of generated files is checked against the files which
+# actually exist in htdocs
+MANIFEST_RECONCILE_INTERVAL = (24 * 60 * 60)
+manifest_last_reconciled = 0
 
 
 #
@@ -129,20 +145,156 @@ def tsformat(ts):
         return time.strftime('%Y-%m-%d %H:%M', time.gmtime(ts))
 
 
+#
+# the set of files we have generated in htdocs
+#
+# this is kept in the database, so we can identify files which are no longer
+# needed without having to scan htdocs
+#
+class Manifest(object):
+    def __init__(self, args):
+        self.args = args
+        self.files = db.generated_files(args)
+        self._recorded = set(self.files)
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.args.htdocs)
+
+    def __contains__(self, path):
+        return self._relpath(path) in self.files
+
+    def add(self, path):
+        self.files.add(self._relpath(path))
+
+    def discard(self, path):
+        self.files.discard(self._relpath(path))
+
+    # the files in the manifest which are depth levels below a directory (i.e.
+    # what glob(dirpath/*/*) would find for depth=2)
+    def glob(self, dirpath, depth=1):
+        prefix = self._relpath(dirpath) + os.sep
+        return set(os.path.join(self.args.htdocs, f) for f in self.files
+                   if f.startswith(prefix) and f[len(prefix):].count(os.sep) == depth - 1)
+
+    # check the manifest against the files which actually exist
+    def reconcile(self, dirpath, depth=1, dotfiles=False):
+        pattern = os.path.join(dirpath, *(['*'] * depth))
+        found = set(glob.glob(pattern))
+        if dotfiles:
+            found.update(glob.glob(os.path.join(os.path.dirname(pattern), '.*')))
+        recorded = self.glob(dirpath, depth)
+
+        for f in sorted(found - recorded):
+            logging.debug("manifest didn't record %s" % (f))
+            self.add(f)
+
+        for f in sorted(recorded - found):
+            logging.debug("manifest recorded non-existent %s" % (f))
+            self.discard(f)
+
+        if found != recorded:
+            logging.info("manifest of %s had %d missing and %d non-existent files" % (dirpath, len(found - recorded), len(recorded - found)))
+
+        return found
+
+    # write any changes back to the database
+    def commit(self):
+        if not self.args.dryrun:
+            db.generated_files_update(self.args, self.files - self._recorded, self._recorded - self.files)
+            self._recorded = set(self.files)
+
+
+#
+# a fingerprint of everything the summary page for a package is made from
+#
+def summary_fingerprint(packages, p, pkg_maintainers, repos, docs):
+    po = packages[p]
+    bv = po.best_version
+
+    if po.kind == package.Kind.source:
+        es = p
+    else:
+        es = po.srcpackage(bv)
+
+    es_po = packages.get(es, po)
+    m = pkg_maintainers.get(es_po.orig_name, None)
+
+    attrs = {}
+    for a in ['obsoleted_by', 'rdepends', 'build_rdepends', 'is_used_by']:
+        attrs[a] = sorted(getattr(po, a, set()))
+
+    # packages which might be linked to, and how
+    linked = set([es])
+    for k in ['depends', 'obsoletes', 'provides', 'conflicts', 'build-depends']:
+        linked.update(po.hints(bv).get(k, []))
+    for a in attrs:
+        linked.update(attrs[a])
+    linked = [re.sub(r'(.*)\s+\(.*\)', r'\1', l) for l in sorted(linked)]
+    linked = [(l, packages[l].orig_name if l in packages else None) for l in linked]
+
+    versions = []
+    for v in sorted(po.versions()):
+        to = po.tar(v)
+        versions.append((v, to.size, to.mtime, to.arch, 'test' in po.hints(v)))
+
+    inputs = (
+        SUMMARY_FORMAT,
+        p,
+        po.orig_name,
+        po.kind,
+        po.hints(bv),
+        attrs,
+        linked,
+        (sorted(m.maintainers()), m.is_orphaned(), m.groups()) if m else None,
+        po.orig_name in repos,
+        getattr(po, 'repology_project_name', None),
+        getattr(po, 'upstream_version', None),
+        str(getattr(po, 'importance', None)),
+        versions,
+        p in docs,
+    )
+
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+
 #
 #
 #
 
 def update_package_listings(args, packages):
+    global manifest_last_reconciled
+
+    manifest = Manifest(args)
+
+    # occasionally (and when we've just started, or have no manifest), check
+    # the manifest is consistent with the files which actually exist
+    now = time.time()
+    reconcile = (now > manifest_last_reconciled + MANIFEST_RECONCILE_INTERVAL) or not manifest.files
+    if reconcile:
+        logging.debug("reconciling manifest of generated files")
+        manifest_last_reconciled = now
+
     update_summary = set()
-    update_summary.update(write_package_listings(args, packages))
+    update_summary.update(write_package_listings(args, packages, manifest, reconcile))
 
     summaries = os.path.join(args.htdocs, 'summary')
     ensure_dir_exists(args, summaries)
 
     pkg_maintainers = maintainers.pkg_list(args.pkglist)
 
-    toremove = glob.glob(os.path.join(summaries, '*'))
+    repos = package.build_recipe_repos(args)
+
+    docs = set()
+    if os.path.exists(os.path.join(args.htdocs, 'doc')):
+        docs = set(os.listdir(os.path.join(args.htdocs, 'doc')))
+
+    fingerprints = db.summary_fingerprints(args)
+    changed_fingerprints = {}
+
+    if reconcile:
+        toremove = manifest.reconcile(summaries)
+    else:
+        toremove = manifest.glob(summaries)
 
     def linkify_package(pkg):
         p = re.sub(r'(.*)\s+\(.*\)', r'\1', pkg)
@@ -153,8 +305,6 @@ def update_package_listings(args, packages):
         logging.debug('package linkification failed for %s' % p)
         return p
 
-    now = time.time()
-
     for p in packages:
         #
         # write package summary
@@ -165,8 +315,7 @@ def update_package_listings(args, packages):
         summary = os.path.join(summaries, p + '.html')
 
         # this file should exist, so remove from the toremove list
-        if summary in toremove:
-            toremove.remove(summary)
+        toremove.discard(summary)
 
         po = packages[p]
         bv = po.best_version
@@ -174,24 +323,16 @@ def update_package_listings(args, packages):
         # update summary if:
         # - it doesn't already exist,
         # - or, listing files (i.e packages versions) were added or removed,
-        # - or, hints have changed since it was written
-        # - or, SUMMARY_REWRITE_INTERVAL has elapsed since it was last written
+        # - or, anything it's made from has changed since it was written
         # - or, forced
-        hint_mtime = po.hint_data(bv).mtime
-
-        summary_mtime = 0
-        if os.path.exists(summary):
-            summary_mtime = os.path.getmtime(summary)
+        fingerprint = summary_fingerprint(packages, p, pkg_maintainers, repos, docs)
 
-        if (p in update_summary) or (summary_mtime < hint_mtime) or (now > summary_last_touched.get(p, 0) + SUMMARY_REWRITE_INTERVAL) or args.force:
+        if (p in update_summary) or (summary not in manifest) or (fingerprints.get(p, None) != fingerprint) or args.force:
             if not args.dryrun:
-                summary_last_touched[p] = now
+                if fingerprints.get(p, None) != fingerprint:
+                    changed_fingerprints[p] = fingerprint
 
-                # if older than hint, touch it so we don't keep on trying to
-                # update it here, if hint has changed in a way that doesn't
-                # affect summary page
-                if summary_mtime < hint_mtime:
-                    utils.touch(summary, now)
+                manifest.add(summary)
 
                 with utils.open_amifc(summary) as f:
                     os.fchmod(f.fileno(), 0o755)
@@ -318,11 +459,9 @@ def update_package_listings(args, packages):
                         details_table['groups'] = ','.join(pkg_groups)
 
                     if po.kind == package.Kind.source:
-                        if args.repodir:
-                            repo = os.path.join(args.repodir, '%s.git' % pn)
-                            if os.path.exists(repo):
-                                repo_browse_url = '/cgit/cygwin-packages/%s/' % pn
-                                details_table['packaging repository'] = '<a href="%s">%s.git</a>' % (repo_browse_url, pn)
+                        if pn in repos:
+                            repo_browse_url = '/cgit/cygwin-packages/%s/' % pn
+                            details_table['packaging repository'] = '<a href="%s">%s.git</a>' % (repo_browse_url, pn)
 
                         repology_pn = getattr(po, 'repology_project_name', None)
                         if repology_pn:
@@ -338,7 +477,7 @@ def update_package_listings(args, packages):
 
                     if po.kind == package.Kind.binary:
                         doc_path = os.path.join(args.htdocs, 'doc', pn)
-                        if os.path.exists(doc_path):
+                        if pn in docs:
                             links = []
 
                             for readme in sorted(os.listdir(doc_path)):
@@ -387,10 +526,18 @@ def update_package_listings(args, packages):
                     </body>
                     </html>'''), file=f)
 
-    for r in toremove:
+    for r in sorted(toremove):
         logging.debug('rm %s' % r)
         if not args.dryrun:
             os.unlink(r)
+            manifest.discard(r)
+
+    manifest.commit()
+
+    # remember the fingerprints of summaries written, and forget those of
+    # packages which have gone away
+    if not args.dryrun:
+        db.summary_fingerprints_update(args, changed_fingerprints, set(fingerprints) - set(packages))
 
     write_packages_inc(args, packages, 'packages.inc', package.Kind.binary, 'package_list.html')
     write_packages_inc(args, packages, 'src_packages.inc', package.Kind.source, 'src_package_list.html')
@@ -482,7 +629,7 @@ def write_packages_inc(args, packages, name, kind, includer):
 doc_inc_overrides = {'X': 'https://x.cygwin.com/'}
 
 
-def write_doc_inc(args):
+def write_doc_inc(args, manifest):
     packages_inc = os.path.join(args.htdocs, 'packages_docs.inc')
     if not args.dryrun:
         htaccess = os.path.join(args.htdocs, 'doc', '.htaccess')
@@ -490,6 +637,7 @@ def write_doc_inc(args):
             with utils.open_amifc(htaccess) as f:
                 # README files are text
                 print('AddType text/plain README', file=f)
+            manifest.add(htaccess)
 
         package_docs = os.path.join(args.htdocs, 'package_docs.html')
         with utils.open_amifc(packages_inc, cb=functools.partial(touch_including, package_docs)) as index:
@@ -524,9 +672,170 @@ def write_doc_inc(args):
             print('</div>', file=index)
 
 
-def write_package_listings(args, packages):
+#
+# everything needed to write the listing of a tarfile's contents
+#
+class ListingJob(NamedTuple):
+    listing: str
+    tf: str
+    p: str
+    desc: str
+
+
+#
+# write the listing of a tarfile's contents
+#
+# this only depends on the ListingJob, so can be done in another process.
+#
+# returns a list of (filename, contents) tuples for any Cygwin-specific READMEs
+# found, which should be written to the documents directory.
+#
+@metrics.subsystem('pkg2html')
+def write_listing(job):
+    readmes = []
+
+    with utils.open_amifc(job.listing) as f:
+        print(textwrap.dedent('''\
+                                 <!DOCTYPE html>
+                                 <html>
+                                 <head>
+                                 <title>%s: %s</title>
+                                 </head>
+                                 <body>
+                                 <h1><a href="/packages/summary/%s.html">%s</a>: %s</h1>
+                                 <pre>''' % (job.p, job.desc, job.p, job.p, job.desc)), file=f)
+
+        tf = job.tf
+        size = None
+        metrics.io('stats')
+        if os.path.exists(tf):
+            size = os.path.getsize(tf)
+            metrics.io('stats')
+
+        if size is None:
+            # this shouldn't happen with a full mirror
+            logging.error("tarfile %s not found" % (tf))
+        elif size <= 32:
+            # compressed empty files aren't a valid tar file,
+            # but we can just ignore them
+            pass
+        else:
+            try:
+                with xtarfile.open(tf, mode='r') as a:
+                    for i in a:
+                        print('    %-16s%12d %s' % (time.strftime('%Y-%m-%d %H:%M', time.gmtime(i.mtime)), i.size, i.name), file=f, end='')
+                        if i.isdir():
+                            print('/', file=f, end='')
+                        if i.issym() or i.islnk():
+                            print(' -> %s' % i.linkname, file=f, end='')
+                        print('', file=f)
+
+                        # extract Cygwin-specific READMEs
+                        if i.name.startswith('usr/share/doc/Cygwin/') and i.name.endswith('README'):
+                            logging.info("extracting %s to cygwin-specific documents directory" % (i.name))
+
+                            readme_text = a.extractfile(i).read()
+                            # redact email addresses
+                            readme_text = re.sub(rb'<(.*)@(.*)>', rb'<\1 at \2>', readme_text)
+
+                            # accommodate an historical error where the README was installed as
+                            # $PN-$PV.README, by stripping off any version suffix after the
+                            # package name
+                            basename = re.sub(r'(.*)-[.0-9ga]*.README', r'\1.README', os.path.basename(i.name))
+
+                            readmes.append((basename, readme_text))
+
+                    metrics.count('bytes_decompressed', a.offset)
+                    metrics.archive_io(a, tf)
+
+            except (tarfile.TarError, lzma.LZMAError) as e:
+                print('package is corrupted', file=f)
+                logging.error("exception %s while reading %s" % (type(e).__name__, tf))
+                logging.debug('', exc_info=True)
+
+        print(textwrap.dedent('''\
+                                 </pre>
+                                 </body>
+                                 </html>'''), file=f)
+
+    return readmes
+
+
+# a log handler which just collects the records
+class _CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # make the record picklable
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        self.records.append(record)
+
+
+# set up logging in a worker process
+#
+# (a process started by a forkserver doesn't inherit the parent's logging
+# configuration, so log records below the default level would be dropped
+# before they could be collected)
+def _init_listing_worker(level):
+    logging.getLogger().setLevel(level)
+
+
+# write_listing(), in a worker process
+#
+# log records are collected and returned, rather than being handled here, so
+# they can be handled by the parent (in order), as are the metrics counted
+def _write_listing_worker(job):
+    collector = _CollectingHandler()
+    root = logging.getLogger()
+    saved_handlers = root.handlers
+    root.handlers = [collector]
+    m = metrics.start()
+    try:
+        readmes = write_listing(job)
+    finally:
+        root.handlers = saved_handlers
+
+    return (collector.records, readmes, m)
+
+
+#
+# write the listings for a list of ListingJobs, using a pool of args.jobs
+# processes
+#
+# the worker processes are started by a forkserver, rather than by forking this
+# (possibly multi-threaded) process, since threads holding locks at the time
+# of the fork could leave them locked forever in the child.
+#
+# yields the result of write_listing() for each job, in order
+#
+def write_listings(args, jobs):
+    njobs = getattr(args, 'jobs', 1) or 1
+
+    if njobs > 1 and len(jobs) > 1:
+        logging.debug("writing %d listings using %d processes" % (len(jobs), njobs))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=njobs, mp_context=multiprocessing.get_context('forkserver'),
+                                                    initializer=_init_listing_worker, initargs=(logging.getLogger().getEffectiveLevel(),)) as executor:
+            for (records, readmes, m) in executor.map(_write_listing_worker, jobs, chunksize=4):
+                for r in records:
+                    logging.getLogger().handle(r)
+                metrics.current().merge(m)
+                yield readmes
+    else:
+        for job in jobs:
+            yield write_listing(job)
+
+
+def write_package_listings(args, packages, manifest, reconcile=False):
     update_summary = set()
     update_doc_inc = False
+    jobs = []
 
     # collect together a list of all the listing files
     #
@@ -553,19 +862,28 @@ def write_package_listings(args, packages):
 
                     print('Redirect temp /packages/%s/index.html https://cygwin.com/packages/package_list.html' % (arch),
                           file=f)
+                manifest.add(htaccess)
 
-        toremove.update(glob.glob(os.path.join(base, '*', '*')))
-        toremove.update(glob.glob(os.path.join(base, '*', '.*')))
+        if reconcile:
+            toremove.update(manifest.reconcile(base, depth=2, dotfiles=True))
+        else:
+            toremove.update(manifest.glob(base, depth=2))
 
     for p in packages:
 
         def check_directory_setup(dirpath):
-            ensure_dir_exists(args, dirpath)
-
             #
             # write .htaccess if needed
             #
+            # (if it's in the manifest, this directory has already been set up)
+            #
             htaccess = os.path.join(dirpath, '.htaccess')
+            if htaccess in manifest:
+                toremove.discard(htaccess)
+                return
+
+            ensure_dir_exists(args, dirpath)
+
             if not os.path.exists(htaccess):
                 if not args.dryrun or args.force:
                     with utils.open_amifc(htaccess) as f:
@@ -580,9 +898,11 @@ def write_package_listings(args, packages):
                         # listing files don't have the extension, but are html
                         print('ForceType text/html', file=f)
 
+            if os.path.exists(htaccess):
+                manifest.add(htaccess)
+
             # this file should exist, so remove from the toremove list
-            if htaccess in toremove:
-                toremove.remove(htaccess)
+            toremove.discard(htaccess)
 
         #
         # for each tarfile, write tarfile listing
@@ -602,84 +922,43 @@ def write_package_listings(args, packages):
             check_directory_setup(dirpath)
 
             # ... if it doesn't already exist, or --force --force
-            if not os.path.exists(listing) or (args.force > 1):
+            if (listing not in manifest) or (args.force > 1):
 
                 if not args.dryrun:
                     # versions are being added, so summary needs updating
                     update_summary.add(p)
 
-                    with utils.open_amifc(listing) as f:
-                        bv = packages[p].best_version
-                        desc = sdesc(packages[p], bv)
-
-                        if packages[p].kind == package.Kind.source:
-                            desc = desc + " (source)"
-
-                        print(textwrap.dedent('''\
-                                                 <!DOCTYPE html>
-                                                 <html>
-                                                 <head>
-                                                 <title>%s: %s</title>
-                                                 </head>
-                                                 <body>
-                                                 <h1><a href="/packages/summary/%s.html">%s</a>: %s</h1>
-                                                 <pre>''' % (p, desc, p, p, desc)), file=f)
-
-                        tf = to.repopath.abspath(args.rel_area)
-                        if not os.path.exists(tf):
-                            # this shouldn't happen with a full mirror
-                            logging.error("tarfile %s not found" % (tf))
-                        elif os.path.getsize(tf) <= 32:
-                            # compressed empty files aren't a valid tar file,
-                            # but we can just ignore them
-                            pass
-                        else:
-                            try:
-                                with xtarfile.open(tf, mode='r') as a:
-                                    for i in a:
-                                        print('    %-16s%12d %s' % (time.strftime('%Y-%m-%d %H:%M', time.gmtime(i.mtime)), i.size, i.name), file=f, end='')
-                                        if i.isdir():
-                                            print('/', file=f, end='')
-                                        if i.issym() or i.islnk():
-                                            print(' -> %s' % i.linkname, file=f, end='')
-                                        print('', file=f)
-
-                                        # extract Cygwin-specific READMEs
-                                        if i.name.startswith('usr/share/doc/Cygwin/') and i.name.endswith('README'):
-                                            logging.info("extracting %s to cygwin-specific documents directory" % (i.name))
-
-                                            readme_text = a.extractfile(i).read()
-                                            # redact email addresses
-                                            readme_text = re.sub(rb'<(.*)@(.*)>', rb'<\1 at \2>', readme_text)
-
-                                            doc_dir = os.path.join(args.htdocs, 'doc', p)
-                                            ensure_dir_exists(args, doc_dir)
-
-                                            # accommodate an historical error where the README was installed as
-                                            # $PN-$PV.README, by stripping off any version suffix after the
-                                            # package name
-                                            basename = re.sub(r'(.*)-[.0-9ga]*.README', r'\1.README', os.path.basename(i.name))
-
-                                            with open(os.path.join(doc_dir, basename), mode='wb') as readme:
-                                                readme.write(readme_text)
-
-                                            update_doc_inc = True
-
-                            except (tarfile.TarError, lzma.LZMAError) as e:
-                                print('package is corrupted', file=f)
-                                logging.error("exception %s while reading %s" % (type(e).__name__, tf))
-                                logging.debug('', exc_info=True)
-
-                        print(textwrap.dedent('''\
-                                                 </pre>
-                                                 </body>
-                                                 </html>'''), file=f)
+                    bv = packages[p].best_version
+                    desc = sdesc(packages[p], bv)
+
+                    if packages[p].kind == package.Kind.source:
+                        desc = desc + " (source)"
+
+                    jobs.append(ListingJob(listing, to.repopath.abspath(args.rel_area), p, desc))
             else:
                 logging.log(5, 'not writing %s, already exists' % listing)
 
             # this file should exist, so remove from the toremove list
-            if listing in toremove:
-                toremove.remove(listing)
+            toremove.discard(listing)
+
+    #
+    # write the listings, then any Cygwin-specific READMEs extracted while doing
+    # that
+    #
+    for (job, readmes) in zip(jobs, write_listings(args, jobs)):
+        if os.path.exists(job.listing):
+            manifest.add(job.listing)
+
+        for (basename, readme_text) in readmes:
+            doc_dir = os.path.join(args.htdocs, 'doc', job.p)
+            ensure_dir_exists(args, doc_dir)
+
+            readme_fn = os.path.join(doc_dir, basename)
+            with open(readme_fn, mode='wb') as readme:
+                readme.write(readme_text)
+            manifest.add(readme_fn)
+
+            update_doc_inc = True
 
     #
     # remove any remaining files for which there was no corresponding package
@@ -694,6 +973,7 @@ def write_package_listings(args, packages):
 
             # remove the file
             os.unlink(r)
+            manifest.discard(r)
 
             # remove any directories which are now empty
             dirpath = os.path.dirname(r)
@@ -703,7 +983,7 @@ def write_package_listings(args, packages):
 
     # update the package documents list
     if update_doc_inc or args.force:
-        write_doc_inc(args)
+        write_doc_inc(args, manifest)
 
     return update_summary
 
@@ -717,6 +997,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Write HTML package listings')
     parser.add_argument('--force', action='store_true', help="overwrite existing files")
     parser.add_argument('--htdocs', action='store', metavar='DIR', help="htdocs output directory (default: " + htdocs_default + ")", default=htdocs_default)
+    parser.add_argument('-j', '--jobs', action='store', type=int, metavar='N', help="number of processes used to write package listings (default: 1)", default=1)
     parser.add_argument('--pkglist', action='store', metavar='FILE', help="package maintainer list (default: " + pkglist_default + ")", default=pkglist_default)
     parser.add_argument('--releasearea', action='store', metavar='DIR', help="release directory (default: " + relarea_default + ")", default=relarea_default, dest='rel_area')
     parser.add_argument('--repodir', action='store', metavar='DIR', help="packaging repositories directory (default: " + repodir_default + ")", default=repodir_default)
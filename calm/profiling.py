@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+
+#
+# profiling of selected phases of processing
+#
+# when enabled for a phase, it's run under cProfile and the profile is dumped
+# into a .pstats file for each cycle, in a directory where only the most recent
+# PROFILE_KEEP files are kept.
+#
+# optionally, a tracemalloc snapshot is also taken at the end of the phase, and
+# compared with that taken at the end of the same phase in the previous cycle,
+# to help track down memory growth.
+#
+
+import cProfile
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PHASES = ['read', 'validate', 'stale', 'output', 'listings', 'reports']
+# number of files kept in the profile directory
+PROFILE_KEEP = 100
+# number of lines in tracemalloc comparisons
+TRACEMALLOC_TOP = 25
+
+_dir = None
+# the phases which are profiled when profiling is enabled
+_phases = set()
+_enabled = False
+_tracemalloc = False
+_cycle = None
+# the number of cycles started, so names are unique even when cycles start in
+# the same second
+_cycles = 0
+# the last tracemalloc snapshot for each phase
+_snapshots = {}
+
+
+#
+# parse a comma-separated list of phases
+#
+def parse_phases(s):
+    phases = set(p.strip() for p in s.split(',') if p.strip())
+    if 'all' in phases:
+        return set(PHASES)
+
+    unknown = phases - set(PHASES)
+    if unknown:
+        raise ValueError("unknown phase(s) %s (known phases are %s)" % (','.join(sorted(unknown)), ','.join(PHASES)))
+
+    return phases
+
+
+def configure(profile_dir, phases, trace_malloc=False):
+    global _dir, _phases, _enabled, _tracemalloc
+
+    _dir = profile_dir
+    _phases = set(phases) or set(PHASES)
+    _enabled = bool(phases)
+    _tracemalloc = trace_malloc
+    _snapshots.clear()
+
+    if _enabled and _tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+#
+# turn profiling on or off (e.g. on SIGUSR1)
+#
+def toggle():
+    global _enabled
+
+    _enabled = not _enabled
+    if _enabled and _tracemalloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not _enabled:
+        _snapshots.clear()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    return _enabled
+
+
+def enabled():
+    return _enabled
+
+
+#
+# start a new cycle (which the dumped files are named after)
+#
+def start_cycle():
+    global _cycle, _cycles
+    _cycles += 1
+    _cycle = '%s-%06d' % (time.strftime('%Y%m%d-%H%M%S'), _cycles)
+
+
+@contextmanager
+def profile(phase):
+    if not _enabled or phase not in _phases or _dir is None:
+        yield
+        return
+
+    if _cycle is None:
+        start_cycle()
+
+    os.makedirs(_dir, exist_ok=True)
+    basename = os.path.join(_dir, '%s-%s' % (_cycle, phase))
+
+    p = cProfile.Profile()
+    p.enable()
+    try:
+        yield
+    finally:
+        p.disable()
+        p.dump_stats(basename + '.pstats')
+        logging.debug("profile of phase %s written to %s.pstats" % (phase, basename))
+
+        if _tracemalloc and tracemalloc.is_tracing():
+            _snapshot(phase, basename + '.tracemalloc')
+
+        _rotate()
+
+
+def _snapshot(phase, fn):
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+
+    previous = _snapshots.get(phase)
+    if previous:
+        stats = snapshot.compare_to(previous, 'lineno')
+        growth = sum(s.size_diff for s in stats)
+        logging.info("memory allocated in phase %s grew by %d bytes since the previous cycle" % (phase, growth))
+    else:
+        stats = snapshot.statistics('lineno')
+
+    with open(fn, 'w') as f:
+        for s in stats[:TRACEMALLOC_TOP]:
+            print(s, file=f)
+
+    _snapshots[phase] = snapshot
+
+
+# keep only the most recent PROFILE_KEEP files in the profile directory
+def _rotate():
+    files = sorted(os.listdir(_dir))
+    for f in files[:-PROFILE_KEEP]:
+        try:
+            os.remove(os.path.join(_dir, f))
+        except OSError:
+            pass
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# atomically publish setup.ini and associated files
+#
+# all the files which make up a 'generation' (setup.ini, its compressed
+# variants, and signatures for all of those) are written into a staging
+# directory under <arch>/.setup/. They are then moved into whichever of the two
+# fixed slot directories .setup/a and .setup/b isn't current, and that is
+# published by atomically replacing the .setup/current symlink with one
+# pointing to it.
+#
+# the published files in <arch>/ are symlinks to the same name in
+# .setup/current/, so they all change at the same instant, and a mirror never
+# sees a mix of files from different generations.
+#
+# since the paths never change, a mirror always has a basis file at the same
+# path for rsync's delta transfer: if it copies symlinks, the setup.* links
+# never change, .setup/current flips between a and b, and the files in the slot
+# being published are updated from the generation before the previous one; if
+# it follows symlinks, the setup.* files are updated from the previous
+# generation.
+#
+# the previous generation is retained (in the other slot, which the 'previous'
+# symlink points to), so it can be rolled back to.
+#
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+from . import common_constants
+from . import utils
+
+GENERATIONS_DIR = '.setup'
+SLOTS = ['a', 'b']
+
+
+# atomically make (or replace) a symlink at path pointing to target
+def _symlink_replace(target, path):
+    tmppath = path + '~'
+    while os.path.lexists(tmppath):
+        tmppath += '~'
+
+    os.symlink(target, tmppath)
+    os.replace(tmppath, path)
+
+
+#
+# make a new, empty staging directory for a generation
+#
+def new_generation(basedir):
+    gendir = os.path.join(basedir, GENERATIONS_DIR)
+    utils.makedirs(gendir)
+
+    staging = tempfile.mkdtemp(prefix='staging-', dir=gendir)
+    logging.debug('staging new generation in %s' % (staging))
+    return staging
+
+
+#
+# publish a staging directory, and ensure the given files in basedir refer to
+# the current generation
+#
+def publish(basedir, staging, files):
+    gendir = os.path.join(basedir, GENERATIONS_DIR)
+    current = os.path.join(gendir, 'current')
+    previous = os.path.join(gendir, 'previous')
+
+    prev = None
+    if os.path.islink(current):
+        prev = os.readlink(current)
+
+    # the slot which isn't current holds the generation before the previous one
+    # (or a rolled-back one), which can be replaced
+    slot = SLOTS[1] if prev == SLOTS[0] else SLOTS[0]
+    slotdir = os.path.join(gendir, slot)
+    utils.makedirs(slotdir)
+    os.chmod(slotdir, 0o755)
+
+    logging.debug("moving generation from %s to %s" % (staging, slotdir))
+    for f in files:
+        os.replace(os.path.join(staging, f), os.path.join(slotdir, f))
+    shutil.rmtree(staging, ignore_errors=True)
+
+    # remove any files in the slot which are no longer part of a generation
+    for f in os.listdir(slotdir):
+        if f not in files:
+            os.remove(os.path.join(slotdir, f))
+
+    # this is the atomic step which publishes the new generation
+    logging.info("publishing generation in slot %s in %s" % (slot, basedir))
+    _symlink_replace(slot, current)
+
+    if prev:
+        _symlink_replace(prev, previous)
+
+    # files in basedir should be symlinks into the current generation (this
+    # only does anything the first time, or if the set of files changes)
+    for f in files:
+        path = os.path.join(basedir, f)
+        target = os.path.join(GENERATIONS_DIR, 'current', f)
+        if not (os.path.islink(path) and os.readlink(path) == target):
+            logging.debug("linking %s to %s" % (path, target))
+            _symlink_replace(target, path)
+
+    # remove anything else (e.g. a staging directory left behind by a failure)
+    for d in os.listdir(gendir):
+        if d in ['current', 'previous', slot, prev]:
+            continue
+
+        logging.debug("removing %s" % (d))
+        shutil.rmtree(os.path.join(gendir, d), ignore_errors=True)
+
+
+#
+# swap the current and previous generations
+#
+def rollback(basedir):
+    gendir = os.path.join(basedir, GENERATIONS_DIR)
+    current = os.path.join(gendir, 'current')
+    previous = os.path.join(gendir, 'previous')
+
+    if not os.path.islink(previous):
+        logging.error("no previous generation in %s" % (basedir))
+        return False
+
+    curr = os.readlink(current)
+    prev = os.readlink(previous)
+
+    logging.info("rolling back from generation %s to %s in %s" % (curr, prev, basedir))
+    _symlink_replace(prev, current)
+    _symlink_replace(curr, previous)
+
+    return True
+
+
+def main():
+    relarea_default = common_constants.FTP
+
+    parser = argparse.ArgumentParser(description='roll back setup.ini to the previous generation')
+    parser.add_argument('--arch', action='store', choices=common_constants.ARCHES, help="architecture", required=True)
+    parser.add_argument('--releasearea', action='store', metavar='DIR', help="release directory (default: " + relarea_default + ")", default=relarea_default, dest='rel_area')
+    (args) = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    logging.basicConfig(format='publish: %(message)s')
+
+    if not rollback(os.path.join(args.rel_area, args.arch)):
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,10 +25,17 @@
 # get 'latest upstream version' information from repology.org (note that this
 # may not exist for some packages, e.g. where upstream doesn't do releases)
 #
+# fetching this data takes some time, so it's done in a background thread, and
+# the results are kept in a cache file (which persists across restarts), which
+# packages are annotated from.
+#
 
 import json
 import logging
+import os
 import re
+import tempfile
+import threading
 import time
 import urllib.error
 import urllib.request
@@ -38,8 +45,19 @@ from enum import Enum, auto, unique
 from .version import SetupVersion
 
 REPOLOGY_API_URL = 'https://repology.org/api/v1/projects/'
-last_check = 0
-last_data = {}
+# how long between API calls
+REPOLOGY_API_INTERVAL = 1
+# how old the cached data can get before we fetch it again
+REPOLOGY_FETCH_INTERVAL = (24 * 60 * 60)
+REPOLOGY_CACHE = 'repology.json'
+
+# the background fetch thread, and when it was last started
+fetch_thread = None
+last_fetch = 0
+# the cache file data, as last read, and the mtime of the cache file it was
+# read from
+cached = {'timestamp': 0, 'data': {}}
+cached_mtime = None
 
 LegacyData = namedtuple('LegacyData', ['version_re', 'ignores', 'transform', 'source'])
 use_legacy = {
@@ -186,7 +204,7 @@ def repology_fetch_data():
             last_pn = pn
 
         # rate-limit individual API calls to once per second
-        time.sleep(1)
+        time.sleep(REPOLOGY_API_INTERVAL)
 
     return repology_data
 
@@ -219,24 +237,119 @@ def up_to_date(po):
     return status
 
 
-def annotate_packages(args, packages):
-    global last_check
-    global last_data
+#
+# the cache file
+#
+# (UnknownVersion values are stored as their name, prefixed with a '!', which
+# can't occur in a version)
+#
+def cache_file(args):
+    return os.path.join(args.htdocs, REPOLOGY_CACHE)
+
+
+def _encode_version(v):
+    if isinstance(v, UnknownVersion):
+        return '!' + v.name
+    return v
+
+
+def _decode_version(v):
+    if v.startswith('!'):
+        return UnknownVersion[v[1:]]
+    return v
+
+
+def write_cache(fn, repology_data, timestamp=None):
+    if timestamp is None:
+        timestamp = time.time()
+
+    j = {
+        'timestamp': timestamp,
+        'data': {pn: {'upstream_version': [_encode_version(v) for v in rd.upstream_version],
+                      'repology_project_name': rd.repology_project_name}
+                 for pn, rd in repology_data.items()},
+    }
+
+    # write atomically, so a reader never sees a partial file
+    with tempfile.NamedTemporaryFile(mode='w', dir=os.path.dirname(fn), delete=False) as f:
+        json.dump(j, f, sort_keys=True)
+    os.replace(f.name, fn)
+
+
+def read_cache(fn):
+    global cached
+    global cached_mtime
+
+    try:
+        mtime = os.stat(fn).st_mtime_ns
+    except FileNotFoundError:
+        return cached
+
+    # only re-read if it's changed since we last read it
+    if mtime != cached_mtime:
+        try:
+            with open(fn) as f:
+                j = json.load(f)
 
-    # rate-limit fetching data to daily
-    if (time.time() - last_check) < (24 * 60 * 60):
+            data = {pn: RepologyData([_decode_version(v) for v in d['upstream_version']], d['repology_project_name'])
+                    for pn, d in j['data'].items()}
+            cached = {'timestamp': j['timestamp'], 'data': data}
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("couldn't read repology cache %s: %s" % (fn, e))
+
+        cached_mtime = mtime
+
+    return cached
+
+
+def _fetch(fn):
+    start = time.time()
+    repology_data = repology_fetch_data()
+    if repology_data:
+        write_cache(fn, repology_data)
+        logging.info("fetched data for %d packages from %s in %.2f seconds" % (len(repology_data), REPOLOGY_API_URL, time.time() - start))
+
+
+#
+# start fetching data in the background, if the cached data is out of date, and
+# we aren't already doing that.
+#
+# (if a fetch fails, the next attempt isn't made until the fetch interval has
+# elapsed again)
+#
+def fetch(args, wait=False):
+    global fetch_thread
+    global last_fetch
+
+    fn = cache_file(args)
+    now = time.time()
+
+    if fetch_thread and fetch_thread.is_alive():
+        logging.info("still consulting %s" % (REPOLOGY_API_URL))
+    elif ((now - read_cache(fn)['timestamp']) < REPOLOGY_FETCH_INTERVAL) or ((now - last_fetch) < REPOLOGY_FETCH_INTERVAL):
         logging.info("not consulting %s due to ratelimit" % (REPOLOGY_API_URL))
     else:
         logging.info("consulting %s" % (REPOLOGY_API_URL))
-        repology_data = repology_fetch_data()
-        if repology_data:
-            last_data = repology_data
+        fetch_thread = threading.Thread(target=_fetch, args=(fn,), name='repology', daemon=True)
+        fetch_thread.start()
+        last_fetch = now
+
+    if wait and fetch_thread:
+        fetch_thread.join()
+
+
+#
+# annotate packages with the cached data (this doesn't wait for any fetch in
+# progress to finish, unless asked to)
+#
+def annotate_packages(args, packages, wait=False):
+    fetch(args, wait)
 
-        last_check = time.time()
+    data = read_cache(cache_file(args))['data']
 
-    for pn in last_data:
+    for pn in data:
         spn = pn + '-src'
         if spn in packages:
-            packages[spn].upstream_version = seqmatch(packages[spn].best_version, last_data[pn].upstream_version)
-            packages[spn].repology_project_name = last_data[pn].repology_project_name
+            packages[spn].upstream_version = seqmatch(packages[spn].best_version, data[pn].upstream_version)
+            packages[spn].repology_project_name = data[pn].repology_project_name
             packages[spn].up_to_date = up_to_date(packages[spn])
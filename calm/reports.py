@@ -21,7 +21,9 @@
 # THE SOFTWARE.
 #
 
+import hashlib
 import io
+import logging
 import os
 import re
 import textwrap
@@ -93,63 +95,101 @@ def status(s):
 
 
 #
-# produce a report of packages maintained by a given maintainer (None = unmaintained)
+# build indexes over the package set, which are shared by all the reports, so
+# each one doesn't have to scan all packages again:
+#
+# by_maintainer: maintainer (None = unmaintained) -> list of row data for their
+#                source packages
+# depends:       package -> list of the dependencies of its best version
+# used_by:       dependency -> list of packages whose best version depends on it
 #
-def maintainer_packages(args, packages, maintainer, reportlist):
+def build_indexes(args, packages):
     pkg_maintainers = maintainers.pkg_list(args.pkglist)
 
-    um_list = []
+    idx = types.SimpleNamespace()
+    idx.by_maintainer = {None: []}
+    idx.depends = {}
+    idx.used_by = {}
 
     for p in packages:
         po = packages[p]
 
+        depends = package.deplist_without_versions(po.hints(po.best_version)['depends'])
+        idx.depends[p] = depends
+        for d in depends:
+            idx.used_by.setdefault(d, []).append(p)
+
         if po.kind != package.Kind.source:
             continue
 
         if po.orig_name not in pkg_maintainers:
             continue
 
-        if maintainer:
-            if maintainer not in pkg_maintainers[po.orig_name].maintainers():
-                continue
-            if pkg_maintainers[po.orig_name].is_orphaned():
-                continue
+        up = _maintainer_package_row(packages, p)
+
+        if pkg_maintainers[po.orig_name].is_orphaned():
+            idx.by_maintainer[None].append(up)
         else:
-            if not pkg_maintainers[po.orig_name].is_orphaned():
-                continue
+            for m in pkg_maintainers[po.orig_name].maintainers():
+                idx.by_maintainer.setdefault(m, []).append(up)
+
+    return idx
+
+
+# the packages whose best version has a dependency matching a predicate, in
+# package order
+def _depended_on(packages, idx, predicate):
+    candidates = set()
+    for d in idx.used_by:
+        if predicate(d):
+            candidates.update(idx.used_by[d])
+
+    return [p for p in packages if p in candidates]
+
+
+# the row data for a source package in a maintainer's package report
+def _maintainer_package_row(packages, p):
+    po = packages[p]
+
+    # the highest version we have
+    v = sorted(po.versions(), key=lambda v: SetupVersion(v), reverse=True)[0]
+
+    # determine the number of unique rdepends over all subpackages (and
+    # likewise build_rdepends)
+    #
+    # zero rdepends makes this package a candidate for removal, whereas lots
+    # means it's important to update it.
+    rdepends = set()
+    build_rdepends = set()
+    for subp in po.is_used_by:
+        rdepends.update(packages[subp].rdepends)
+        build_rdepends.update(packages[subp].build_rdepends)
+
+    up = types.SimpleNamespace()
+    up.pn = p
+    up.po = po
+    up.v = SetupVersion(v).V
+    up.ts = po.tar(v).mtime
+    up.rdepends = len(rdepends)
+    up.build_rdepends = len(build_rdepends)
+    up.importance = po.importance
+    up.status = getattr(po, 'up_to_date', 1)
+    up.upstream_v = getattr(po, 'upstream_version', None)
+
+    if not isinstance(up.upstream_v, str):
+        if up.upstream_v is None:
+            up.upstream_v = 'unknown'
+        else:
+            up.upstream_v = 'unknown (%s)' % up.upstream_v
+
+    return up
+
 
-        # the highest version we have
-        v = sorted(po.versions(), key=lambda v: SetupVersion(v), reverse=True)[0]
-
-        # determine the number of unique rdepends over all subpackages (and
-        # likewise build_rdepends)
-        #
-        # zero rdepends makes this package a candidate for removal, whereas lots
-        # means it's important to update it.
-        rdepends = set()
-        build_rdepends = set()
-        for subp in po.is_used_by:
-            rdepends.update(packages[subp].rdepends)
-            build_rdepends.update(packages[subp].build_rdepends)
-
-        up = types.SimpleNamespace()
-        up.pn = p
-        up.po = po
-        up.v = SetupVersion(v).V
-        up.ts = po.tar(v).mtime
-        up.rdepends = len(rdepends)
-        up.build_rdepends = len(build_rdepends)
-        up.importance = po.importance
-        up.status = getattr(po, 'up_to_date', 1)
-        up.upstream_v = getattr(po, 'upstream_version', None)
-
-        if not isinstance(up.upstream_v, str):
-            if up.upstream_v is None:
-                up.upstream_v = 'unknown'
-            else:
-                up.upstream_v = 'unknown (%s)' % up.upstream_v
-
-        um_list.append(up)
+#
+# produce a report of packages maintained by a given maintainer (None = unmaintained)
+#
+def maintainer_packages(args, packages, maintainer, reportlist, idx):
+    um_list = idx.by_maintainer.get(maintainer, [])
 
     body = io.StringIO()
 
@@ -183,11 +223,8 @@ def maintainer_packages(args, packages, maintainer, reportlist):
         write_report(args, 'Unmaintained packages', body, 'unmaintained.html', reportlist)
 
 
-# produce a report of deprecated packages
-#
-def deprecated(args, packages, reportlist):
-    dep_list = []
-
+# the shared library packages, which might be deprecated
+def _solib_packages(packages):
     for p in packages:
         po = packages[p]
 
@@ -200,6 +237,33 @@ def deprecated(args, packages, reportlist):
         if p.startswith('girepository-'):
             continue
 
+        yield p
+
+
+# the packages the deprecated report is made from: shared library packages,
+# their source packages, and the packages depending on them (and their source
+# packages)
+def _deprecated_deps(packages):
+    deps = set()
+    for p in _solib_packages(packages):
+        po = packages[p]
+        deps.add(p)
+        deps.add(po.hints(po.best_version).get('external-source', p))
+        for d in po.rdepends:
+            deps.add(d)
+            deps.add(packages[d].srcpackage(packages[d].best_version))
+
+    return deps
+
+
+# produce a report of deprecated packages
+#
+def deprecated(args, packages, reportlist, idx):
+    dep_list = []
+
+    for p in _solib_packages(packages):
+        po = packages[p]
+
         bv = po.best_version
         es = po.hints(bv).get('external-source', None)
         if not es:
@@ -227,8 +291,7 @@ def deprecated(args, packages, reportlist):
                 continue
 
             # current version has the dependency of interest
-            dpl = package.deplist_without_versions(packages[d].hints(bv)['depends'])
-            if p not in dpl:
+            if p not in idx.depends[d]:
                 continue
 
             depp.rdepends.append(d)
@@ -403,32 +466,55 @@ def maintainer_activity_report(args, packages, reportlist):
     write_report(args, 'Maintainer activity', body, 'maintainer_activity.html', reportlist, not_empty=False)
 
 
+# the latest version provides of a package, and the provide base, which is the
+# start of it, up-to and including the first '_' (assumed to be followed by
+# digits and maybe separators), so it doesn't accidentally match the package
+# name we probably get without the '_'.
+def _provide(po):
+    provide = po.hints(po.best_version)['provides'][0]
+    return provide, re.sub(r'^(.*?_).*$', r'\1', provide)
+
+
+# the packages whose best version has a dependency matching a predicate, and
+# their source packages
+def _depended_on_deps(packages, idx, predicate):
+    deps = set()
+    for p in _depended_on(packages, idx, predicate):
+        deps.add(p)
+        deps.add(packages[p].srcpackage(packages[p].best_version))
+
+    return deps
+
+
+# the packages a provides_rebuild() report is made from
+def _provides_rebuild_deps(packages, provide_package, idx):
+    deps = {provide_package}
+
+    pp_package = packages.get(provide_package, None)
+    if pp_package:
+        _pp_provide, pp_provide_base = _provide(pp_package)
+        deps.update(_depended_on_deps(packages, idx, lambda d: d.startswith(pp_provide_base)))
+
+    return deps
+
+
 # produce a report of packages which need rebuilding for the latest major
 # version version provides
 #
-def provides_rebuild(args, packages, fn, provide_package, reportlist):
+def provides_rebuild(args, packages, fn, provide_package, reportlist, idx):
     pr_list = []
 
     pp_package = packages.get(provide_package, None)
     pp_provide = None
 
     if pp_package:
-        pp_bv = pp_package.best_version
-        pp_provide = pp_package.hints(pp_bv)['provides'][0]
-        # provide_base is the start of the provide, up-to and including the
-        # first '_' (assumed to be followed by digits and maybe separators), so
-        # it doesn't accidentally match the package name we probably get without
-        # the '_'.
-        pp_provide_base = re.sub(r'^(.*?_).*$', r'\1', pp_provide)
-
-        for p in packages:
+        pp_provide, pp_provide_base = _provide(pp_package)
+
+        for p in _depended_on(packages, idx, lambda d: d.startswith(pp_provide_base)):
             po = packages[p]
             bv = po.best_version
 
-            depends = packages[p].hints(bv)['depends']
-            depends = package.deplist_without_versions(depends)
-
-            for d in depends:
+            for d in idx.depends[p]:
                 if not d.startswith(pp_provide_base):
                     continue
 
@@ -467,7 +553,7 @@ def provides_rebuild(args, packages, fn, provide_package, reportlist):
 
 # produce a report of python modules/bindings/linked packages which depend on
 # non-latest version of python
-def python_rebuild(args, packages, fn, reportlist):
+def python_rebuild(args, packages, fn, reportlist, idx):
     pr_list = []
 
     # assume that python3 depends only on the latest python3n package
@@ -479,17 +565,14 @@ def python_rebuild(args, packages, fn, reportlist):
 
     modules = {}
 
-    for p in packages:
+    for p in _depended_on(packages, idx, lambda d: re.match(r'python\d+$', d)):
         po = packages[p]
         bv = po.best_version
 
         if po.obsoleted_by:
             continue
 
-        depends = packages[p].hints(bv)['depends']
-        depends = package.deplist_without_versions(depends)
-
-        for d in depends:
+        for d in idx.depends[p]:
             # scan for a 'pythonnn' dependency
             if not re.match(r'python\d+$', d):
                 continue
@@ -570,27 +653,143 @@ def python_rebuild(args, packages, fn, reportlist):
 
 
 #
-def do_reports(args, packages):
+# fingerprints of what reports use from a package or maintainer, so we can tell
+# which have changed since reports were last written
+#
+def _package_fingerprint(po):
+    bv = po.best_version
+
+    versions = []
+    for v in sorted(po.versions()):
+        to = po.tar(v)
+        versions.append((v, to.mtime, to.is_empty, sorted(po.hints(v).items())))
+
+    inputs = (
+        po.name,
+        po.orig_name,
+        po.kind,
+        bv,
+        po.srcpackage(bv),
+        versions,
+        sorted(po.obsoleted_by),
+        sorted(po.rdepends),
+        sorted(po.build_rdepends),
+        sorted(po.is_used_by),
+        str(getattr(po, 'importance', None)),
+        getattr(po, 'up_to_date', 1),
+        getattr(po, 'upstream_version', None),
+    )
+
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+
+def _maintainer_fingerprint(m):
+    inputs = (
+        m.name,
+        m.email,
+        m.last_seen,
+        sorted((str(p), p.is_orphaned(), sorted(p.maintainers())) for p in m.pkgs),
+    )
+
+    return hashlib.sha256(repr(inputs).encode()).hexdigest()
+
+
+# the names of the things which have changed (or been added or removed) between
+# two sets of fingerprints
+def _changed(old, new):
+    return set(k for k in new if old.get(k, None) != new[k]) | (set(old) - set(new))
+
+
+#
+# write reports
+#
+# each report declares the packages and maintainers it is made from (None
+# meaning all of them), and is only regenerated if any of those have changed
+# since it was last written (as recorded in cache, which should be retained
+# between calls), or the set of things it is made from has changed.
+#
+def do_reports(args, packages, cache=None):
     if args.dryrun:
         return
 
-    reportlist = {}
+    if cache is None:
+        cache = {}
 
     pkg2html.ensure_dir_exists(args, os.path.join(args.htdocs, 'reports'))
 
-    maintainer_packages(args, packages, None, reportlist)
-    deprecated(args, packages, reportlist)
-    unstable(args, packages, reportlist)
+    idx = build_indexes(args, packages)
+    mlist = maintainers.maintainer_list(args)
+
+    # work out what has changed since we were last run
+    package_fingerprints = {p: _package_fingerprint(packages[p]) for p in packages}
+    maintainer_fingerprints = {m: _maintainer_fingerprint(mlist[m]) for m in mlist}
+
+    dirty_packages = _changed(cache.get('packages', {}), package_fingerprints)
+    dirty_maintainers = _changed(cache.get('maintainers', {}), maintainer_fingerprints)
+
+    # the packages shown in a maintainer's report (and the subpackages whose
+    # rdepends are counted there)
+    def maintainer_deps(m):
+        deps = set()
+        for up in idx.by_maintainer.get(m, []):
+            deps.add(up.pn)
+            deps.update(up.po.is_used_by)
+        return deps
+
+    def report(name, func, package_deps=None, maintainer_deps=None):
+        return types.SimpleNamespace(name=name, func=func, package_deps=package_deps, maintainer_deps=maintainer_deps)
+
+    source_packages = set(p for p in packages if packages[p].kind == package.Kind.source)
+    python_deps = {'python3'} | _depended_on_deps(packages, idx, lambda d: re.match(r'python\d+$', d))
+
+    # (only the maintainer activity report is made from everything)
+    reports = [
+        report('unmaintained', lambda rl: maintainer_packages(args, packages, None, rl, idx), maintainer_deps(None), set()),
+        report('deprecated', lambda rl: deprecated(args, packages, rl, idx), _deprecated_deps(packages), set()),
+        report('unstable', lambda rl: unstable(args, packages, rl), source_packages, set()),
+        report('perl', lambda rl: provides_rebuild(args, packages, 'perl_rebuilds.html', 'perl_base', rl, idx), _provides_rebuild_deps(packages, 'perl_base', idx), set()),
+        report('ruby', lambda rl: provides_rebuild(args, packages, 'ruby_rebuilds.html', 'ruby', rl, idx), _provides_rebuild_deps(packages, 'ruby', idx), set()),
+        report('php', lambda rl: provides_rebuild(args, packages, 'php_rebuilds.html', 'php', rl, idx), _provides_rebuild_deps(packages, 'php', idx), set()),
+        report('python', lambda rl: python_rebuild(args, packages, 'python_rebuilds.html', rl, idx), python_deps, set()),
+        report('maintainer_activity', lambda rl: maintainer_activity_report(args, packages, rl), None, None),
+    ]
+
+    for m in mlist:
+        reports.append(report('maintainer ' + m, lambda rl, m=m: maintainer_packages(args, packages, m, None, idx), maintainer_deps(m), set()))
+
+    def is_dirty(deps, previous_deps, dirty):
+        if deps != previous_deps:
+            return True
+        if deps is None:
+            return bool(dirty)
+        return not deps.isdisjoint(dirty)
+
+    previous = cache.get('reports', {})
+    current = {}
+    reportlist = {}
+    regenerated = 0
+
+    for r in reports:
+        prev = previous.get(r.name, None)
+        if (args.force or (prev is None) or
+                is_dirty(r.package_deps, prev.package_deps, dirty_packages) or
+                is_dirty(r.maintainer_deps, prev.maintainer_deps, dirty_maintainers)):
+            # the reportlist entries this report makes
+            r.entries = {}
+            r.func(r.entries)
+            regenerated += 1
+        else:
+            r.entries = prev.entries
 
-    provides_rebuild(args, packages, 'perl_rebuilds.html', 'perl_base', reportlist)
-    provides_rebuild(args, packages, 'ruby_rebuilds.html', 'ruby', reportlist)
-    provides_rebuild(args, packages, 'php_rebuilds.html', 'php', reportlist)
-    python_rebuild(args, packages, 'python_rebuilds.html', reportlist)
+        # (don't retain func, which refers to this package set)
+        current[r.name] = types.SimpleNamespace(package_deps=r.package_deps, maintainer_deps=r.maintainer_deps, entries=r.entries)
+        reportlist.update(r.entries)
 
-    maintainer_activity_report(args, packages, reportlist)
+    logging.debug("regenerated %d of %d reports (%d packages and %d maintainers changed)" % (regenerated, len(reports), len(dirty_packages), len(dirty_maintainers)))
 
-    for maintainer in maintainers.maintainer_list(args):
-        maintainer_packages(args, packages, maintainer, None)
+    cache['packages'] = package_fingerprints
+    cache['maintainers'] = maintainer_fingerprints
+    cache['reports'] = current
 
     fn = os.path.join(args.htdocs, 'reports_list.inc')
     with utils.open_amifc(fn) as f:
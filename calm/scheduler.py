@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# decide what the daemon needs to do, and when, from inotify events
+#
+# events are accumulated until there have been none for the quiet period (so we
+# don't start processing in the middle of a flurry of events, e.g. an sftp
+# upload of many files), or the maximum delay since the first of them has
+# passed (so a continuous stream of events can't hold off processing forever).
+#
+# the actions required, and the maintainers and package paths affected, are
+# coalesced across all the events accumulated.
+#
+
+import os
+import time
+from enum import Flag, auto, unique
+
+from . import publish
+
+# default seconds without events before actions are taken
+QUIET_PERIOD = 10
+# default maximum seconds between the first event and actions being taken
+MAX_DELAY = 120
+
+
+# the arch/release/package part of a path relative to the release area, if it
+# has one
+def _pkgpath(relpath):
+    relpath = relpath.split(os.path.sep)
+    if len(relpath) >= 3:
+        return os.path.join(*relpath[:3])
+    return None
+
+
+@unique
+class Event(Flag):
+    read_uploads = auto()
+    read_relarea = auto()
+
+
+class Scheduler(object):
+    def __init__(self, args, quiet=QUIET_PERIOD, max_delay=MAX_DELAY):
+        self.rel_area = args.rel_area
+        self.homedir = args.homedir
+        self.stagingdir = args.stagingdir
+        self.depth = args.rel_area.count(os.path.sep) + 1
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self._reset()
+
+    def _reset(self):
+        self.action = Event(0)
+        # maintainers with uploads to process (None means all of them)
+        self.maintainers = set()
+        # package paths (relative to the release area) which have changed
+        self.paths = set()
+        self.events = 0
+        self.first = None
+        self.last = None
+        self.immediate = False
+
+    #
+    # determine the action (if any) needed for an inotify event, and the
+    # maintainer or package path which it affects
+    #
+    def classify(self, event):
+        (_, _type_names, path, filename) = event
+        action = Event(0)
+        maint = None
+        pkgpath = None
+
+        if path.startswith(self.rel_area):
+            # ignore sha512.sum and modifications to setup.* files in the arch
+            # directory (or the generations of them)
+            if ((filename != 'sha512.sum') and ((path.count(os.path.sep) > self.depth) or filename == ".touch") and
+                (os.path.sep + publish.GENERATIONS_DIR + os.path.sep) not in (path + os.path.sep)):
+                action = Event.read_relarea
+                pkgpath = _pkgpath(os.path.relpath(path, self.rel_area))
+        elif path.startswith(self.stagingdir) and (filename == '.touch'):
+            action = Event.read_uploads
+        elif (path.startswith(self.homedir)) and (filename == ".sftp-session-close"):
+            action = Event.read_uploads
+            maint = os.path.relpath(path, self.homedir).split(os.path.sep)[0]
+
+        return (action, maint, pkgpath)
+
+    #
+    # accumulate an inotify event
+    #
+    def add(self, event, now=None):
+        if now is None:
+            now = time.time()
+
+        (action, maint, pkgpath) = self.classify(event)
+        if action:
+            self._accumulate(action, maint, pkgpath, now)
+
+        return action
+
+    #
+    # accumulate changes found in the release area by comparing directory
+    # mtimes (see dirtree), given the paths of the changed directories relative
+    # to the release area
+    #
+    def add_relarea_changes(self, dirs, now=None):
+        if now is None:
+            now = time.time()
+
+        action = Event(0)
+        for d in dirs:
+            # ignore changes to the release area and arch directories
+            # themselves (where setup.* files are written)
+            if len(d.split(os.path.sep)) < 2:
+                continue
+
+            action = Event.read_relarea
+            self._accumulate(action, None, _pkgpath(d), now)
+
+        return action
+
+    def _accumulate(self, action, maint, pkgpath, now):
+        self.action |= action
+        if maint and self.maintainers is not None:
+            self.maintainers.add(maint)
+        if pkgpath:
+            self.paths.add(pkgpath)
+
+        self.events += 1
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    #
+    # schedule actions to be taken as soon as possible, for all maintainers
+    #
+    def schedule(self, action):
+        self.action |= action
+        if Event.read_uploads in action:
+            self.maintainers = None
+        self.immediate = True
+
+    def pending(self):
+        return bool(self.action)
+
+    #
+    # are accumulated actions due to be taken?
+    #
+    def due(self, now=None):
+        if not self.action:
+            return False
+
+        if self.immediate:
+            return True
+
+        if now is None:
+            now = time.time()
+
+        return ((now - self.last) >= self.quiet) or ((now - self.first) >= self.max_delay)
+
+    #
+    # return the accumulated actions, maintainers and package paths as a tuple,
+    # and start accumulating afresh
+    #
+    def take(self):
+        result = (self.action, self.maintainers, self.paths)
+        self._reset()
+        return result
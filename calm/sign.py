@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Jon Turney
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+#
+# make detached signatures
+#
+
+import logging
+import os
+import subprocess
+import time
+
+GPG = '/usr/bin/gpg'
+
+# how long we wait for all the signatures to be made
+DEFAULT_TIMEOUT = 60
+
+
+#
+# make a detached signature (file.sig) for each of a list of files
+#
+# a gpg process is started for each file, and these all run concurrently.
+#
+# returns the list of files which couldn't be signed (any partial signature
+# file for those is removed)
+#
+def sign(files, keys, gpg=GPG, timeout=DEFAULT_TIMEOUT):
+    procs = {}
+    for fn in files:
+        cmd = [gpg] + ['-u' + k for k in keys] + ['--batch', '--yes', '-b', fn]
+        logging.debug(' '.join(cmd))
+        procs[fn] = subprocess.Popen(cmd, stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT)
+
+    deadline = time.time() + timeout
+    failed = []
+    for fn, p in procs.items():
+        killed = False
+        try:
+            output, _ = p.communicate(timeout=max(0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            # (it may have finished after all, but we didn't get to it before
+            # the deadline, because we were waiting for others)
+            if p.poll() is None:
+                p.kill()
+                killed = True
+            output, _ = p.communicate()
+
+        if killed:
+            logging.error("signing %s timed out after %d seconds" % (fn, timeout))
+            failed.append(fn)
+        elif p.returncode < 0:
+            logging.error("signing %s failed, gpg killed by signal %d" % (fn, -p.returncode))
+            failed.append(fn)
+        elif p.returncode != 0:
+            logging.error("signing %s failed, gpg exited %d" % (fn, p.returncode))
+            failed.append(fn)
+
+        for l in output.decode(errors='replace').splitlines():
+            if fn in failed:
+                logging.warning(l)
+            else:
+                logging.info(l)
+
+    for fn in failed:
+        try:
+            os.remove(fn + '.sig')
+        except FileNotFoundError:
+            pass
+
+    return failed
@@ -25,7 +25,6 @@
 # upload directory processing
 #
 
-import filecmp
 import logging
 import os
 import re
@@ -36,7 +35,9 @@ import xtarfile
 
 from . import common_constants
 from . import fixes
+from . import metrics
 from . import package
+from . import utils
 from .movelist import MoveList
 
 # reminders will be issued weekly
@@ -60,6 +61,7 @@ class ScanResult:
 #
 #
 
+@metrics.subsystem('uploads.scan')
 def scan(scandir, m, all_packages, args):
     homedir = os.path.join(scandir, m.name)
 
@@ -92,6 +94,7 @@ def scan(scandir, m, all_packages, args):
         if '!ready' in files:
             ready = os.path.join(dirpath, '!ready')
             mtime = os.path.getmtime(ready)
+            metrics.io('stats')
             mtimes.append((relpath + '/', mtime))
             remove.append(ready)
             files.remove('!ready')
@@ -131,6 +134,7 @@ def scan(scandir, m, all_packages, args):
         for f in sorted(files):
             fn = os.path.join(dirpath, f)
             file_mtime = os.path.getmtime(fn)
+            metrics.io('stats')
             if file_mtime > mtime:
                 if mtime == 0:
                     m.reminders_timestamp_checked = True
@@ -260,6 +264,7 @@ def scan(scandir, m, all_packages, args):
                     # it
                     with xtarfile.open(fn, mode='r') as a:
                         a.getmembers()
+                        metrics.archive_io(a, fn)
 
                 except Exception as e:
                     valid = False
@@ -280,9 +285,10 @@ def scan(scandir, m, all_packages, args):
             # does file already exist in release area?
             # XXX: this needs to be redone later to be multipath aware
             dest = os.path.join(args.rel_area, relpath, f)
+            metrics.io('stats')
             if os.path.isfile(dest):
                 if not f.endswith('.hint'):
-                    if filecmp.cmp(dest, fn, shallow=False):
+                    if utils.cmp_files(dest, fn):
                         logging.info("discarding, identical %s is already in release area" % fn)
                         remove_success.append(fn)
                     else:
@@ -291,7 +297,7 @@ def scan(scandir, m, all_packages, args):
                         error = True
                     files.remove(f)
                 else:
-                    if filecmp.cmp(dest, fn, shallow=False):
+                    if utils.cmp_files(dest, fn):
                         logging.debug("identical %s is already in release area" % fn)
                     else:
                         logging.debug("different %s is already in release area" % fn)
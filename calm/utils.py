@@ -27,12 +27,14 @@
 
 import email.message
 import email.utils
-import filecmp
 import logging
 import os
 import subprocess
 from contextlib import contextmanager
 
+from . import mailqueue
+from . import metrics
+
 
 #
 # touch a file
@@ -77,6 +79,30 @@ def rmemptysubdirs(path, depth=3):
             os.rmdir(dirpath)
 
 
+#
+# compare the contents of two files, returning True if they are the same
+#
+# (like filecmp.cmp(shallow=False), but without caching the result, and with
+# the I/O done counted)
+#
+@metrics.subsystem('filecmp')
+def cmp_files(f1, f2, bufsize=64 * 1024):
+    metrics.io('stats', 2)
+    if os.path.getsize(f1) != os.path.getsize(f2):
+        return False
+
+    with open(f1, 'rb') as a, open(f2, 'rb') as b:
+        metrics.io('opens', 2)
+        while True:
+            c1 = a.read(bufsize)
+            c2 = b.read(bufsize)
+            metrics.io('bytes_read', len(c1) + len(c2))
+            if c1 != c2:
+                return False
+            if not c1:
+                return True
+
+
 #
 # a wrapper for open() which:
 #
@@ -94,7 +120,7 @@ def open_amifc(filepath, mode='w', cb=None):
             logging.debug('writing %s for move-if-changed' % (tmppath))
             yield file
 
-        changed = not os.path.exists(filepath) or not filecmp.cmp(tmppath, filepath, shallow=False)
+        changed = not os.path.exists(filepath) or not cmp_files(tmppath, filepath)
         if changed:
             logging.info("writing %s" % (filepath))
             os.rename(tmppath, filepath)
@@ -199,6 +225,10 @@ def sendmail(hdr, msg):
         logging.debug('-' * 40)
         logging.debug(msg)
         logging.debug('-' * 40)
+    elif mailqueue.queue():
+        # if a mail queue has been configured, leave it to deliver this
+        mailqueue.queue().enqueue(envelope_from, m.as_bytes())
+        logging.debug('sendmail: msgid %s, queued' % (m['Message-Id']))
     else:
         with subprocess.Popen(['/usr/sbin/sendmail', '-t', '-oi', '-f', envelope_from], stdin=subprocess.PIPE) as p:
             p.communicate(m.as_bytes())
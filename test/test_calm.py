@@ -25,30 +25,63 @@
 # tests
 #
 
+import bz2
 import collections
 import contextlib
 import filecmp
+import http.server
 import io
 import json
 import logging
+import logging.handlers
+import lzma
 import os
 import pprint
+import pstats
 import re
 import shutil
+import signal
+import socket
+import socketserver
 import tempfile
+import threading
+import time
 import types
 import unittest
+import unittest.mock
+import urllib.parse
 
+import benchmarks.loadsim as loadsim
+import benchmarks.rsync_delta as rsync_delta
+import benchmarks.synthetic as synthetic
+
+import calm.abeyance_handler as abeyance_handler
 import calm.calm
+import calm.compress as compress
 import calm.db as db
+import calm.dirtree as dirtree
 import calm.hint as hint
+import calm.irk as irk
+import calm.logfilters as logfilters
+import calm.mailqueue as mailqueue
 import calm.maintainers as maintainers
+import calm.metrics as metrics
 import calm.package as package
 import calm.pkg2html as pkg2html
+import calm.profiling as profiling
+import calm.publish as publish
+import calm.repology as repology
 import calm.reports as reports
+import calm.scheduler as scheduler
+import calm.sign as sign
 import calm.uploads as uploads
+import calm.utils as utils
 from calm.version import SetupVersion
 
+import xtarfile
+
+import zstandard
+
 from .utils import compare_with_expected_file
 
 ARGDIRS = ['rel_area', 'homedir', 'htdocs', 'stagingdir', 'vault']
@@ -102,6 +135,121 @@ def pprint_patch():
         yield
 
 
+#
+# serve recorded repology API responses
+#
+@contextlib.contextmanager
+def repology_stub():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            last_pn = urllib.parse.urlparse(self.path).path.split('/')[4]
+            fn = os.path.join('testdata', 'repology', 'projects' + ('-' + last_pn if last_pn else '') + '.json')
+
+            try:
+                with open(fn, 'rb') as f:
+                    content = f.read()
+            except FileNotFoundError:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d/api/v1/projects/' % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#
+# a minimal SMTP server, which records the connections made to it, and the
+# messages received over each one
+#
+@contextlib.contextmanager
+def smtp_stub():
+    connections = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, s):
+            self.wfile.write(s.encode() + b'\r\n')
+
+        def handle(self):
+            messages = []
+            connections.append(messages)
+            self.reply('220 localhost')
+
+            for l in self.rfile:
+                cmd = l.decode().strip()
+                verb = cmd.split(' ', 1)[0].upper()
+                if verb in ['EHLO', 'HELO', 'RSET', 'NOOP']:
+                    self.reply('250 ok')
+                elif verb == 'MAIL':
+                    msg = {'from': cmd[10:], 'to': [], 'data': b''}
+                    self.reply('250 ok')
+                elif verb == 'RCPT':
+                    msg['to'].append(cmd[8:])
+                    self.reply('250 ok')
+                elif verb == 'DATA':
+                    self.reply('354 go ahead')
+                    for d in self.rfile:
+                        if d == b'.\r\n':
+                            break
+                        msg['data'] += d
+                    messages.append(msg)
+                    self.reply('250 ok')
+                elif verb == 'QUIT':
+                    self.reply('221 bye')
+                    break
+                else:
+                    self.reply('500 unrecognized')
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield (server.server_address[1], connections)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#
+# a stand-in for irked, which records the connections made to it, and the
+# notifications received over each one
+#
+@contextlib.contextmanager
+def irked_stub():
+    connections = []
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            notifications = []
+            connections.append(notifications)
+            for l in self.rfile:
+                notifications.append(json.loads(l))
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield (server.server_address, connections)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 #
 #
 #
@@ -147,6 +295,7 @@ class CalmTest(unittest.TestCase):
         args.homedir = 'testdata/homes'
         args.dryrun = False
         args.force = True
+        args.jobs = 2
         args.pkglist = 'testdata/pkglist/cygwin-pkg-maint'
         args.repodir = 'testdata/repodir'
 
@@ -157,7 +306,11 @@ class CalmTest(unittest.TestCase):
 
         packages, _ = package.read_packages(args.rel_area)
         package.validate_packages(args, packages)
-        pkg2html.update_package_listings(args, packages)
+        with self.assertLogs(level='INFO') as cm:
+            pkg2html.update_package_listings(args, packages)
+
+        # log output from writing listings in worker processes reaches us
+        self.assertTrue(any(r.levelno == logging.INFO and r.processName != 'MainProcess' and r.getMessage().startswith('writing ') for r in cm.records))
 
         # compare the output dirtree with expected
         with self.subTest('dirtree'):
@@ -168,6 +321,10 @@ class CalmTest(unittest.TestCase):
         for (dirpath, _subdirs, files) in os.walk(htdocs):
             relpath = os.path.relpath(dirpath, htdocs)
             for f in files:
+                # (summary page fingerprints are recorded in the database)
+                if f == 'calm.db':
+                    continue
+
                 with self.subTest(file=os.path.join(relpath, f)):
                     results = os.path.join(htdocs, relpath, f)
                     expected = os.path.join('testdata/htdocs.expected', relpath, f)
@@ -178,6 +335,463 @@ class CalmTest(unittest.TestCase):
                     else:
                         logging.info("%s identical", os.path.join(relpath, f))
 
+        # summaries are only rewritten when something they are made from changes
+        with self.subTest('fingerprints'):
+            args.force = False
+            summary = os.path.join(htdocs, 'summary', 'arc.html')
+            with open(summary, 'w') as f:
+                print('scribble', file=f)
+
+            pkg2html.update_package_listings(args, packages)
+            with open(summary) as f:
+                self.assertEqual(f.read(), 'scribble\n')
+
+            packages['arc'].hints(packages['arc'].best_version)['sdesc'] = '"changed"'
+            pkg2html.update_package_listings(args, packages)
+            with open(summary) as f:
+                self.assertIn('changed', f.read())
+
+        # files we've generated are recorded in the manifest, so removed ones
+        # are found without scanning htdocs
+        with self.subTest('manifest'):
+            manifest = db.generated_files(args)
+            self.assertIn(os.path.join('summary', 'arc.html'), manifest)
+            self.assertIn(os.path.join('x86_64', 'arc', '.htaccess'), manifest)
+
+            del packages['arc']
+            pkg2html.update_package_listings(args, packages)
+            self.assertFalse(os.path.exists(summary))
+            self.assertNotIn(os.path.join('summary', 'arc.html'), db.generated_files(args))
+
+    def test_repology(self):
+        args = types.SimpleNamespace()
+        args.dryrun = False
+        args.pkglist = 'testdata/pkglist/cygwin-pkg-maint'
+        packages, _ = package.read_packages('testdata/relarea')
+        package.validate_packages(args, packages)
+
+        def reset():
+            return unittest.mock.patch.multiple(repology, fetch_thread=None, last_fetch=0,
+                                                cached={'timestamp': 0, 'data': {}}, cached_mtime=None)
+
+        with tempfile.TemporaryDirectory() as args.htdocs, repology_stub() as url, \
+                unittest.mock.patch.multiple(repology, REPOLOGY_API_URL=url, REPOLOGY_API_INTERVAL=0):
+            with reset():
+                repology.annotate_packages(args, packages, wait=True)
+
+                self.assertEqual(packages['arc-src'].upstream_version, '5.21p')
+                self.assertEqual(packages['arc-src'].up_to_date, -1)
+                self.assertEqual(packages['keychain-src'].upstream_version, '2.7.1')
+                self.assertEqual(packages['keychain-src'].up_to_date, 0)
+
+            # after a restart, data is read from the cache, and isn't fetched
+            # again, since it's fresh
+            with reset():
+                data = repology.read_cache(repology.cache_file(args))['data']
+                self.assertEqual(data['libspiro'].upstream_version, [repology.UnknownVersion.noscheme])
+
+                repology.annotate_packages(args, packages)
+                self.assertIsNone(repology.fetch_thread)
+
+    def test_package_names(self):
+        args = types.SimpleNamespace()
+
+        with tempfile.TemporaryDirectory() as args.htdocs:
+            self.assertEqual(db.update_package_names(args, {'a': None, 'b': None}), set())
+            self.assertEqual(db.update_package_names(args, {'a': None}), {'b'})
+
+            # the same historic names are read back from the database
+            db.reset_db()
+            self.assertEqual(db.update_package_names(args, {'a': None, 'c': None}), {'b'})
+            self.assertEqual(db.update_package_names(args, {}), {'a', 'b', 'c'})
+
+    def test_mail_routing(self):
+        args = types.SimpleNamespace()
+        args.email = ['leads@example.org']
+        args.pkglist = 'testdata/pkglist/cygwin-pkg-maint'
+
+        state = calm.calm.CalmState()
+        state.args = args
+        state.subject = 'test'
+
+        class RecordingHandler(logging.handlers.BufferingHandler):
+            def __init__(self, toaddrs, subject):
+                super().__init__(capacity=0)
+                self.subject = subject
+
+            def shouldFlush(self, record):
+                return False
+
+            def flush(self):
+                if self.buffer:
+                    sent[self.subject] = [self.format(r) for r in self.buffer]
+                self.buffer = []
+
+        root = logging.getLogger()
+        level = root.level
+        root.setLevel(logging.NOTSET)
+
+        with tempfile.TemporaryDirectory() as args.homedir, tempfile.TemporaryDirectory() as args.htdocs, \
+                unittest.mock.patch.object(calm.calm, 'BufferingSMTPHandler', RecordingHandler):
+            for m in ['Blooey McFooey', 'Jari Aalto', 'Jon Turney']:
+                os.mkdir(os.path.join(args.homedir, m))
+                with open(os.path.join(args.homedir, m, '!email'), 'w') as f:
+                    print('%s@example.org' % m.replace(' ', '.'), file=f)
+
+            # (records are the same, whether held in memory or spilled to disk)
+            try:
+                for threshold in [abeyance_handler.SPILL_THRESHOLD, 1]:
+                    sent = {}
+
+                    with self.subTest(threshold=threshold), \
+                            unittest.mock.patch.object(abeyance_handler, 'SPILL_THRESHOLD', threshold):
+                        with calm.calm.mail_logs(state):
+                            with logfilters.AttrFilter(package='arc'):
+                                logging.info('about %s', 'arc')
+                            with logfilters.AttrFilter(maint='Blooey McFooey'):
+                                logging.warning('by Blooey')
+                                with logfilters.AttrFilter(package='keychain'):
+                                    logging.info('by Blooey, about keychain')
+                            logging.error('about nothing in particular')
+
+                        self.assertEqual(sent, {
+                            'test': ['about nothing in particular'],
+                            'test for Jari Aalto': ['about arc', 'by Blooey, about keychain'],
+                            'test for Blooey McFooey': ['by Blooey', 'by Blooey, about keychain'],
+                        })
+            finally:
+                root.setLevel(level)
+
+    def test_mailqueue(self):
+        hdr = {
+            'From': 'calm@example.org',
+            'To': 'maintainer@example.org',
+            'Bcc': 'archive@example.org',
+        }
+
+        # a port with nothing listening on it
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            closed_port = s.getsockname()[1]
+
+        with tempfile.TemporaryDirectory() as spooldir:
+            # queued messages remain in the spool when they can't be delivered
+            q = mailqueue.MailQueue(spooldir, mailqueue.SMTPBackend('127.0.0.1', closed_port), background=False)
+            with unittest.mock.patch.object(mailqueue, '_queue', q):
+                for i in range(2):
+                    utils.sendmail(dict(hdr, Subject='message %d' % i), 'body %d' % i)
+
+            self.assertEqual(len(q.pending()), 2)
+            self.assertEqual(q.deliver(), 2)
+
+            # a malformed message is set aside, without preventing delivery of
+            # the others
+            with open(os.path.join(spooldir, 'malformed.msg'), 'wb') as f:
+                f.write(b'\xff\n')
+
+            # ... and are delivered later (e.g. after a restart), over a single
+            # connection
+            with smtp_stub() as (port, connections):
+                q = mailqueue.MailQueue(spooldir, mailqueue.SMTPBackend('127.0.0.1', port), background=False)
+                self.assertEqual(q.deliver(), 0)
+
+            self.assertEqual(os.listdir(q.failed), ['malformed.msg'])
+            self.assertEqual(len(connections), 1)
+            self.assertEqual(len(connections[0]), 2)
+            for i, msg in enumerate(connections[0]):
+                self.assertEqual(msg['from'], '<calm@example.org>')
+                self.assertEqual(sorted(msg['to']), ['<archive@example.org>', '<maintainer@example.org>'])
+                self.assertIn(b'Subject: message %d' % i, msg['data'])
+                self.assertNotIn(b'Bcc:', msg['data'])
+
+    def test_irk(self):
+        target = irk.DEFAULT_TARGET[0]
+
+        with irked_stub() as (server, connections):
+            # notifications beyond the queue size are dropped, and repeated or
+            # queued notifications are coalesced
+            n = irk.Notifier(server, maxsize=4, background=False)
+            for m in ['processing uploads', 'processing uploads', 'processing uploads', 'processing done', 'lost', 'lost']:
+                n.notify('calm %s' % m)
+            n.send_pending()
+
+            # the connection is reused
+            n.notify('calm processing release area')
+            n.send_pending()
+
+            # flushing times out if nothing is sending
+            n.notify('calm unsent')
+            self.assertFalse(n.flush(0.1))
+            n.send_pending()
+            self.assertTrue(n.flush(10))
+            n.close()
+
+            # a notification sent in the background
+            n = irk.Notifier(server)
+            n.notify('calm daemon started')
+            self.assertTrue(n.flush(10))
+            n.close()
+
+            # wait for the stub to see the connections close
+            deadline = time.time() + 10
+            while sum(len(c) for c in connections) < 4 and time.time() < deadline:
+                time.sleep(0.05)
+
+        self.assertEqual(connections, [
+            [
+                {'to': target, 'privmsg': 'calm processing uploads (x3); calm processing done; calm dropped 2 notification(s)'},
+                {'to': target, 'privmsg': 'calm processing release area'},
+                {'to': target, 'privmsg': 'calm unsent'},
+            ],
+            [
+                {'to': target, 'privmsg': 'calm daemon started'},
+            ],
+        ])
+
+    def test_scheduler(self):
+        args = types.SimpleNamespace()
+        args.rel_area = '/relarea'
+        args.homedir = '/homedir'
+        args.stagingdir = '/staging'
+
+        # replay a recorded trace of inotify events through the scheduler,
+        # checking every second if actions are due, returning the batches of
+        # actions taken, and the number of cycles the daemon would have run
+        # without the scheduler (one for each time a read of inotify events
+        # returned some requiring an action)
+        def replay(trace):
+            with open(os.path.join('testdata', 'events', trace)) as f:
+                events = [json.loads(l) for l in f]
+
+            s = scheduler.Scheduler(args, quiet=10, max_delay=120)
+            batches = []
+            unscheduled = set()
+            now = 0
+            while events or s.pending():
+                while events and events[0]['t'] <= now:
+                    e = events.pop(0)
+                    event = (None, e['types'], '/' + e['path'], e['filename'])
+                    if s.add(event, now):
+                        unscheduled.add(e['t'])
+
+                if s.due(now):
+                    (action, maints, paths) = s.take()
+                    batches.append((now, action, sorted(maints), sorted(paths)))
+
+                now += 1
+
+            return batches, len(unscheduled)
+
+        Event = scheduler.Event
+        batches, unscheduled = replay('uploads.trace')
+        self.assertEqual(batches, [
+            (29, Event.read_uploads, ['Blooey McFooey', 'Jon Turney'], []),
+            (110, Event.read_uploads, ['Jari Aalto'], []),
+        ])
+        self.assertEqual(unscheduled - len(batches), 3)
+
+        # a continuous stream of events is processed at least every max_delay
+        batches, unscheduled = replay('relarea.trace')
+        self.assertEqual([(b[0], b[1]) for b in batches], [(120, Event.read_relarea), (189, Event.read_relarea), (210, Event.read_relarea)])
+        self.assertEqual(batches[0][3], [os.path.join('x86_64', 'release', p) for p in ['cygwin', 'keychain', 'libspiro', 'perl-Net-SMTP-SSL', 'testpackage']])
+        self.assertEqual(unscheduled - len(batches), 178)
+
+    def test_dirtree(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            relarea = os.path.join(tmpdir, 'relarea')
+            shutil.copytree('testdata/relarea', relarea)
+            os.makedirs(os.path.join(relarea, 'x86_64', publish.GENERATIONS_DIR))
+
+            before = dirtree.scan(relarea, exclude=[publish.GENERATIONS_DIR])
+            self.assertEqual(dirtree.changed(before, dirtree.scan(relarea, exclude=[publish.GENERATIONS_DIR])), set())
+
+            # add a file to a package, add a new package, remove a package, and
+            # write setup.ini and a new generation of it
+            utils.touch(os.path.join(relarea, 'x86_64', 'release', 'testpackage', 'testpackage-1.0-2.tar.bz2'))
+            os.makedirs(os.path.join(relarea, 'noarch', 'release', 'newpackage'))
+            shutil.rmtree(os.path.join(relarea, 'x86_64', 'release', 'keychain'))
+            utils.touch(os.path.join(relarea, 'x86_64', 'setup.ini'))
+            os.makedirs(os.path.join(relarea, 'x86_64', publish.GENERATIONS_DIR, '1'))
+
+            after = dirtree.scan(relarea, exclude=[publish.GENERATIONS_DIR])
+            changes = dirtree.changed(before, after)
+            self.assertEqual(changes, {
+                'x86_64',
+                os.path.join('x86_64', 'release'),
+                os.path.join('x86_64', 'release', 'keychain'),
+                os.path.join('x86_64', 'release', 'testpackage'),
+                os.path.join('noarch', 'release'),
+                os.path.join('noarch', 'release', 'newpackage'),
+            })
+
+            # changes to arch directories alone don't need the release area to
+            # be read
+            args = types.SimpleNamespace(rel_area=relarea, homedir='/homedir', stagingdir='/staging')
+            s = scheduler.Scheduler(args)
+            self.assertFalse(s.add_relarea_changes({'.', 'x86_64'}))
+            self.assertTrue(s.add_relarea_changes(changes))
+            self.assertEqual(s.action, scheduler.Event.read_relarea)
+            self.assertEqual(s.paths, {
+                os.path.join('x86_64', 'release', 'keychain'),
+                os.path.join('x86_64', 'release', 'testpackage'),
+                os.path.join('noarch', 'release', 'newpackage'),
+            })
+
+    def test_metrics(self):
+        with tempfile.TemporaryDirectory() as htdocs:
+            args = types.SimpleNamespace(htdocs=htdocs, dryrun=False)
+
+            metrics.start()
+            with metrics.phase('read_packages'):
+                packages, _ = package.read_packages('testdata/relarea')
+            for m in ['Blooey McFooey', 'Jon Turney']:
+                with metrics.phase('upload/%s' % m):
+                    pass
+            m = metrics.finish(args)
+
+            self.assertEqual(m.counters['packages'], len(packages))
+            self.assertEqual(m.phases['read_packages'][2], 1)
+            self.assertRegex(m.summary(), r'^cycle took [0-9.]+s \([0-9.]+s CPU\), read_packages [0-9.]+s')
+
+            with open(os.path.join(htdocs, metrics.PROMETHEUS_FILE)) as f:
+                prom = f.read()
+            self.assertIn('# TYPE calm_phase_wall_seconds gauge\n', prom)
+            self.assertRegex(prom, r'\ncalm_phase_wall_seconds{phase="read_packages"} [0-9.e-]+\n')
+            self.assertRegex(prom, r'\ncalm_phase_calls{phase="upload",maintainer="Jon Turney"} 1\n')
+            self.assertIn('\ncalm_packages %d\n' % len(packages), prom)
+
+            # I/O is attributed to the subsystem doing it
+            self.assertGreater(m.io['read_one_package']['opens'], 0)
+            self.assertGreater(m.io['sha512_file']['bytes_read'], 0)
+            self.assertEqual(m.io['tarfile_is_empty']['archives'], m.io['tarfile_is_empty']['opens'])
+            self.assertRegex(m.io_summary(), r'read_one_package: [0-9]+ stats, [0-9]+ opens, [0-9]+ bytes read;')
+            self.assertRegex(prom, r'\ncalm_io_opens{subsystem="read_one_package"} [0-9]+\n')
+
+            # history is appended to
+            metrics.start()
+            fn = os.path.join(htdocs, metrics.PROMETHEUS_FILE)
+            self.assertTrue(utils.cmp_files(fn, fn))
+            metrics.finish(args)
+            with open(os.path.join(htdocs, metrics.HISTORY_FILE)) as f:
+                history = [json.loads(l) for l in f]
+            self.assertEqual(len(history), 2)
+            self.assertEqual(history[0]['counters']['packages'], len(packages))
+            self.assertEqual(history[0]['io'], m.io)
+            self.assertEqual(history[1]['phases'], {})
+            self.assertEqual(history[1]['io'], {'filecmp': {'bytes_read': 2 * len(prom), 'opens': 2, 'stats': 2}})
+
+            # the bytes read from an archive are the compressed bytes actually
+            # read (all of them, for a zstd archive)
+            m = metrics.start()
+            for tf in ['testdata/homes/Blooey McFooey/noarch/release/perl-Net-SMTP-SSL/perl-Net-SMTP-SSL-1.03-2.tar.xz',
+                       'testdata/homes/Blooey McFooey/x86_64/release/testpackage-zstd/testpackage-zstd-1.0-1.tar.zst']:
+                with xtarfile.open(tf, mode='r') as a:
+                    a.getmembers()
+                    metrics.archive_io(a, tf)
+                    self.assertEqual(m.io['other']['bytes_read'], os.path.getsize(tf))
+                    self.assertEqual(m.io['other']['bytes_decompressed'], a.offset)
+                m.io.clear()
+
+    def test_profiling(self):
+        with tempfile.TemporaryDirectory() as profile_dir:
+            try:
+                profiling.configure(profile_dir, profiling.parse_phases('read'), trace_malloc=True)
+                self.assertTrue(profiling.enabled())
+
+                for _i in range(2):
+                    profiling.start_cycle()
+                    with profiling.profile('read'):
+                        package.read_packages('testdata/relarea')
+                    with profiling.profile('validate'):
+                        pass
+
+                # (cycles starting in the same second don't overwrite each
+                # other's files)
+                files = os.listdir(profile_dir)
+                self.assertEqual(len(files), 4)
+                self.assertEqual(set(os.path.splitext(f)[1] for f in files), {'.pstats', '.tracemalloc'})
+                self.assertTrue(all(f.split('-')[-1].startswith('read.') for f in files))
+                pstats.Stats(os.path.join(profile_dir, [f for f in files if f.endswith('.pstats')][0]))
+
+                # toggling turns profiling off
+                self.assertFalse(profiling.toggle())
+                shutil.rmtree(profile_dir)
+                with profiling.profile('read'):
+                    pass
+                self.assertFalse(os.path.exists(profile_dir))
+            finally:
+                profiling.configure(None, set())
+
+        with self.assertRaises(ValueError):
+            profiling.parse_phases('read,bogus')
+        self.assertEqual(profiling.parse_phases('all'), set(profiling.PHASES))
+
+    def test_synthetic(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args = types.SimpleNamespace()
+            args.rel_area = os.path.join(tmpdir, 'relarea')
+            args.pkglist = os.path.join(tmpdir, 'cygwin-pkg-maint')
+            args.htdocs = os.path.join(tmpdir, 'htdocs')
+            args.dryrun = True
+
+            result = synthetic.generate(args.rel_area, args.pkglist, 300)
+            synthetic.generate(os.path.join(tmpdir, 'upload'), None, 300, update=True)
+
+            # the generated release area is valid, and so is it merged with
+            # the generated update to it
+            packages, error = package.read_packages(args.rel_area)
+            self.assertFalse(error)
+            self.assertEqual(len(packages), result.packages)
+            self.assertTrue(package.validate_packages(args, packages))
+
+            upload, _ = package.read_packages(os.path.join(tmpdir, 'upload'))
+            merged = package.merge(packages, upload)
+            self.assertTrue(package.validate_packages(args, merged))
+            self.assertEqual(merged['pkg00000-src'].best_version, '9.0-1')
+
+    def test_daemon_loop_stop(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sim = loadsim.Simulation(tmpdir, 100, quiet_period=1, max_delay=2)
+            with sim:
+                # the initial cycle has published setup.ini
+                self.assertTrue(os.path.exists(os.path.join(sim.args.rel_area, synthetic.ARCH, 'setup.ini')))
+                start = time.time()
+
+            # the loop stops promptly when it's waiting for events
+            self.assertFalse(sim.thread.is_alive())
+            self.assertLess(time.time() - start, calm.calm.POLL_INTERVAL + 5)
+
+    def test_loadsim_script(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            args = types.SimpleNamespace()
+            args.rel_area = os.path.join(tmpdir, 'relarea')
+            args.pkglist = os.path.join(tmpdir, 'cygwin-pkg-maint')
+            args.htdocs = os.path.join(tmpdir, 'htdocs')
+            args.dryrun = True
+
+            result = synthetic.generate(args.rel_area, args.pkglist, 300)
+            steps = loadsim.script(result.catalogue, 'mixed', seed=1)
+
+            # scripts are reproducible, in time order, and don't operate on
+            # the same source package twice
+            self.assertEqual(steps, loadsim.script(result.catalogue, 'mixed', seed=1))
+            self.assertEqual([s['t'] for s in steps], sorted(s['t'] for s in steps))
+            self.assertEqual(len(set(s['source'] for s in steps)), len(steps))
+            for (op, count, _spread) in loadsim.SCENARIOS['mixed']:
+                self.assertEqual(len([s for s in steps if s['op'] == op]), count)
+
+            # the uploads written are valid
+            sources = {s.name: s for s in result.catalogue}
+            upload = os.path.join(tmpdir, 'upload')
+            for s in steps:
+                if s['op'] == 'upload':
+                    synthetic.write_version(upload, sources[s['source']].path, s['source'], s['version'])
+
+            packages, _ = package.read_packages(args.rel_area)
+            uploaded, error = package.read_packages(upload)
+            self.assertFalse(error)
+            self.assertTrue(package.validate_packages(args, package.merge(packages, uploaded)))
+
     def test_version_sort(self):
         test_data = [
             ["1.0.0", "2.0.0", -1],
@@ -302,6 +916,20 @@ class CalmTest(unittest.TestCase):
 
         compare_with_expected_file(self, 'testdata/pkglist', mlist)
 
+        # the maintainer list is cached, until something it's made from changes
+        self.assertIs(maintainers.maintainer_list(args), mlist)
+
+        with tempfile.TemporaryDirectory() as args.homedir:
+            shutil.copytree('testdata/homes/Blooey McFooey', os.path.join(args.homedir, 'Blooey McFooey'))
+            mlist = maintainers.maintainer_list(args)
+            self.assertIs(maintainers.maintainer_list(args), mlist)
+
+            with open(os.path.join(args.homedir, 'Blooey McFooey', '!email'), 'a') as f:
+                print('blooey@example.org', file=f)
+
+            mlist = maintainers.maintainer_list(args)
+            self.assertIn('blooey@example.org', mlist['Blooey McFooey'].email)
+
     def test_scan_uploads(self):
         self.maxDiff = None
 
@@ -361,7 +989,8 @@ class CalmTest(unittest.TestCase):
         packages, _ = package.read_packages(args.rel_area)
         package.delete(packages, 'x86_64/release/nonexistent', 'nosuchfile-1.0.0.tar.xz')
         self.assertEqual(package.validate_packages(args, packages), True)
-        package.write_setup_ini(args, packages, args.arch)
+        digest = package.write_setup_ini(args, packages, args.arch)
+        self.assertEqual(digest, package.setup_ini_digest(args.inifile))
         with open(args.inifile) as inifile:
             results = inifile.read()
             # fix the timestamp to match expected
@@ -369,8 +998,178 @@ class CalmTest(unittest.TestCase):
             results = re.sub('generated at .*', 'generated at 2016-03-17 13:36:40 GMT', results, count=1)
             compare_with_expected_file(self, 'testdata/inifile', (results,), 'setup.ini')
 
+        # digest ignores changes to timestamp, comments and whitespace ...
+        d = package.SetupIniDigest()
+        d.update(re.sub('\n\n', '\n  \n\n', results.replace('sdesc: ', 'sdesc:  ')))
+        self.assertEqual(digest, d.hexdigest())
+
+        # ... but not other changes
+        d = package.SetupIniDigest()
+        d.update(results.replace('arch: x86_64', 'arch: x86'))
+        self.assertNotEqual(digest, d.hexdigest())
+
         # XXX: delete a needed package, and check validate fails
 
+    def test_compress(self):
+        with open('testdata/inifile/setup.ini.expected', 'rb') as f:
+            data = f.read()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            basename = os.path.join(tmpdir, 'setup')
+            self.assertTrue(compress.compress(data, basename))
+
+            self.assertCountEqual(os.listdir(tmpdir), ['setup' + ext for ext in compress.EXTENSIONS])
+            with bz2.open(basename + '.bz2') as f:
+                self.assertEqual(f.read(), data)
+            with lzma.open(basename + '.xz') as f:
+                self.assertEqual(f.read(), data)
+            with open(basename + '.zst', 'rb') as f:
+                self.assertEqual(zstandard.ZstdDecompressor().decompress(f.read()), data)
+
+    def test_compress_rsyncable(self):
+        def inifile(versions):
+            return ''.join('@ pkg%d\nversion: %s\n\n' % (i, v) for i, v in enumerate(versions)).encode()
+
+        versions = ['1.0-1'] * 1000
+        data = inifile(versions)
+        chunks = list(compress.rsyncable_chunks(data))
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 1)
+
+        # changing a package only changes the chunk containing it
+        versions[500] = '2.0-1'
+        changed_chunks = list(compress.rsyncable_chunks(inifile(versions)))
+        self.assertEqual(len(chunks), len(changed_chunks))
+        self.assertEqual(len([c for c in changed_chunks if c not in chunks]), 1)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            basename = os.path.join(tmpdir, 'setup')
+            self.assertTrue(compress.compress(data, basename, rsyncable=True))
+            with open(basename + '.zst', 'rb') as f:
+                self.assertEqual(zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True).read(), data)
+
+    @unittest.skipUnless(shutil.which('rsync'), 'needs rsync')
+    def test_rsync_delta(self):
+        def inifile(n):
+            return ''.join('@ pkg%d\nversion: %s\n\n' % (i, '2.0-1' if i == n * 100 else '1.0-1') for i in range(3000))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inifiles = []
+            for n in range(4):
+                fn = os.path.join(tmpdir, 'setup.ini.%d' % n)
+                with open(fn, 'w') as f:
+                    f.write(inifile(n))
+                inifiles.append(fn)
+
+            # mirroring the published generations with rsync transfers only a
+            # delta for setup.ini (even when the mirror follows symlinks, and
+            # so has more than one copy of it), and the rsyncable setup.zst
+            for copy_links in [False, True]:
+                generations = list(rsync_delta.measure(inifiles, copy_links))
+                self.assertEqual(len(generations), 3 if copy_links else 2)
+                for _fn, result in generations:
+                    size, sent = result['ini']
+                    self.assertLess(sent, size / 2)
+                    if not copy_links:
+                        size, sent = result['zst --rsyncable']
+                        self.assertLess(sent, size)
+
+    def test_sign(self):
+        gpg = os.path.abspath('fake-gpg')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            files = [os.path.join(tmpdir, f) for f in ['setup.ini', 'setup.fail', 'setup.hang', 'setup.crash', 'setup.zst']]
+            for fn in files:
+                with open(fn, 'w') as f:
+                    print(fn, file=f)
+
+            with self.assertLogs(level='ERROR') as cm:
+                failed = sign.sign(files, ['KEYID'], gpg=gpg, timeout=2)
+
+            self.assertEqual(failed, files[1:4])
+            self.assertEqual([r.getMessage() for r in cm.records], [
+                'signing %s failed, gpg exited 2' % files[1],
+                'signing %s timed out after 2 seconds' % files[2],
+                'signing %s failed, gpg killed by signal %d' % (files[3], signal.SIGABRT),
+            ])
+            self.assertCountEqual(os.listdir(tmpdir), [os.path.basename(f) for f in files] + ['setup.ini.sig', 'setup.zst.sig'])
+            with open(files[0] + '.sig') as f:
+                self.assertTrue(f.read().startswith('FAKE SIGNATURE -uKEYID --batch --yes -b'))
+
+    def test_publish(self):
+        files = ['setup.ini', 'setup.ini.sig']
+
+        def generation(content):
+            staging = publish.new_generation(basedir)
+            for f in files:
+                with open(os.path.join(staging, f), 'w') as fh:
+                    print(content, file=fh)
+            publish.publish(basedir, staging, files)
+            return os.readlink(os.path.join(basedir, publish.GENERATIONS_DIR, 'current'))
+
+        def published():
+            with open(os.path.join(basedir, 'setup.ini')) as fh:
+                return fh.read().strip()
+
+        with tempfile.TemporaryDirectory() as basedir:
+            # a regular file is replaced by a symlink into the generation
+            with open(os.path.join(basedir, 'setup.ini'), 'w') as fh:
+                print('old', file=fh)
+
+            gen1 = generation('one')
+            self.assertEqual(published(), 'one')
+            self.assertTrue(os.path.islink(os.path.join(basedir, 'setup.ini')))
+            self.assertTrue(os.path.islink(os.path.join(basedir, 'setup.ini.sig')))
+
+            gen2 = generation('two')
+            self.assertEqual(published(), 'two')
+
+            # generations alternate between two slots, so the files are always
+            # at the same paths (and the staging directories are removed)
+            gen3 = generation('three')
+            self.assertEqual(published(), 'three')
+            self.assertCountEqual(os.listdir(os.path.join(basedir, publish.GENERATIONS_DIR)), ['current', 'previous'] + publish.SLOTS)
+            self.assertEqual(os.readlink(os.path.join(basedir, publish.GENERATIONS_DIR, 'current')), gen3)
+            self.assertEqual(gen1, gen3)
+            self.assertNotEqual(gen2, gen3)
+
+            self.assertTrue(publish.rollback(basedir))
+            self.assertEqual(published(), 'two')
+
+    def test_publish_setup_ini(self):
+        args = types.SimpleNamespace()
+        args.compress_threads = 1
+        args.keys = ['KEYID']
+        args.rsyncable = False
+
+        gpg = os.path.abspath('fake-gpg')
+        real_sign = sign.sign
+
+        def generation(content, failed=False):
+            inifile = os.path.join(basedir, 'setup.ini~')
+            with open(inifile, 'w') as fh:
+                print(content, file=fh)
+            with unittest.mock.patch.object(sign, 'sign', lambda files, keys: files[1:2] if failed else real_sign(files, keys, gpg=gpg)):
+                return calm.calm.publish_setup_ini(args, basedir, inifile)
+
+        with tempfile.TemporaryDirectory() as basedir:
+            gendir = os.path.join(basedir, publish.GENERATIONS_DIR)
+
+            self.assertTrue(generation('one'))
+            current = os.readlink(os.path.join(gendir, 'current'))
+            self.assertTrue(os.path.exists(os.path.join(basedir, 'setup.zst.sig')))
+
+            # if signing or compressing fails, the current generation is kept,
+            # and the staging directory discarded
+            self.assertFalse(generation('two', failed=True))
+            with unittest.mock.patch.object(compress, 'compress', lambda *args: False):
+                self.assertFalse(generation('three'))
+
+            self.assertEqual(os.readlink(os.path.join(gendir, 'current')), current)
+            self.assertCountEqual(os.listdir(gendir), ['current', current])
+            with open(os.path.join(basedir, 'setup.ini')) as fh:
+                self.assertEqual(fh.read().strip(), 'one')
+
     def test_process_uploads_conflict(self):
         self.maxDiff = None
 
@@ -443,6 +1242,42 @@ class CalmTest(unittest.TestCase):
                 compare_with_expected_file(self, 'testdata/upload_bad_auth', dirlist, d)
                 shutil.rmtree(getattr(args, d))
 
+    def test_process_uploads_only(self):
+        args = types.SimpleNamespace()
+
+        for d in ARGDIRS:
+            setattr(args, d, tempfile.mktemp())
+
+        shutil.copytree('testdata/relarea', args.rel_area)
+        shutil.copytree('testdata/homes', args.homedir)
+        os.mkdir(args.stagingdir)
+
+        args.dryrun = False
+        args.email = None
+        args.force = False
+        args.pkglist = 'testdata/pkglist/cygwin-pkg-maint'
+        args.stale = True
+        args.trustedmaint = ''
+
+        reminder_file = os.path.join(args.homedir, 'Jon Turney', '!reminder-timestamp')
+        utils.touch(reminder_file)
+
+        state = calm.calm.CalmState()
+        state.args = args
+        state.packages = calm.calm.process_relarea(args, state)
+
+        # the reminder time of a maintainer whose uploads weren't looked at is
+        # left alone ...
+        calm.calm.process_uploads(args, state, only={'Blooey McFooey'})
+        self.assertTrue(os.path.exists(reminder_file))
+
+        # ... but is reset when they are, and there's nothing to remind about
+        calm.calm.process_uploads(args, state)
+        self.assertFalse(os.path.exists(reminder_file))
+
+        for d in ARGDIRS:
+            shutil.rmtree(getattr(args, d))
+
     def test_process_normal(self):
         self.maxDiff = None
 
@@ -506,6 +1341,48 @@ class CalmTest(unittest.TestCase):
             del j['timestamp']
             compare_with_expected_file(self, 'testdata/process_arch', json.dumps(j, sort_keys=True, indent=4), 'packages.json')
 
+        # writing again with a cache gives the same result, and then reuses
+        # cached entries, except for changed packages
+        cache = {}
+        for changed in [None, 'testpackage-src']:
+            if changed:
+                packages[changed].upstream_version = '9.9'
+            with io.StringIO() as jsonfile:
+                package.write_repo_json(args, packages, jsonfile, cache)
+                jc = json.loads(jsonfile.getvalue(), object_pairs_hook=collections.OrderedDict)
+                del jc['timestamp']
+                for p in jc['packages']:
+                    if p['name'] == 'testpackage':
+                        self.assertEqual(p.pop('upstream_version', None), '9.9' if changed else None)
+                self.assertEqual(j, jc)
+
+        # reports are only regenerated when something they are made from changes
+        with self.subTest('reports'):
+            cache = {}
+            reports.do_reports(args, packages, cache)
+
+            def report(m):
+                return os.path.join(args.htdocs, 'reports', reports.filenameify(m))
+
+            others = [os.path.join(args.htdocs, 'reports', fn) for fn in ['deprecated_so.html', 'perl_rebuilds.html', 'python_rebuilds.html']]
+
+            for fn in [report('Blooey McFooey'), report('Yaakov Selkowitz')] + others:
+                with open(fn, 'w') as f:
+                    print('scribble', file=f)
+
+            reports.do_reports(args, packages, cache)
+            for fn in [report('Blooey McFooey'), report('Yaakov Selkowitz')] + others:
+                with open(fn) as f:
+                    self.assertEqual(f.read(), 'scribble\n')
+
+            packages['testpackage-src'].upstream_version = '10.0'
+            reports.do_reports(args, packages, cache)
+            with open(report('Blooey McFooey')) as f:
+                self.assertIn('10.0', f.read())
+            for fn in [report('Yaakov Selkowitz')] + others:
+                with open(fn) as f:
+                    self.assertEqual(f.read(), 'scribble\n')
+
         for d in ARGDIRS:
             shutil.rmtree(getattr(args, d))
 